@@ -0,0 +1,201 @@
+#!/usr/bin/python3
+"""Performance benchmarks for libmelee
+
+These don't need Dolphin. live_stream uses a stand-in server instead. Run the whole thing, or name the benchmarks to run:
+    ./benchmark.py event_dispatch
+"""
+
+import argparse
+import base64
+import json
+import statistics
+import time
+
+import melee
+from melee.slippstream import _fast_message
+from melee.slpfilestreamer import EventType, SLPFileStreamer
+
+REPLAY = "test_artifacts/test_game_1.slp"
+
+
+def _replay_events(path):
+    """Every game event in the replay, as a list of (command, bytes)"""
+    streamer = SLPFileStreamer(path)
+    streamer.connect()
+    events = []
+    while True:
+        message = streamer.dispatch(False)
+        if message is None:
+            return events
+        if message["type"] == "game_event":
+            payload = bytes(message["payload"])
+            events.append((payload[0], payload))
+
+
+def _best_of(repeats, function):
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_event_dispatch():
+    """Cost per event of Console event handling, as messages get bigger
+
+    A linear-time dispatcher keeps the per-event cost flat no matter how many
+    events are packed into one message.
+    """
+    events = _replay_events(REPLAY)
+    prelude = b"".join(
+        payload
+        for command, payload in events
+        if command in (EventType.PAYLOADS.value, EventType.GAME_START.value)
+    )
+    frame_events = [
+        payload
+        for command, payload in events
+        if command in (EventType.PRE_FRAME.value, EventType.POST_FRAME.value)
+    ]
+
+    print("event_dispatch: events per message, microseconds per event")
+    for count in (10, 100, 1000, 10000, 50000):
+        message = b"".join(frame_events[i % len(frame_events)] for i in range(count))
+        console = melee.Console(system="file", path=REPLAY)
+        # Name mangled, since the event handler is private
+        handle = console._Console__handle_slippstream_events
+        handle(prelude, melee.GameState())
+        seconds = _best_of(5, lambda: handle(message, melee.GameState()))
+        print("  {:>6} {:>8.2f}".format(count, seconds / count * 1e6))
+
+
+def bench_decode_profile():
+    """Cost per frame of stepping through a replay, by how much gets decoded"""
+    profiles = [
+        ("1 port, position", melee.DecodeProfile(ports=[1], fields=["position"])),
+        (
+            "2 ports, 4 fields",
+            melee.DecodeProfile(
+                ports=[1, 2], fields=["position", "action", "percent", "stock"]
+            ),
+        ),
+        ("everything", None),
+    ]
+
+    def play(profile):
+        console = melee.Console(system="file", path=REPLAY, decode_profile=profile)
+        console.connect()
+        while console.step() is not None:
+            pass
+
+    console = melee.Console(system="file", path=REPLAY)
+    console.connect()
+    frames = 0
+    while console.step() is not None:
+        frames += 1
+
+    print("decode_profile: microseconds per frame")
+    for name, profile in profiles:
+        seconds = _best_of(3, lambda: play(profile))
+        print("  {:<20} {:>8.2f}".format(name, seconds / frames * 1e6))
+
+
+def bench_message_decode():
+    """Cost of getting the events out of one Dolphin message, a frame's worth each"""
+    events = _replay_events(REPLAY)
+    frames, frame = [], []
+    for command, payload in events:
+        frame.append(payload)
+        if command == EventType.FRAME_BOOKEND.value:
+            frames.append(b"".join(frame))
+            frame = []
+    messages = [
+        json.dumps(
+            {"payload": base64.b64encode(payload).decode(), "type": "game_event"},
+            separators=(",", ":"),
+        ).encode()
+        for payload in frames
+    ]
+
+    def slow():
+        for message in messages:
+            base64.b64decode(json.loads(message)["payload"])
+
+    def fast():
+        for message in messages:
+            _fast_message(message)
+
+    print("message_decode: microseconds per message")
+    for name, function in (("json + base64", slow), ("fast path", fast)):
+        seconds = _best_of(5, function)
+        print("  {:<20} {:>8.2f}".format(name, seconds / len(messages) * 1e6))
+
+
+def bench_live_stream():
+    """Decoding frames from a stand-in Dolphin over ENet on localhost
+
+    Throughput is with frames sent as fast as possible. Latency is from when the
+    server was due to send a frame to when step() returned it, at 2x real time.
+    """
+    port = 51600
+
+    def connect(server):
+        server.start()
+        console = melee.Console(
+            system="dolphin", path=None, slippi_port=port, tmp_home_directory=False
+        )
+        console.connect()
+        return console
+
+    print("live_stream:")
+    server = melee.replayserver.ReplayServer(REPLAY, port=port, speed=None)
+    console = connect(server)
+    try:
+        console.step()
+        start = time.perf_counter()
+        for _ in range(1000):
+            console.step()
+        seconds = time.perf_counter() - start
+    finally:
+        server.stop()
+        console.stop()
+    print("  {:<20} {:>8.0f}".format("frames per second", 1000 / seconds))
+
+    port += 1
+    server = melee.replayserver.ReplayServer(REPLAY, port=port, speed=2)
+    console = connect(server)
+    latencies = []
+    try:
+        for _ in range(240):
+            gamestate = console.step()
+            due = server.start_time + server.frame_offsets[gamestate.frame]
+            latencies.append(time.perf_counter() - due)
+    finally:
+        server.stop()
+        console.stop()
+    latencies.sort()
+    for name, latency in (
+        ("median latency (us)", statistics.median(latencies)),
+        ("99th percentile (us)", latencies[len(latencies) * 99 // 100]),
+    ):
+        print("  {:<20} {:>8.0f}".format(name, latency * 1e6))
+
+
+BENCHMARKS = {
+    "event_dispatch": bench_event_dispatch,
+    "decode_profile": bench_decode_profile,
+    "message_decode": bench_message_decode,
+    "live_stream": bench_live_stream,
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="libmelee benchmarks")
+    parser.add_argument(
+        "benchmarks", nargs="*", help="Benchmarks to run: " + ", ".join(BENCHMARKS)
+    )
+    args = parser.parse_args()
+    for name in args.benchmarks or BENCHMARKS:
+        if name not in BENCHMARKS:
+            parser.error("Unknown benchmark: " + name)
+        BENCHMARKS[name]()
@@ -3,9 +3,24 @@ Python3 only
 Works on Linux/OSX/Windows
 """
 
-from melee import framedata, menuhelper, stages, techskill
+from melee import (
+    capture,
+    framedata,
+    history,
+    lazystate,
+    menuhelper,
+    observation,
+    replays,
+    replayserver,
+    sharedframes,
+    stages,
+    stepstats,
+    techskill,
+)
 from melee.console import *
+from melee.consolepool import *
 from melee.controller import *
+from melee.decodeprofile import *
 from melee.enums import *
 from melee.framedata import *
 from melee.gamestate import *
@@ -0,0 +1,253 @@
+"""Capture exactly what a Console receives, and play it back later
+
+A capture file is every message the slippstream handed the Console, with the time it
+arrived, so a live session can be reproduced bit for bit: menus, dropped frames,
+odd timing and all. Play one back with Console(system="capture").
+
+The file is the 8 byte CAPTURE_MAGIC, then one record after another. Each record
+is a little endian header of the receive time (time.time(), a double), the kind of
+record (a byte) and the length of its data (4 bytes), then the data. Game and menu
+events, and frame ends, are stored as their raw bytes, and anything else as JSON.
+"""
+
+import asyncio
+import json
+import struct
+import time
+
+CAPTURE_MAGIC = b"SLPCAP\x00\x01"
+_RECORD = struct.Struct("<dBI")
+
+# Kinds of record
+_GAME_EVENT = 0
+_MENU_EVENT = 1
+_JSON_MESSAGE = 2
+# The slippstream's playedOn, timestamp, consoleNick and players, at the start
+_STREAM_INFO = 3
+# Frame ends that SLP files without bookends get, which have an empty payload
+_FRAME_END = 4
+_RAW_KINDS = {
+    "game_event": _GAME_EVENT,
+    "menu_event": _MENU_EVENT,
+    "frame_end": _FRAME_END,
+}
+_RAW_TYPES = {kind: message_type for message_type, kind in _RAW_KINDS.items()}
+
+
+def read_capture(path):
+    """Read the messages in a capture file
+
+    Args:
+        path (str): The capture file
+
+    Yields:
+        (float, dict): Each message, with the time.time() it was received
+
+    Raises:
+        ValueError: If the file isn't a capture
+    """
+    with open(path, "rb") as file:
+        contents = file.read()
+    for timestamp, kind, data in _records(contents):
+        if kind != _STREAM_INFO:
+            yield timestamp, _message(kind, data)
+
+
+def _records(contents):
+    if contents[: len(CAPTURE_MAGIC)] != CAPTURE_MAGIC:
+        raise ValueError("Not a capture file")
+    view = memoryview(contents)
+    index = len(CAPTURE_MAGIC)
+    # A record cut short means the capture was cut short. Stop there
+    while index + _RECORD.size <= len(contents):
+        timestamp, kind, length = _RECORD.unpack_from(contents, index)
+        index += _RECORD.size
+        if index + length > len(contents):
+            return
+        yield timestamp, kind, view[index : index + length]
+        index += length
+
+
+def _message(kind, data):
+    if kind in _RAW_TYPES:
+        return {"type": _RAW_TYPES[kind], "payload": data}
+    return json.loads(bytes(data))
+
+
+class CaptureRecorder:
+    """Wraps a slippstream, appending every message it receives to a capture file
+
+    Everything else is passed straight through to the slippstream.
+    """
+
+    def __init__(self, stream, path):
+        """Create a recorder
+
+        Args:
+            stream: The SlippstreamClient or SLPFileStreamer to record
+            path (str): Capture file to append to. Made if it doesn't exist
+        """
+        self._stream = stream
+        self._file = open(path, "ab")
+        if self._file.tell() == 0:
+            self._file.write(CAPTURE_MAGIC)
+        self._info_written = False
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+    def dispatch(self, polling_mode):
+        message = self._stream.dispatch(polling_mode)
+        if message:
+            self.record(message)
+        return message
+
+    async def dispatch_async(self, polling_mode):
+        message = await self._stream.dispatch_async(polling_mode)
+        if message:
+            self.record(message)
+        return message
+
+    def record(self, message):
+        """Append a message to the capture, stamped with the time now"""
+        timestamp = time.time()
+        if not self._info_written:
+            # The metadata is known once connected, which it is by the first message
+            stream = self._stream
+            info = {
+                "playedOn": stream.playedOn,
+                "timestamp": stream.timestamp,
+                "consoleNick": stream.consoleNick,
+                "players": stream.players,
+            }
+            self._write(timestamp, _STREAM_INFO, json.dumps(info).encode())
+            self._info_written = True
+        kind = _RAW_KINDS.get(message["type"])
+        payload = message.get("payload")
+        # Payloads still in base64 are kept as they are, in JSON
+        if kind is None or isinstance(payload, str):
+            self._write(timestamp, _JSON_MESSAGE, json.dumps(message).encode())
+        else:
+            self._write(timestamp, kind, payload)
+
+    def _write(self, timestamp, kind, data):
+        self._file.write(_RECORD.pack(timestamp, kind, len(data)))
+        self._file.write(data)
+
+    def close(self):
+        """Finish writing the capture. Done by Console.stop()"""
+        if not self._file.closed:
+            self._file.close()
+
+    def shutdown(self):
+        self.close()
+        return self._stream.shutdown()
+
+
+class CaptureStreamer:
+    """Plays back a capture file, standing in for the slippstream it was made from"""
+
+    def __init__(self, path, realtime=False):
+        """Create a capture streamer
+
+        Args:
+            path (str): The capture file
+            realtime (bool): Hand messages out with the same time between them as
+                when they were captured. Otherwise they're all available at once.
+        """
+        self.path = path
+        self.realtime = realtime
+        self.playedOn = "dolphin"
+        self.timestamp = ""
+        self.consoleNick = ""
+        self.players = {}
+        self._records = None
+        # The next record, once it's been read but not handed out
+        self._pending = None
+        # perf_counter() at the first message, and its time.time() in the capture
+        self._start = None
+        self._first_timestamp = None
+
+    def connect(self):
+        """Read the capture in
+
+        Returns:
+            True on success, False if it isn't a capture file
+        """
+        try:
+            with open(self.path, "rb") as file:
+                contents = file.read()
+            records = list(_records(contents))
+        except (OSError, ValueError):
+            return False
+        self._records = iter(records)
+        for _, kind, data in records:
+            if kind == _STREAM_INFO:
+                info = json.loads(bytes(data))
+                self.playedOn = info["playedOn"]
+                self.timestamp = info["timestamp"]
+                self.consoleNick = info["consoleNick"]
+                self.players = info["players"]
+                break
+        return True
+
+    async def connect_async(self):
+        return self.connect()
+
+    def shutdown(self):
+        self._records = None
+        return False
+
+    def dispatch(self, polling_mode):
+        """Take the next captured message
+
+        Args:
+            polling_mode (bool): Only matters in realtime. Return None straight away
+                if the next message isn't due yet, rather than waiting for it.
+
+        Returns:
+            dict: The message, or None at the end of the capture
+        """
+        delay = self._next_delay()
+        if delay is None:
+            return None
+        if delay > 0:
+            if polling_mode:
+                return None
+            time.sleep(delay)
+        return self._take()
+
+    async def dispatch_async(self, polling_mode):
+        delay = self._next_delay()
+        if delay is None:
+            return None
+        if delay > 0:
+            if polling_mode:
+                return None
+            await asyncio.sleep(delay)
+        return self._take()
+
+    def _next_delay(self):
+        """How long until the next message is due, or None if there isn't one"""
+        if self._pending is None:
+            if self._records is None:
+                return None
+            for record in self._records:
+                if record[1] != _STREAM_INFO:
+                    self._pending = record
+                    break
+            else:
+                self._records = None
+                return None
+        if not self.realtime:
+            return 0
+        timestamp = self._pending[0]
+        if self._start is None:
+            self._start = time.perf_counter()
+            self._first_timestamp = timestamp
+        return self._start + (timestamp - self._first_timestamp) - time.perf_counter()
+
+    def _take(self):
+        _, kind, data = self._pending
+        self._pending = None
+        return _message(kind, data)
@@ -7,15 +7,16 @@ is your method to start and stop Dolphin, set configs, and get the latest GameSt
 import base64
 import configparser
 import csv
-import math
+import functools
 import os
 import platform
 import shutil
 import stat
 import subprocess
 import tempfile
+import threading
 import time
-from collections import defaultdict
+from collections import defaultdict, deque
 from pathlib import Path
 from typing import Optional
 
@@ -23,10 +24,26 @@ import numpy as np
 from packaging import version
 
 from melee import enums, stages
+from melee.capture import CaptureRecorder, CaptureStreamer
+from melee.decodeprofile import DecodeProfile
 from melee.enums import Action
-from melee.gamestate import GameState, PlayerState, Projectile
-from melee.slippstream import EventType, SlippstreamClient
-from melee.slpfilestreamer import SLPFileStreamer
+from melee.events import (
+    GAME_START_DECODER,
+    GAME_START_PLAYER_DECODER,
+    GAME_START_PLAYER_FIELDS,
+    GAME_START_PLAYER_STRIDE,
+    FRAME_NUMBER,
+    ITEM_UPDATE_DECODER,
+    PAYLOAD_ENTRY,
+)
+from melee.framequeue import FrameQueue
+from melee.gamestate import GameState, _distance
+from melee.history import GameStateHistory
+from melee.lazystate import LazyGameState, LazyPlayerState
+from melee.sharedframes import FramePublisher
+from melee.slippstream import AsyncSlippstreamClient, EventType, SlippstreamClient
+from melee.slpfilestreamer import SLPFileStreamer, read_payload_sizes
+from melee.stepstats import STAGES, StepStats
 
 
 class SlippiVersionTooLow(Exception):
@@ -43,6 +60,56 @@ class InvalidDolphinPath(Exception):
         self.message = message
 
 
+# How long the background receiver waits for data before checking if it should stop
+RECEIVER_WAIT = 0.1
+# How long stop() waits for the background receiver to finish
+RECEIVER_STOP_TIMEOUT = 2
+
+# Stages of StepStats that the Console times itself
+_FLUSH_STAGE = STAGES.index("flush")
+_FINISH_STAGE = STAGES.index("finish")
+
+# What catch-up mode decodes of the frames it skips. Later frames depend on them
+_SKIPPED_FRAME_FIELDS = frozenset(("invulnerability_left", "moonwalkwarning"))
+
+
+def _timed(function, stats, index, within=None):
+    """Wrap a function so the time it takes is added to a stage of stats
+
+    Args:
+        within (int): A stage that the time is part of, to take it away from
+    """
+    add = stats.add
+    perf_counter = time.perf_counter
+
+    def timed(*args):
+        start = perf_counter()
+        try:
+            return function(*args)
+        finally:
+            elapsed = perf_counter() - start
+            add(index, elapsed)
+            if within is not None:
+                add(within, -elapsed)
+
+    return timed
+
+
+def _timed_async(function, stats, index):
+    """_timed(), for a coroutine function"""
+    add = stats.add
+    perf_counter = time.perf_counter
+
+    async def timed(*args):
+        start = perf_counter()
+        try:
+            return await function(*args)
+        finally:
+            add(index, perf_counter() - start)
+
+    return timed
+
+
 def _ignore_fifos(src, names):
     fifos = []
     for name in names:
@@ -72,6 +139,39 @@ def _default_home_path(path: str) -> str:
     raise FileNotFoundError("Could not find dolphin home directory.")
 
 
+@functools.lru_cache(maxsize=None)
+def _load_melee_data():
+    """Read the CSV data that Consoles use to fix up melee's values
+
+    This only happens once per process, and is then shared by every Console.
+
+    Returns:
+        (dict, dict): The set of zero-indexed actions for each character, and the
+            character data for each character
+    """
+    path = os.path.dirname(os.path.realpath(__file__))
+    with open(path + "/actiondata.csv") as csvfile:
+        # A list of dicts containing the frame data
+        actiondata = list(csv.DictReader(csvfile))
+        # Dict of sets
+        zero_indices = defaultdict(set)
+        for line in actiondata:
+            if line["zeroindex"] == "True":
+                zero_indices[int(line["character"])].add(int(line["action"]))
+
+    # Read the character data csv
+    characterdata = dict()
+    with open(path + "/characterdata.csv") as csvfile:
+        reader = csv.DictReader(csvfile)
+        for line in reader:
+            del line["Character"]
+            # Convert all fields to numbers
+            for key, value in line.items():
+                line[key] = float(value)
+            characterdata[enums.Character(line["CharacterIndex"])] = line
+    return zero_indices, characterdata
+
+
 # pylint: disable=too-many-instance-attributes
 class Console:
     """The console object that represents your Dolphin / GameCube / SLP file"""
@@ -96,6 +196,19 @@ class Console:
         disable_audio=False,
         overclock: Optional[float] = None,
         save_replays=True,
+        follow_file=False,
+        decode_profile=None,
+        background_receiver=False,
+        frame_queue_size=8,
+        frame_queue_policy="block",
+        catch_up=False,
+        capture_path=None,
+        capture_realtime=False,
+        stats=False,
+        publish=None,
+        reuse_gamestates=0,
+        lazy=False,
+        history=0,
     ):
         """Create a Console object
 
@@ -103,7 +216,7 @@ class Console:
             path (str): Path to the directory where your dolphin executable is located.
                 If None, will assume the dolphin is remote and won't try to configure it.
             dolphin_home_path (str): Path to dolphin user directory. Optional.
-            system (string): One of "dolphin", "file", or "gamecube"
+            system (string): One of "dolphin", "file", "gamecube", or "capture"
             tmp_home_directory (bool): Use a temporary directory for the dolphin User path
                 This is useful so instances don't interfere with each other.
             copy_home_directory (bool): Copy an existing home directory on the system.
@@ -127,6 +240,59 @@ class Console:
             disable_audio (bool): Turn off sound.
             overclock (bool): Overclock the dolphin CPU.
             save_replays (bool): Save slippi replays.
+            follow_file (bool): For the "file" system, follow an SLP file that is
+                still being written, such as a replay Dolphin is saving on another
+                machine. step() waits for each frame to be written, or returns None
+                straight away in polling_mode. The game ends at the GAME_END event.
+            decode_profile (DecodeProfile): Only decode these ports and fields. The
+                rest are left out of the GameState. None decodes everything.
+            background_receiver (bool): Receive and decode frames on a background
+                thread, into a queue that step() takes them from. Time spent between
+                steps then doesn't hold up the connection. Not for use with
+                step_async().
+            frame_queue_size (int): Most frames the background receiver will queue
+            frame_queue_policy (str): What the background receiver does when the
+                queue is full. "block" waits for room, "drop_oldest" throws away the
+                oldest frame, and "latest" only ever keeps the newest frame. See
+                dropped_frames and late_frames.
+            catch_up (bool): For when the bot can't keep up with the game. Each
+                step() takes every message that has already arrived and only fully
+                decodes the newest complete frame. Frames in between only get the
+                fields needed to keep invulnerability_left and moonwalkwarning right,
+                and are counted in skipped_frames. Reading a whole SLP file, that's
+                everything up to the end of the game.
+            capture_path (str): Append every message received to this capture file,
+                with when it arrived. Play it back with the "capture" system, and
+                the capture file as path. See melee.capture.
+            capture_realtime (bool): For the "capture" system, play the capture back
+                with the same timing as it was captured. Otherwise it goes as fast as
+                it can be read.
+            stats (bool): Time each stage of every step(), into console.stats. Off,
+                it costs nothing. Can't be used with background_receiver, which
+                decodes frames away from step().
+            publish (str): Publish every frame step() returns to shared memory of
+                this name, for FrameSubscribers in other processes to read. True
+                picks a name. See console.publisher and melee.sharedframes. Needs
+                Python 3.8 or later.
+            reuse_gamestates (int): Cycle through this many GameStates, and the
+                players and projectiles in them, overwriting them in place rather
+                than making new ones every frame. 0 makes new ones. The GameState
+                step() returns belongs to the console: it's overwritten once this
+                many more frames have been decoded (skipped frames count, in
+                catch_up), so use GameState.copy() to keep one for longer. At least
+                2, and can't be used with background_receiver.
+            lazy (bool): Only work out each PlayerState attribute, and the
+                GameState's distance, the first time it's read. Faster when only a
+                few fields get used. See melee.lazystate. Can't be used with
+                reuse_gamestates.
+            history (int): Keep this many of the most recent frames step() returned
+                in console.history, as numpy arrays. 0 keeps none. See
+                melee.history.
+
+        Raises:
+            ValueError: If stats is combined with background_receiver, or
+                reuse_gamestates with lazy or background_receiver, or
+                reuse_gamestates is 1
         """
         self.logger = logger
         self.system = system
@@ -147,6 +313,49 @@ class Console:
         self.slippi_port = slippi_port
         """(int): UDP port of slippi server. Default 51441"""
         self.eventsize = [0] * 0x100
+        # Jump table of event handlers, indexed by command byte
+        self._event_handlers = [None] * 0x100
+        self._event_handlers[EventType.PAYLOADS.value] = self.__payloads
+        self._event_handlers[EventType.GAME_START.value] = self.__game_start
+        self._lazy = lazy
+        if lazy:
+            self._event_handlers[EventType.PRE_FRAME.value] = self.__lazy_pre_frame
+            self._event_handlers[EventType.POST_FRAME.value] = self.__lazy_post_frame
+        else:
+            self._event_handlers[EventType.PRE_FRAME.value] = self.__pre_frame
+            self._event_handlers[EventType.POST_FRAME.value] = self.__post_frame
+        self._event_handlers[EventType.GAME_END.value] = self.__game_end
+        self._event_handlers[EventType.FRAME_START.value] = self.__skip_event
+        self._event_handlers[EventType.ITEM_UPDATE.value] = self.__item_update
+        self._event_handlers[EventType.FRAME_BOOKEND.value] = self.__frame_bookend
+        self._event_handlers[EventType.GECKO_CODES.value] = self.__skip_event
+        self.publisher = None
+        """(FramePublisher): Where frames are published, if publish is set"""
+        if publish:
+            self.publisher = FramePublisher(None if publish is True else publish)
+        if stats and background_receiver:
+            # The receiver's timings would land on whichever frame step() was on
+            raise ValueError("Step stats can't be used with a background receiver")
+        self.stats = StepStats() if stats else None
+        """(StepStats): Where the time goes in each step(), if stats is on"""
+        self.history = GameStateHistory(history) if history else None
+        """(GameStateHistory): The last frames step() returned, if history is set"""
+        self._decode_profile = decode_profile or DecodeProfile()
+        # The profile frames are being decoded with right now
+        self._profile = None
+        self.__use_profile(self._decode_profile)
+        # Frames that catch-up mode skips only need what later frames depend on
+        self._skip_profile = DecodeProfile(
+            ports=self._decode_profile.ports,
+            fields=self._decode_profile.fields & _SKIPPED_FRAME_FIELDS,
+            nana=self._decode_profile.nana,
+            projectiles=False,
+        )
+        self._catch_up = catch_up
+        # Messages received in catch-up mode that haven't been handled yet
+        self._pending_messages = deque()
+        self.skipped_frames = 0
+        """(int): Frames catch-up mode skipped over to get to the newest one"""
         self.connected = False
         self.nick = ""
         """(str): The nickname the console has given itself."""
@@ -180,50 +389,119 @@ class Console:
         self._prev_gamestate = GameState()
         # Half-completed gamestate not yet ready to add to the list
         self._temp_gamestate = None
+        # The gamestates to cycle through, if they're reused
+        self._gamestate_pool = None
+        self._pool_index = 0
+        if reuse_gamestates:
+            if lazy:
+                raise ValueError("Lazy gamestates can't be reused")
+            if reuse_gamestates < 2:
+                raise ValueError("Reusing gamestates needs at least 2")
+            if background_receiver:
+                raise ValueError(
+                    "Gamestates can't be reused with a background receiver"
+                )
+            self._gamestate_pool = [
+                GameState._pooled() for _ in range(reuse_gamestates)
+            ]
         self._process = None
-        assert self.system in ["dolphin", "gamecube", "file"]
+        self._frame_queue = None
+        if background_receiver:
+            self._frame_queue = FrameQueue(frame_queue_size, frame_queue_policy)
+        self._receiver = None
+        self._receiver_error = None
+        assert self.system in ["dolphin", "gamecube", "file", "capture"]
         if self.system == "dolphin":
-            self._slippstream = SlippstreamClient(
+            self._slippstream = AsyncSlippstreamClient(
                 self.slippi_address, self.slippi_port, True
             )
             if self.path:
                 self._setup_home_directory()
         elif self.system == "gamecube":
-            self._slippstream = SlippstreamClient(
+            self._slippstream = AsyncSlippstreamClient(
                 self.slippi_address, self.slippi_port, False
             )
+        elif self.system == "capture":
+            self._slippstream = CaptureStreamer(self.path, realtime=capture_realtime)
         else:
-            self._slippstream = SLPFileStreamer(self.path)
+            self._slippstream = SLPFileStreamer(self.path, follow=follow_file)
+        if self.stats is not None:
+            self.__instrument()
+        self._capture = None
+        if capture_path is not None:
+            self._capture = CaptureRecorder(self._slippstream, capture_path)
+            self._slippstream = self._capture
 
         # Prepare some structures for fixing melee data
-        path = os.path.dirname(os.path.realpath(__file__))
-        with open(path + "/actiondata.csv") as csvfile:
-            # A list of dicts containing the frame data
-            actiondata = list(csv.DictReader(csvfile))
-            # Dict of sets
-            self.zero_indices = defaultdict(set)
-            for line in actiondata:
-                if line["zeroindex"] == "True":
-                    self.zero_indices[int(line["character"])].add(int(line["action"]))
-
-        # Read the character data csv
-        self.characterdata = dict()
-        with open(path + "/characterdata.csv") as csvfile:
-            reader = csv.DictReader(csvfile)
-            for line in reader:
-                del line["Character"]
-                # Convert all fields to numbers
-                for key, value in line.items():
-                    line[key] = float(value)
-                self.characterdata[enums.Character(line["CharacterIndex"])] = line
+        self.zero_indices, self.characterdata = _load_melee_data()
 
     def connect(self):
         """Connects to the Slippi server (dolphin or gamecube).
 
+        Starts the background receiver, if there is one.
+
+        Returns:
+            True is successful, False otherwise
+        """
+        if not self._slippstream.connect():
+            return False
+        if self._frame_queue is not None and self._receiver is None:
+            self._receiver = threading.Thread(
+                target=self.__receive_loop, name="libmelee receiver", daemon=True
+            )
+            self._receiver.start()
+        return True
+
+    async def connect_async(self):
+        """connect(), for use with asyncio. Needed before step_async()
+
         Returns:
             True is successful, False otherwise
         """
-        return self._slippstream.connect()
+        return await self._slippstream.connect_async()
+
+    def build_index(self, sidecar_path=None):
+        """Index where each frame starts in the SLP file, for seek()
+
+        Only for SLP files. You don't have to call this, seek() will build the index
+        if it needs one. But it lets you keep the index in a sidecar file, so
+        repeated runs over the same file don't have to scan it again.
+
+        Args:
+            sidecar_path (str): Index file to load if it matches the replay, or to
+                save the new index to otherwise.
+        """
+        assert self.system == "file", "Only SLP files can be indexed"
+        self._slippstream.build_index(sidecar_path)
+
+    def seek(self, frame):
+        """Jump to the given frame of an SLP file
+
+        The next step() will return that frame. Only for SLP files, and only after
+        connect().
+
+        Note:
+            Helpers that track state across frames (invulnerability_left,
+            moonwalkwarning) start over from the frame you seek to.
+
+        Args:
+            frame (int): Frame number to jump to
+
+        Raises:
+            ValueError: If the replay has no such frame
+        """
+        assert self.system == "file", "Only SLP files can seek"
+        self._slippstream.seek(frame)
+        # Make sure we've seen the game start info, in case this is the first thing
+        #   that's done with the file
+        self.__handle_slippstream_events(self._slippstream.prelude(), GameState())
+        self._frame = frame - 1
+        self._temp_gamestate = None
+        self._pending_messages.clear()
+        self._prev_gamestate = GameState()
+        self._invuln_start = {1: (0, 0), 2: (0, 0), 3: (0, 0), 4: (0, 0)}
+        if self.history is not None:
+            self.history.clear()
 
     def _get_dolphin_home_path(self):
         """Return the path to dolphin's home directory"""
@@ -303,6 +581,10 @@ class Console:
         For Dolphin instances, this will kill the dolphin process.
         For gamecubes and SLP files, it just shuts down our connection
         """
+        if self._receiver is not None:
+            self._frame_queue.close()
+            self._receiver.join(RECEIVER_STOP_TIMEOUT)
+            self._receiver = None
         if self.path:
             self.connected = False
             self._slippstream.shutdown()
@@ -311,6 +593,11 @@ class Console:
                 self._process.terminate()
                 self._process = None
 
+        if self._capture is not None:
+            self._capture.close()
+        if self.publisher is not None:
+            self.publisher.close()
+
         if self.temp_dir:
             shutil.rmtree(self.temp_dir)
             self.temp_dir = None
@@ -443,63 +730,355 @@ class Console:
 
         Returns:
             GameState object that represents new current state of the game"""
+        self.flush()
+        return self.__next_frame(self._polling_mode)
+
+    def poll(self):
+        """Take the next frame if it has arrived, without waiting for it
+
+        Unlike step(), this doesn't flush the controllers first. It's for driving
+        many consoles from one loop, as ConsolePool does: call flush() once a frame
+        has been dealt with, then poll() until the next one turns up.
+
+        Returns:
+            GameState: The next frame, or None if it isn't here yet
+        """
+        return self.__next_frame(True)
+
+    def flush(self):
+        """Flush all controllers, sending them to the console
+
+        step() does this for you."""
         self.processingtime = time.time() - self._frametimestamp
 
-        # Flush the controllers
+        stats = self.stats
+        if stats is not None:
+            start = time.perf_counter()
         for controller in self.controllers:
             controller.flush()
+        if stats is not None:
+            stats.add(_FLUSH_STAGE, time.perf_counter() - start)
+
+    def fileno(self):
+        """The file descriptor of the socket frames arrive on, for select()
+
+        Only for Dolphin and GameCube, once connected."""
+        return self._slippstream.fileno()
+
+    def __next_frame(self, polling_mode):
+        if self._frame_queue is not None:
+            gamestate = self._frame_queue.get(block=not polling_mode)
+            if gamestate is None and self._receiver_error is not None:
+                raise self._receiver_error
+        else:
+            gamestate = self.__receive(polling_mode)
+        if gamestate is not None:
+            # Start the processing timer now that we're done reading messages
+            self._frametimestamp = time.time()
+            self.__hand_out(gamestate)
+        return gamestate
 
+    def __hand_out(self, gamestate):
+        """Keep track of a frame that's being returned to the caller
+
+        This is on the caller's thread, after the background receiver (if there is
+        one) has handed the frame over, so it only sees the frames that are
+        returned, in order.
+        """
+        if self.publisher is not None:
+            self.publisher.publish(gamestate)
+        if self.history is not None:
+            self.history.append(gamestate)
+
+    async def step_async(self):
+        """step(), for use with asyncio
+
+        Waiting for the next frame yields to the event loop rather than blocking, so
+        one thread can run many consoles alongside other async work. Connect with
+        connect_async() first.
+
+        Returns:
+            GameState object that represents new current state of the game"""
+        assert self._frame_queue is None, "step_async() can't use a background receiver"
+        self.flush()
         if self._temp_gamestate is None:
-            self._temp_gamestate = GameState()
+            self._temp_gamestate = self.__new_gamestate()
+        if self._catch_up:
+            gamestate = None
+            while gamestate is None:
+                frames = self.__drain()
+                if frames > 0:
+                    gamestate = self.__decode_latest(frames)
+                    continue
+                message = await self._slippstream.dispatch_async(self._polling_mode)
+                if not message:
+                    return None
+                self._pending_messages.append(message)
+        else:
+            frame_ended = False
+            while not frame_ended:
+                message = await self._slippstream.dispatch_async(self._polling_mode)
+                if not message:
+                    return None
+                frame_ended = self.__handle_message(message)
+            gamestate = self.__finish_step()
+        self._frametimestamp = time.time()
+        self.__hand_out(gamestate)
+        return gamestate
+
+    @property
+    def dropped_frames(self):
+        """(int): Frames the background receiver threw away because the queue was full"""
+        return 0 if self._frame_queue is None else self._frame_queue.dropped
+
+    @property
+    def late_frames(self):
+        """(int): Frames step() returned when a newer one was already waiting"""
+        return 0 if self._frame_queue is None else self._frame_queue.late
 
+    def __receive(self, polling_mode):
+        """Read messages until a whole frame has been decoded
+
+        Returns:
+            GameState: The frame, or None if there are no more messages for now
+        """
+        if self._temp_gamestate is None:
+            self._temp_gamestate = self.__new_gamestate()
+        if self._catch_up:
+            return self.__receive_latest(polling_mode)
         frame_ended = False
         while not frame_ended:
-            message = self._slippstream.dispatch(self._polling_mode)
-            if message:
-                if message["type"] == "connect_reply":
-                    self.connected = True
-                    self.nick = message["nick"]
-                    self.version = message["version"]
-                    self.cursor = message["cursor"]
-
-                elif message["type"] == "game_event":
-                    if len(message["payload"]) > 0:
-                        if self.system == "dolphin":
-                            frame_ended = self.__handle_slippstream_events(
-                                base64.b64decode(message["payload"]),
-                                self._temp_gamestate,
-                            )
-                        else:
-                            frame_ended = self.__handle_slippstream_events(
-                                message["payload"], self._temp_gamestate
-                            )
-
-                elif message["type"] == "menu_event":
-                    if len(message["payload"]) > 0:
-                        if self.system == "dolphin":
-                            self.__handle_slippstream_menu_event(
-                                base64.b64decode(message["payload"]),
-                                self._temp_gamestate,
-                            )
-                        else:
-                            self.__handle_slippstream_menu_event(
-                                message["payload"], self._temp_gamestate
-                            )
-                        frame_ended = True
-
-                elif (
-                    self._use_manual_bookends
-                    and message["type"] == "frame_end"
-                    and self._frame != -10000
-                ):
-                    frame_ended = True
-            else:
+            message = self._slippstream.dispatch(polling_mode)
+            if not message:
+                return None
+            frame_ended = self.__handle_message(message)
+        return self.__finish_step()
+
+    def __receive_latest(self, polling_mode):
+        """__receive() for catch-up mode. Decodes only the newest complete frame"""
+        while True:
+            frames = self.__drain()
+            if frames > 0:
+                gamestate = self.__decode_latest(frames)
+                if gamestate is not None:
+                    return gamestate
+                continue
+            message = self._slippstream.dispatch(polling_mode)
+            if not message:
                 return None
+            self._pending_messages.append(message)
+
+    def __drain(self):
+        """Queue up every message that has already arrived
+
+        Returns:
+            int: How many frames the queued messages complete
+        """
+        pending = self._pending_messages
+        message = self._slippstream.dispatch(True)
+        while message:
+            pending.append(message)
+            message = self._slippstream.dispatch(True)
+        return self.__count_frames(pending)
+
+    def __count_frames(self, messages):
+        """Count the frames a list of messages would complete, without decoding them
+
+        Follows __handle_message() and the event handlers, but only looks at the
+        command bytes and frame numbers.
+        """
+        eventsize = self.eventsize
+        manual_bookends = self._use_manual_bookends
+        last_frame = self._frame
+        frames = 0
+        for message in messages:
+            payload = message["payload"]
+            if message["type"] == "menu_event":
+                frames += len(payload) > 0
+            elif message["type"] == "frame_end":
+                # Ignored until the first frame of the game, as by __handle_message()
+                frames += manual_bookends and last_frame != -10000
+            elif message["type"] == "game_event":
+                if isinstance(payload, str):
+                    payload = message["payload"] = base64.b64decode(payload)
+                offset = 0
+                while offset < len(payload):
+                    command = payload[offset]
+                    if command == 0x00:
+                        frames += 1
+                        break
+                    if command == EventType.FRAME_BOOKEND.value:
+                        # Rolled back frames don't count
+                        frame = FRAME_NUMBER.unpack_from(payload, offset + 1)[0]
+                        if frame > last_frame:
+                            frames += 1
+                            last_frame = frame
+                        break
+                    if command == EventType.GAME_END.value and manual_bookends:
+                        frames += 1
+                        break
+                    if command == EventType.PAYLOADS.value:
+                        # A new game. Don't touch the sizes until it's handled
+                        eventsize = list(eventsize)
+                        offset += read_payload_sizes(payload, offset, eventsize)
+                        continue
+                    if command == EventType.GAME_START.value:
+                        last_frame = -10000
+                        manual_bookends = self._allow_old_version and (
+                            payload[offset + 1] < 3
+                        )
+                    elif manual_bookends and command in (
+                        EventType.PRE_FRAME.value,
+                        EventType.POST_FRAME.value,
+                    ):
+                        # Without bookends, the frame handlers keep track of _frame
+                        last_frame = FRAME_NUMBER.unpack_from(payload, offset + 1)[0]
+                    if eventsize[command] == 0:
+                        break
+                    offset += eventsize[command]
+        return frames
+
+    def __decode_latest(self, frames):
+        """Handle the pending messages, up to the end of the last of their frames
+
+        Every frame but the last is decoded with the skip profile and thrown away.
+
+        Returns:
+            GameState: The last frame, or None if the messages ran out first
+        """
+        pending = self._pending_messages
+        skipped = 0
+        try:
+            while pending:
+                if skipped < frames - 1:
+                    self.__use_profile(self._skip_profile)
+                else:
+                    self.__use_profile(self._decode_profile)
+                if self.__handle_message(pending.popleft()):
+                    if skipped == frames - 1:
+                        return self.__finish_step()
+                    skipped += 1
+                    self.skipped_frames += 1
+                    self._temp_gamestate = self.__new_gamestate()
+        finally:
+            self.__use_profile(self._decode_profile)
+        return None
+
+    def __new_gamestate(self):
+        """A blank GameState for the next frame. The next one in the pool, if they're
+        reused"""
+        pool = self._gamestate_pool
+        if pool is None:
+            return LazyGameState() if self._lazy else GameState()
+        gamestate = pool[self._pool_index]
+        self._pool_index = (self._pool_index + 1) % len(pool)
+        gamestate._recycle()
+        return gamestate
+
+    def __use_profile(self, profile):
+        """Decode frames with this DecodeProfile from now on"""
+        self._profile = profile
+        item_handler = self.__item_update if profile.projectiles else self.__skip_event
+        if self.stats is not None:
+            item_handler = _timed(
+                item_handler, self.stats, self.stats.index("item_update")
+            )
+        self._event_handlers[EventType.ITEM_UPDATE.value] = item_handler
+
+    def __instrument(self):
+        """Wrap the event handlers and the slippstream in timers, for stats"""
+        stats = self.stats
+        handlers = self._event_handlers
+        for event in EventType:
+            # ITEM_UPDATE is already timed, by __use_profile()
+            if handlers[event.value] is not None and event != EventType.ITEM_UPDATE:
+                handlers[event.value] = _timed(
+                    handlers[event.value], stats, stats.index(event.name.lower())
+                )
+        stream = self._slippstream
+        wait = stats.index("wait")
+        stream.dispatch = _timed(stream.dispatch, stats, wait)
+        stream.dispatch_async = _timed_async(stream.dispatch_async, stats, wait)
+        # Dolphin's messages are decoded while dispatching, so don't count that as
+        #   waiting
+        if isinstance(stream, SlippstreamClient):
+            stream._handle_enet_event = _timed(
+                stream._handle_enet_event, stats, stats.index("decode"), within=wait
+            )
+
+    def __receive_loop(self):
+        """The background receiver. Owns the slippstream until the console stops"""
+        queue = self._frame_queue
+        # Poll the network so that this thread notices when it's time to stop
+        polling = self.system not in ("file", "capture")
+        try:
+            while not queue.closed:
+                if self.system == "gamecube" and not self._slippstream.wait(
+                    RECEIVER_WAIT
+                ):
+                    continue
+                gamestate = self.__receive(polling)
+                if gamestate is not None:
+                    queue.put(gamestate)
+                elif self.system in ("file", "capture"):
+                    break
+                elif self.system == "dolphin":
+                    self._slippstream.wait(RECEIVER_WAIT)
+        # Hand anything that goes wrong over to step()
+        except Exception as error:  # pylint: disable=broad-except
+            self._receiver_error = error
+        finally:
+            queue.close()
+
+    def __handle_message(self, message):
+        """Apply one message from the slippstream to the gamestate being built
+
+        Returns:
+            bool: Whether the message completed a frame
+        """
+        frame_ended = False
+        if message["type"] == "connect_reply":
+            self.connected = True
+            self.nick = message["nick"]
+            self.version = message["version"]
+            self.cursor = message["cursor"]
+
+        elif message["type"] == "game_event":
+            payload = message["payload"]
+            if len(payload) > 0:
+                # Dolphin sends base64, unless the client already decoded it
+                if isinstance(payload, str):
+                    payload = base64.b64decode(payload)
+                frame_ended = self.__handle_slippstream_events(
+                    payload, self._temp_gamestate
+                )
 
+        elif message["type"] == "menu_event":
+            payload = message["payload"]
+            if len(payload) > 0:
+                if isinstance(payload, str):
+                    payload = base64.b64decode(payload)
+                self.__handle_slippstream_menu_event(payload, self._temp_gamestate)
+                frame_ended = True
+
+        elif (
+            self._use_manual_bookends
+            and message["type"] == "frame_end"
+            and self._frame != -10000
+        ):
+            frame_ended = True
+        return frame_ended
+
+    def __finish_step(self):
+        stats = self.stats
+        if stats is not None:
+            start = time.perf_counter()
         gamestate = self._temp_gamestate
         self._temp_gamestate = None
-        self.__fixframeindexing(gamestate)
-        self.__fixiasa(gamestate)
+        # Lazy states fix these up when they're read
+        if not self._lazy:
+            self.__fixframeindexing(gamestate)
+            self.__fixiasa(gamestate)
         # Insert some metadata into the gamestate
         gamestate.playedOn = self._slippstream.playedOn
         gamestate.startAt = self._slippstream.timestamp
@@ -514,482 +1093,411 @@ class Console:
             except KeyError:
                 pass
 
-        # Start the processing timer now that we're done reading messages
-        self._frametimestamp = time.time()
+        if stats is not None:
+            stats.add(_FINISH_STAGE, time.perf_counter() - start)
+            stats.end_frame()
         return gamestate
 
     def __handle_slippstream_events(self, event_bytes, gamestate):
-        """Handle a series of events, provided sequentially in a byte array"""
+        """Handle a series of events, provided sequentially in a byte array
+
+        Walks the buffer with an offset rather than slicing it, so handling a message
+        is linear in its size.
+        """
         gamestate.menu_state = enums.Menu.IN_GAME
-        while len(event_bytes) > 0:
+        handlers = self._event_handlers
+        eventsize = self.eventsize
+        end = len(event_bytes)
+        offset = 0
+        while offset < end:
+            command = event_bytes[offset]
             # A null message type means that the rest of the data is padding
-            if event_bytes[0] == 0x00:
+            if command == 0x00:
                 return True
-            event_size = self.eventsize[event_bytes[0]]
-            if len(event_bytes) < event_size:
+            handler = handlers[command]
+            if handler is None:
                 print(
-                    "WARNING: Something went wrong unpacking events. Data is probably missing"
+                    "WARNING: Something went wrong unpacking events. "
+                    + "Data is probably missing"
                 )
-                print("\tDidn't have enough data for event")
+                print("\tGot invalid event type: ", command)
                 return False
-            if EventType(event_bytes[0]) == EventType.PAYLOADS:
-                cursor = 0x2
-                payload_size = event_bytes[1]
-                num_commands = (payload_size - 1) // 3
-                for i in range(0, num_commands):
-                    command = np.ndarray((1,), ">B", event_bytes, cursor)[0]
-                    command_len = np.ndarray((1,), ">H", event_bytes, cursor + 0x1)[0]
-                    self.eventsize[command] = command_len + 1
-                    cursor += 3
-                event_bytes = event_bytes[payload_size + 1 :]
-
-            elif EventType(event_bytes[0]) == EventType.FRAME_START:
-                event_bytes = event_bytes[event_size:]
-
-            elif EventType(event_bytes[0]) == EventType.GAME_START:
-                self.__game_start(gamestate, event_bytes)
-                event_bytes = event_bytes[event_size:]
-                # The game needs to know what to press on the first frame of the game
-                #   Just give it empty input. Characters are not actionable anyway.
-                for controller in self.controllers:
-                    controller.release_all()
-                    controller.flush()
-
-            elif EventType(event_bytes[0]) == EventType.GAME_END:
-                event_bytes = event_bytes[event_size:]
-                return self._use_manual_bookends
-
-            elif EventType(event_bytes[0]) == EventType.PRE_FRAME:
-                self.__pre_frame(gamestate, event_bytes)
-                event_bytes = event_bytes[event_size:]
-
-            elif EventType(event_bytes[0]) == EventType.POST_FRAME:
-                self.__post_frame(gamestate, event_bytes)
-                event_bytes = event_bytes[event_size:]
-
-            elif EventType(event_bytes[0]) == EventType.GECKO_CODES:
-                event_bytes = event_bytes[event_size:]
-
-            elif EventType(event_bytes[0]) == EventType.FRAME_BOOKEND:
-                self.__frame_bookend(gamestate, event_bytes)
-                event_bytes = event_bytes[event_size:]
-                # If this is an old frame, then don't return it.
-                if gamestate.frame <= self._frame:
-                    return False
-                self._frame = gamestate.frame
-                return True
-
-            elif EventType(event_bytes[0]) == EventType.ITEM_UPDATE:
-                self.__item_update(gamestate, event_bytes)
-                event_bytes = event_bytes[event_size:]
-
-            else:
+            event_size = eventsize[command]
+            if end - offset < event_size:
                 print(
-                    "WARNING: Something went wrong unpacking events. "
-                    + "Data is probably missing"
+                    "WARNING: Something went wrong unpacking events. Data is probably missing"
                 )
-                print("\tGot invalid event type: ", event_bytes[0])
+                print("\tDidn't have enough data for event")
                 return False
+            # Handlers return None to keep going, or whether the frame ended
+            frame_ended = handler(gamestate, event_bytes, offset, event_size)
+            if frame_ended is not None:
+                return frame_ended
+            # PAYLOADS sets its own size, so look it up again
+            offset += eventsize[command]
         return False
 
-    def __game_start(self, gamestate, event_bytes):
+    def __payloads(self, gamestate, event_bytes, offset, event_size):
+        payload_size = event_bytes[offset + 1]
+        num_commands = (payload_size - 1) // 3
+        for cursor in range(offset + 2, offset + 2 + (3 * num_commands), 3):
+            command, command_len = PAYLOAD_ENTRY.unpack_from(event_bytes, cursor)
+            self.eventsize[command] = command_len + 1
+        self.eventsize[EventType.PAYLOADS.value] = payload_size + 1
+
+    def __skip_event(self, gamestate, event_bytes, offset, event_size):
+        pass
+
+    def __game_end(self, gamestate, event_bytes, offset, event_size):
+        return self._use_manual_bookends
+
+    def __game_start(self, gamestate, event_bytes, offset, event_size):
         self._frame = -10000
-        major = np.ndarray((1,), ">B", event_bytes, 0x1)[0]
-        minor = np.ndarray((1,), ">B", event_bytes, 0x2)[0]
-        version_num = np.ndarray((1,), ">B", event_bytes, 0x3)[0]
-        self.slp_version = str(major) + "." + str(minor) + "." + str(version_num)
+        start = GAME_START_DECODER.decode(event_bytes, offset, event_size)
+        self.slp_version = (
+            str(start.major) + "." + str(start.minor) + "." + str(start.build)
+        )
         self._use_manual_bookends = self._allow_old_version and (
             version.parse(self.slp_version) < version.parse("3.0.0")
         )
-        if major < 3 and not self._allow_old_version:
+        if start.major < 3 and not self._allow_old_version:
             raise SlippiVersionTooLow(self.slp_version)
         try:
-            self._current_stage = enums.to_internal_stage(
-                np.ndarray((1,), ">H", event_bytes, 0x13)[0]
-            )
+            self._current_stage = enums.to_internal_stage(start.stage)
         except ValueError:
             self._current_stage = enums.Stage.NO_STAGE
 
-        self._is_teams = not (np.ndarray((1,), ">H", event_bytes, 0xD)[0] == 0)
-
-        for i in range(4):
-            self._costumes[i] = np.ndarray((1,), ">B", event_bytes, 0x68 + (0x24 * i))[
-                0
-            ]
-
-        for i in range(4):
-            self._cpu_level[i] = np.ndarray((1,), ">B", event_bytes, 0x74 + (0x24 * i))[
-                0
-            ]
-
-        for i in range(4):
-            self._team_id[i] = np.ndarray((1,), ">B", event_bytes, 0x6E + (0x24 * i))[0]
+        self._is_teams = not (start.is_teams == 0)
 
         for i in range(4):
-            if np.ndarray((1,), ">B", event_bytes, 0x66 + (0x24 * i))[0] != 1:
+            block = GAME_START_PLAYER_FIELDS[0][1] + (GAME_START_PLAYER_STRIDE * i)
+            player = GAME_START_PLAYER_DECODER.decode(
+                event_bytes, offset + block, event_size - block
+            )
+            self._costumes[i] = player.costume
+            self._cpu_level[i] = player.cpu_level
+            self._team_id[i] = player.team_id
+            if player.player_type != 1:
                 self._cpu_level[i] = 0
 
-    def __pre_frame(self, gamestate, event_bytes):
-        # Grab the physical controller state and put that into the controller state
-        controller_port = np.ndarray((1,), ">B", event_bytes, 0x5)[0] + 1
+        # The game needs to know what to press on the first frame of the game
+        #   Just give it empty input. Characters are not actionable anyway.
+        for controller in self.controllers:
+            controller.release_all()
+            controller.flush()
+
+    def __pre_frame(self, gamestate, event_bytes, offset, event_size):
+        profile = self._profile
+        controller_port = event_bytes[offset + 0x5] + 1
+        is_nana = event_bytes[offset + 0x6] == 1
+        if not profile.wants(controller_port, is_nana):
+            return
+        pre = profile.pre_frame_decoder.decode(event_bytes, offset, event_size)
 
         if controller_port not in gamestate.players:
-            gamestate.players[controller_port] = PlayerState()
+            gamestate.players[controller_port] = gamestate._new_player(controller_port)
         playerstate = gamestate.players[controller_port]
 
         # Is this Nana?
-        if np.ndarray((1,), ">B", event_bytes, 0x6)[0] == 1:
-            playerstate.nana = PlayerState()
+        if is_nana:
+            playerstate.nana = gamestate._new_player(-controller_port, playerstate.nana)
             playerstate = playerstate.nana
 
         playerstate.costume = self._costumes[controller_port - 1]
         playerstate.cpu_level = self._cpu_level[controller_port - 1]
         playerstate.team_id = self._team_id[controller_port - 1]
 
-        main_x = (np.ndarray((1,), ">f", event_bytes, 0x19)[0] / 2) + 0.5
-        main_y = (np.ndarray((1,), ">f", event_bytes, 0x1D)[0] / 2) + 0.5
-        playerstate.controller_state.main_stick = (main_x, main_y)
-
-        c_x = (np.ndarray((1,), ">f", event_bytes, 0x21)[0] / 2) + 0.5
-        c_y = (np.ndarray((1,), ">f", event_bytes, 0x25)[0] / 2) + 0.5
-        playerstate.controller_state.c_stick = (c_x, c_y)
-
-        raw_main_x = 0
-        raw_main_y = 0
-        try:
-            raw_main_x = int(np.ndarray((1,), ">b", event_bytes, 0x3B)[0])
-        except TypeError:
-            pass
-        try:
-            raw_main_y = int(np.ndarray((1,), ">b", event_bytes, 0x40)[0])
-        except TypeError:
-            pass
-        playerstate.controller_state.raw_main_stick = (raw_main_x, raw_main_y)
+        # Grab the physical controller state and put that into the controller state
+        if "controller_state" in profile.fields:
+            controller_state = playerstate.controller_state
+            controller_state.main_stick = (
+                (pre.main_stick_x / 2) + 0.5,
+                (pre.main_stick_y / 2) + 0.5,
+            )
+            controller_state.c_stick = (
+                (pre.c_stick_x / 2) + 0.5,
+                (pre.c_stick_y / 2) + 0.5,
+            )
+            controller_state.raw_main_stick = (
+                pre.raw_main_stick_x,
+                pre.raw_main_stick_y,
+            )
 
-        # The game interprets both shoulders together, so the processed value will always be the same
-        trigger = np.ndarray((1,), ">f", event_bytes, 0x29)[0]
-        playerstate.controller_state.l_shoulder = trigger
-        playerstate.controller_state.r_shoulder = trigger
+            # The game interprets both shoulders together, so the processed value will always be the same
+            controller_state.l_shoulder = pre.trigger
+            controller_state.r_shoulder = pre.trigger
 
-        buttonbits = np.ndarray((1,), ">H", event_bytes, 0x31)[0]
-        playerstate.controller_state.button[enums.Button.BUTTON_A] = bool(
-            int(buttonbits) & 0x0100
-        )
-        playerstate.controller_state.button[enums.Button.BUTTON_B] = bool(
-            int(buttonbits) & 0x0200
-        )
-        playerstate.controller_state.button[enums.Button.BUTTON_X] = bool(
-            int(buttonbits) & 0x0400
-        )
-        playerstate.controller_state.button[enums.Button.BUTTON_Y] = bool(
-            int(buttonbits) & 0x0800
-        )
-        playerstate.controller_state.button[enums.Button.BUTTON_START] = bool(
-            int(buttonbits) & 0x1000
-        )
-        playerstate.controller_state.button[enums.Button.BUTTON_Z] = bool(
-            int(buttonbits) & 0x0010
-        )
-        playerstate.controller_state.button[enums.Button.BUTTON_R] = bool(
-            int(buttonbits) & 0x0020
-        )
-        playerstate.controller_state.button[enums.Button.BUTTON_L] = bool(
-            int(buttonbits) & 0x0040
-        )
-        playerstate.controller_state.button[enums.Button.BUTTON_D_LEFT] = bool(
-            int(buttonbits) & 0x0001
-        )
-        playerstate.controller_state.button[enums.Button.BUTTON_D_RIGHT] = bool(
-            int(buttonbits) & 0x0002
-        )
-        playerstate.controller_state.button[enums.Button.BUTTON_D_DOWN] = bool(
-            int(buttonbits) & 0x0004
-        )
-        playerstate.controller_state.button[enums.Button.BUTTON_D_UP] = bool(
-            int(buttonbits) & 0x0008
-        )
+            controller_state.buttons = pre.buttons
         if self._use_manual_bookends:
             self._frame = gamestate.frame
 
-    def __post_frame(self, gamestate, event_bytes):
+    def __post_frame(self, gamestate, event_bytes, offset, event_size):
+        profile = self._profile
+        fields = profile.fields
+        controller_port = event_bytes[offset + 0x5] + 1
+        is_nana = event_bytes[offset + 0x6] == 1
+        if not profile.wants(controller_port, is_nana):
+            return
+        post = profile.post_frame_decoder.decode(event_bytes, offset, event_size)
         gamestate.stage = self._current_stage
         gamestate.is_teams = self._is_teams
-        gamestate.frame = np.ndarray((1,), ">i", event_bytes, 0x1)[0]
-        controller_port = np.ndarray((1,), ">B", event_bytes, 0x5)[0] + 1
+        gamestate.frame = post.frame
 
         if controller_port not in gamestate.players:
-            gamestate.players[controller_port] = PlayerState()
+            gamestate.players[controller_port] = gamestate._new_player(controller_port)
         playerstate = gamestate.players[controller_port]
 
         # Is this Nana?
-        if np.ndarray((1,), ">B", event_bytes, 0x6)[0] == 1:
-            playerstate.nana = PlayerState()
+        if is_nana:
+            playerstate.nana = gamestate._new_player(-controller_port, playerstate.nana)
             playerstate = playerstate.nana
 
-        playerstate.position.x = np.ndarray((1,), ">f", event_bytes, 0xA)[0]
-        playerstate.position.y = np.ndarray((1,), ">f", event_bytes, 0xE)[0]
+        if "position" in fields:
+            playerstate.position.x = post.x
+            playerstate.position.y = post.y
 
-        playerstate.x = playerstate.position.x
-        playerstate.y = playerstate.position.y
+            playerstate.x = playerstate.position.x
+            playerstate.y = playerstate.position.y
 
-        playerstate.character = enums.Character(
-            np.ndarray((1,), ">B", event_bytes, 0x7)[0]
-        )
-        try:
-            playerstate.action = enums.Action(
-                np.ndarray((1,), ">H", event_bytes, 0x8)[0]
-            )
-        except ValueError:
-            playerstate.action = enums.Action.UNKNOWN_ANIMATION
+        if "character" in fields:
+            playerstate.character = enums.Character(post.character)
+        if "action" in fields:
+            try:
+                playerstate.action = enums.Action(post.action)
+            except ValueError:
+                playerstate.action = enums.Action.UNKNOWN_ANIMATION
 
         # Melee stores this in a float for no good reason. So we have to convert
-        playerstate.facing = np.ndarray((1,), ">f", event_bytes, 0x12)[0] > 0
-
-        playerstate.percent = int(np.ndarray((1,), ">f", event_bytes, 0x16)[0])
-        playerstate.shield_strength = np.ndarray((1,), ">f", event_bytes, 0x1A)[0]
-        playerstate.stock = np.ndarray((1,), ">B", event_bytes, 0x21)[0]
-        playerstate.action_frame = int(np.ndarray((1,), ">f", event_bytes, 0x22)[0])
-
-        try:
-            sb4 = int(np.ndarray((1,), ">B", event_bytes, 0x29)[0])
-            playerstate.is_powershield = (sb4 & 0x20) == 0x20
-        except TypeError:
-            playerstate.is_powershield = False
-
-        try:
-            playerstate.hitstun_frames_left = int(
-                np.ndarray((1,), ">f", event_bytes, 0x2B)[0]
-            )
-        except TypeError:
-            playerstate.hitstun_frames_left = 0
-        except ValueError:
-            playerstate.hitstun_frames_left = 0
-        try:
-            playerstate.on_ground = not bool(
-                np.ndarray((1,), ">B", event_bytes, 0x2F)[0]
-            )
-        except TypeError:
-            playerstate.on_ground = True
-        try:
-            playerstate.jumps_left = np.ndarray((1,), ">B", event_bytes, 0x32)[0]
-        except TypeError:
-            playerstate.jumps_left = 1
+        if "facing" in fields:
+            playerstate.facing = post.facing > 0
+
+        if "percent" in fields:
+            playerstate.percent = int(post.percent)
+        if "shield_strength" in fields:
+            playerstate.shield_strength = post.shield_strength
+        if "stock" in fields:
+            playerstate.stock = post.stock
+        if "action_frame" in fields:
+            playerstate.action_frame = int(post.action_frame)
+        if "is_powershield" in fields:
+            playerstate.is_powershield = (post.state_flags_4 & 0x20) == 0x20
+
+        if "hitstun_frames_left" in fields:
+            try:
+                playerstate.hitstun_frames_left = int(post.hitstun_frames_left)
+            except ValueError:
+                playerstate.hitstun_frames_left = 0
+        if "on_ground" in fields:
+            playerstate.on_ground = not bool(post.airborne)
+        if "jumps_left" in fields:
+            playerstate.jumps_left = post.jumps_left
+        if "invulnerable" in fields:
+            playerstate.invulnerable = post.hurtbox_status != 0
+
+        if "speed" in fields:
+            playerstate.speed_air_x_self = post.speed_air_x_self
+            playerstate.speed_y_self = post.speed_y_self
+            playerstate.speed_x_attack = post.speed_x_attack
+            playerstate.speed_y_attack = post.speed_y_attack
+            playerstate.speed_ground_x_self = post.speed_ground_x_self
+        if "hitlag_left" in fields:
+            playerstate.hitlag_left = int(post.hitlag_left)
 
-        try:
-            playerstate.invulnerable = (
-                int(np.ndarray((1,), ">B", event_bytes, 0x34)[0]) != 0
+        # Keep track of a player's invulnerability due to respawn or ledge grab
+        if "invulnerability_left" in fields:
+            playerstate.invulnerability_left = self.__track_invulnerability(
+                controller_port,
+                gamestate.frame,
+                playerstate.action,
+                playerstate.action_frame,
+                playerstate.invulnerability_left,
             )
-        except TypeError:
-            playerstate.invulnerable = False
-
-        try:
-            playerstate.speed_air_x_self = np.ndarray((1,), ">f", event_bytes, 0x35)[0]
-        except TypeError:
-            playerstate.speed_air_x_self = 0
+            if playerstate.invulnerability_left > 0 and "invulnerable" in fields:
+                playerstate.invulnerable = True
+
+        if "moonwalkwarning" in fields:
+            # The pre-warning occurs when we first start a dash dance.
+            if controller_port in self._prev_gamestate.players:
+                if (
+                    playerstate.action == Action.DASHING
+                    and self._prev_gamestate.players[controller_port].action
+                    not in [Action.DASHING, Action.TURNING]
+                ):
+                    playerstate.moonwalkwarning = True
 
-        try:
-            playerstate.speed_y_self = np.ndarray((1,), ">f", event_bytes, 0x39)[0]
-        except TypeError:
-            playerstate.speed_y_self = 0
+            # Take off the warning if the player does an action other than dashing
+            if playerstate.action != Action.DASHING:
+                playerstate.moonwalkwarning = False
 
-        try:
-            playerstate.speed_x_attack = np.ndarray((1,), ">f", event_bytes, 0x3D)[0]
-        except TypeError:
-            playerstate.speed_x_attack = 0
+        # "off_stage" helper
+        if "off_stage" in fields:
+            try:
+                if (
+                    abs(playerstate.position.x)
+                    > stages.EDGE_GROUND_POSITION[gamestate.stage]
+                    or playerstate.y < -6
+                ) and not playerstate.on_ground:
+                    playerstate.off_stage = True
+                else:
+                    playerstate.off_stage = False
+            except KeyError:
+                playerstate.off_stage = False
 
-        try:
-            playerstate.speed_y_attack = np.ndarray((1,), ">f", event_bytes, 0x41)[0]
-        except TypeError:
-            playerstate.speed_y_attack = 0
+        if "ecb" in fields:
+            playerstate.ecb.top.x = post.ecb_top_x
+            playerstate.ecb.top.y = post.ecb_top_y
+            playerstate.ecb_top = (post.ecb_top_x, post.ecb_top_y)
+            playerstate.ecb.bottom.x = post.ecb_bottom_x
+            playerstate.ecb.bottom.y = post.ecb_bottom_y
+            playerstate.ecb_bottom = (post.ecb_bottom_x, post.ecb_bottom_y)
+            playerstate.ecb.left.x = post.ecb_left_x
+            playerstate.ecb.left.y = post.ecb_left_y
+            playerstate.ecb_left = (post.ecb_left_x, post.ecb_left_y)
+            playerstate.ecb.right.x = post.ecb_right_x
+            playerstate.ecb.right.y = post.ecb_right_y
+            playerstate.ecb_right = (post.ecb_right_x, post.ecb_right_y)
+        if self._use_manual_bookends:
+            self._frame = gamestate.frame
 
-        try:
-            playerstate.speed_ground_x_self = np.ndarray((1,), ">f", event_bytes, 0x45)[
-                0
-            ]
-        except TypeError:
-            playerstate.speed_ground_x_self = 0
+        # FoD platform heights
+        if "fod_platforms" in fields:
+            gamestate._fod_platform_left = post.fod_platform_left
+            gamestate._fod_platform_right = post.fod_platform_right
 
-        try:
-            playerstate.hitlag_left = int(np.ndarray((1,), ">f", event_bytes, 0x49)[0])
-        except TypeError:
-            playerstate.hitlag_left = 0
+    def __track_invulnerability(
+        self, controller_port, frame, action, action_frame, invulnerability_left
+    ):
+        """Keep track of a player's invulnerability due to respawn or ledge grab
 
-        # Keep track of a player's invulnerability due to respawn or ledge grab
+        Returns:
+            int: The player's invulnerability_left, given its value so far
+        """
         if controller_port in self._prev_gamestate.players:
-            playerstate.invulnerability_left = max(
+            invulnerability_left = max(
                 0,
                 self._invuln_start[controller_port][1]
-                - (gamestate.frame - self._invuln_start[controller_port][0]),
+                - (frame - self._invuln_start[controller_port][0]),
             )
-        if playerstate.action == Action.ON_HALO_WAIT:
-            playerstate.invulnerability_left = 120
-            self._invuln_start[controller_port] = (gamestate.frame, 120)
+        if action == Action.ON_HALO_WAIT:
+            invulnerability_left = 120
+            self._invuln_start[controller_port] = (frame, 120)
         # Don't give invulnerability to the first descent
-        if playerstate.action == Action.ON_HALO_DESCENT and gamestate.frame > 150:
-            playerstate.invulnerability_left = 120
-            self._invuln_start[controller_port] = (gamestate.frame, 120)
-        if playerstate.action == Action.EDGE_CATCHING and playerstate.action_frame == 1:
-            playerstate.invulnerability_left = 36
-            self._invuln_start[controller_port] = (gamestate.frame, 36)
+        if action == Action.ON_HALO_DESCENT and frame > 150:
+            invulnerability_left = 120
+            self._invuln_start[controller_port] = (frame, 120)
+        if action == Action.EDGE_CATCHING and action_frame == 1:
+            invulnerability_left = 36
+            self._invuln_start[controller_port] = (frame, 36)
         # First frame of the game
-        if gamestate.frame == -123:
-            playerstate.invulnerability_left = 0
-            self._invuln_start[controller_port] = (gamestate.frame, 0)
-
-        if playerstate.invulnerability_left > 0:
-            playerstate.invulnerable = True
-
-        # The pre-warning occurs when we first start a dash dance.
-        if controller_port in self._prev_gamestate.players:
-            if playerstate.action == Action.DASHING and self._prev_gamestate.players[
-                controller_port
-            ].action not in [Action.DASHING, Action.TURNING]:
-                playerstate.moonwalkwarning = True
+        if frame == -123:
+            invulnerability_left = 0
+            self._invuln_start[controller_port] = (frame, 0)
+        return invulnerability_left
+
+    def __lazy_pre_frame(self, gamestate, event_bytes, offset, event_size):
+        """__pre_frame(), for lazy mode. Keeps the event for the player to decode"""
+        profile = self._profile
+        controller_port = event_bytes[offset + 0x5] + 1
+        is_nana = event_bytes[offset + 0x6] == 1
+        if not profile.wants(controller_port, is_nana):
+            return
+        pre = profile.pre_frame_decoder.decode(event_bytes, offset, event_size)
+
+        playerstate = gamestate.players.get(controller_port)
+        if playerstate is None:
+            playerstate = LazyPlayerState(profile.fields, False, self.zero_indices)
+            gamestate.players[controller_port] = playerstate
+        if is_nana:
+            playerstate.nana = LazyPlayerState(profile.fields, True, self.zero_indices)
+            playerstate = playerstate.nana
 
-        # Take off the warning if the player does an action other than dashing
-        if playerstate.action != Action.DASHING:
-            playerstate.moonwalkwarning = False
+        playerstate.costume = self._costumes[controller_port - 1]
+        playerstate.cpu_level = self._cpu_level[controller_port - 1]
+        playerstate.team_id = self._team_id[controller_port - 1]
+        playerstate.set_pre_frame(pre)
+        if self._use_manual_bookends:
+            self._frame = gamestate.frame
 
-        # "off_stage" helper
-        try:
-            if (
-                abs(playerstate.position.x)
-                > stages.EDGE_GROUND_POSITION[gamestate.stage]
-                or playerstate.y < -6
-            ) and not playerstate.on_ground:
-                playerstate.off_stage = True
-            else:
-                playerstate.off_stage = False
-        except KeyError:
-            playerstate.off_stage = False
+    def __lazy_post_frame(self, gamestate, event_bytes, offset, event_size):
+        """__post_frame(), for lazy mode. Keeps the event for the player to decode"""
+        profile = self._profile
+        fields = profile.fields
+        controller_port = event_bytes[offset + 0x5] + 1
+        is_nana = event_bytes[offset + 0x6] == 1
+        if not profile.wants(controller_port, is_nana):
+            return
+        post = profile.post_frame_decoder.decode(event_bytes, offset, event_size)
+        gamestate.stage = self._current_stage
+        gamestate.is_teams = self._is_teams
+        gamestate.frame = post.frame
+
+        playerstate = gamestate.players.get(controller_port)
+        if playerstate is None:
+            playerstate = LazyPlayerState(fields, False, self.zero_indices)
+            gamestate.players[controller_port] = playerstate
+        if is_nana:
+            playerstate.nana = LazyPlayerState(fields, True, self.zero_indices)
+            playerstate = playerstate.nana
 
-        # ECB top edge, x
-        ecb_top_x = 0
-        ecb_top_y = 0
-        try:
-            ecb_top_x = np.ndarray((1,), ">f", event_bytes, 0x51)[0]
-        except TypeError:
-            ecb_top_x = 0
-        # ECB Top edge, y
-        try:
-            ecb_top_y = np.ndarray((1,), ">f", event_bytes, 0x55)[0]
-        except TypeError:
-            ecb_top_y = 0
-        playerstate.ecb.top.x = ecb_top_x
-        playerstate.ecb.top.y = ecb_top_y
-        playerstate.ecb_top = (ecb_top_x, ecb_top_y)
-
-        # ECB bottom edge, x coord
-        ecb_bot_x = 0
-        ecb_bot_y = 0
-        try:
-            ecb_bot_x = np.ndarray((1,), ">f", event_bytes, 0x59)[0]
-        except TypeError:
-            ecb_bot_x = 0
-        # ECB Bottom edge, y coord
-        try:
-            ecb_bot_y = np.ndarray((1,), ">f", event_bytes, 0x5D)[0]
-        except TypeError:
-            ecb_bot_y = 0
-        playerstate.ecb.bottom.x = ecb_bot_x
-        playerstate.ecb.bottom.y = ecb_bot_y
-        playerstate.ecb_bottom = (ecb_bot_x, ecb_bot_y)
-
-        # ECB left edge, x coord
-        ecb_left_x = 0
-        ecb_left_y = 0
-        try:
-            ecb_left_x = np.ndarray((1,), ">f", event_bytes, 0x61)[0]
-        except TypeError:
-            ecb_left_x = 0
-        # ECB left edge, y coord
-        try:
-            ecb_left_y = np.ndarray((1,), ">f", event_bytes, 0x65)[0]
-        except TypeError:
-            ecb_left_y = 0
-        playerstate.ecb.left.x = ecb_left_x
-        playerstate.ecb.left.y = ecb_left_y
-        playerstate.ecb_left = (ecb_left_x, ecb_left_y)
-
-        # ECB right edge, x coord
-        ecb_right_x = 0
-        ecb_right_y = 0
-        try:
-            ecb_right_x = np.ndarray((1,), ">f", event_bytes, 0x69)[0]
-        except TypeError:
-            ecb_right_x = 0
-        # ECB right edge, y coord
-        try:
-            ecb_right_y = np.ndarray((1,), ">f", event_bytes, 0x6D)[0]
-        except TypeError:
-            ecb_right_y = 0
-        playerstate.ecb.right.x = ecb_right_x
-        playerstate.ecb.right.y = ecb_right_y
-        playerstate.ecb_right = (ecb_right_x, ecb_right_y)
+        prev_player = None
+        if "moonwalkwarning" in fields:
+            prev_player = self._prev_gamestate.players.get(controller_port)
+        playerstate.set_post_frame(post, gamestate.stage, prev_player)
+        # This has to be kept up to date every frame, so it can't wait
+        if "invulnerability_left" in fields:
+            playerstate.invulnerability_left = self.__track_invulnerability(
+                controller_port,
+                gamestate.frame,
+                playerstate.action,
+                int(post.action_frame),
+                playerstate.invulnerability_left,
+            )
         if self._use_manual_bookends:
             self._frame = gamestate.frame
 
-        # FoD platform heights
-        try:
-            gamestate._fod_platform_left = np.ndarray((1,), ">f", event_bytes, 0x71)[0]
-        except TypeError:
-            gamestate._fod_platform_left = 0
-        try:
-            gamestate._fod_platform_right = np.ndarray((1,), ">f", event_bytes, 0x75)[0]
-        except TypeError:
-            gamestate._fod_platform_right = 0
+        if "fod_platforms" in fields:
+            gamestate._fod_platform_left = post.fod_platform_left
+            gamestate._fod_platform_right = post.fod_platform_right
 
-    def __frame_bookend(self, gamestate, event_bytes):
+    def __frame_bookend(self, gamestate, event_bytes, offset, event_size):
         self._prev_gamestate = gamestate
-        # Calculate helper distance variable
-        #   This is a bit kludgey.... :/
-        i = 0
-        player_one_x, player_one_y, player_two_x, player_two_y = 0, 0, 0, 0
-        for _, player_state in gamestate.players.items():
-            if i == 0:
-                player_one_x, player_one_y = (
-                    player_state.position.x,
-                    player_state.position.y,
-                )
-            if i == 1:
-                player_two_x, player_two_y = (
-                    player_state.position.x,
-                    player_state.position.y,
-                )
-            i += 1
-        xdist = player_one_x - player_two_x
-        ydist = player_one_y - player_two_y
-        gamestate.distance = math.sqrt((xdist**2) + (ydist**2))
-
-    def __item_update(self, gamestate, event_bytes):
-        projectile = Projectile()
-        projectile.position.x = np.ndarray((1,), ">f", event_bytes, 0x14)[0]
-        projectile.position.y = np.ndarray((1,), ">f", event_bytes, 0x18)[0]
+        if self._lazy:
+            # Distance is worked out when it's read
+            gamestate._ended = True
+        else:
+            gamestate.distance = _distance(gamestate.players)
+
+        # If this is an old frame, then don't return it.
+        if gamestate.frame <= self._frame:
+            return False
+        self._frame = gamestate.frame
+        return True
+
+    def __item_update(self, gamestate, event_bytes, offset, event_size):
+        item = ITEM_UPDATE_DECODER.decode(event_bytes, offset, event_size)
+        projectile = gamestate._new_projectile()
+        projectile.position.x = item.x
+        projectile.position.y = item.y
         projectile.x = projectile.position.x
         projectile.y = projectile.position.y
-        projectile.speed.x = np.ndarray((1,), ">f", event_bytes, 0xC)[0]
-        projectile.speed.y = np.ndarray((1,), ">f", event_bytes, 0x10)[0]
+        projectile.speed.x = item.speed_x
+        projectile.speed.y = item.speed_y
         projectile.x_speed = projectile.speed.x
         projectile.y_speed = projectile.speed.y
-        try:
-            projectile.owner = np.ndarray((1,), ">B", event_bytes, 0x2A)[0] + 1
-            if projectile.owner > 4:
-                projectile.owner = -1
-        except TypeError:
+        projectile.owner = item.owner + 1
+        if projectile.owner > 4:
             projectile.owner = -1
         try:
-            projectile.type = enums.ProjectileType(
-                np.ndarray((1,), ">H", event_bytes, 0x5)[0]
-            )
+            projectile.type = enums.ProjectileType(item.type)
         except ValueError:
             projectile.type = enums.ProjectileType.UNKNOWN_PROJECTILE
 
         try:
-            projectile.frame = int(np.ndarray((1,), ">f", event_bytes, 0x1E)[0])
+            projectile.frame = int(item.expiration_timer)
         except ValueError:
             projectile.frame = -1
 
-        projectile.subtype = np.ndarray((1,), ">B", event_bytes, 0x7)[0]
+        projectile.subtype = item.subtype
 
         # Ignore exploded Samus bombs. They are subtype 3
         if (
@@ -1022,26 +1530,26 @@ class Console:
         if scene == 0x02:
             gamestate.menu_state = enums.Menu.CHARACTER_SELECT
             # All the controller ports are active on this screen
-            gamestate.players[1] = PlayerState()
-            gamestate.players[2] = PlayerState()
-            gamestate.players[3] = PlayerState()
-            gamestate.players[4] = PlayerState()
+            gamestate.players[1] = gamestate._new_player(1)
+            gamestate.players[2] = gamestate._new_player(2)
+            gamestate.players[3] = gamestate._new_player(3)
+            gamestate.players[4] = gamestate._new_player(4)
         elif scene in [0x0102, 0x0108]:
             gamestate.menu_state = enums.Menu.STAGE_SELECT
-            gamestate.players[1] = PlayerState()
-            gamestate.players[2] = PlayerState()
-            gamestate.players[3] = PlayerState()
-            gamestate.players[4] = PlayerState()
+            gamestate.players[1] = gamestate._new_player(1)
+            gamestate.players[2] = gamestate._new_player(2)
+            gamestate.players[3] = gamestate._new_player(3)
+            gamestate.players[4] = gamestate._new_player(4)
         elif scene == 0x0202:
             gamestate.menu_state = enums.Menu.IN_GAME
         elif scene == 0x0001:
             gamestate.menu_state = enums.Menu.MAIN_MENU
         elif scene == 0x0008:
             gamestate.menu_state = enums.Menu.SLIPPI_ONLINE_CSS
-            gamestate.players[1] = PlayerState()
-            gamestate.players[2] = PlayerState()
-            gamestate.players[3] = PlayerState()
-            gamestate.players[4] = PlayerState()
+            gamestate.players[1] = gamestate._new_player(1)
+            gamestate.players[2] = gamestate._new_player(2)
+            gamestate.players[3] = gamestate._new_player(3)
+            gamestate.players[4] = gamestate._new_player(4)
         elif scene == 0x0000:
             gamestate.menu_state = enums.Menu.PRESS_START
         elif scene == 0x0402:
@@ -1238,6 +1746,9 @@ class Console:
     def __fixframeindexing(self, gamestate):
         """Melee's indexing of action frames is wildly inconsistent.
         Here we adjust all of the frames to be indexed at 1 (so math is easier)"""
+        # Frames that weren't decoded stay at their default
+        if "action_frame" not in self._profile.fields:
+            return
         for _, player in gamestate.players.items():
             if player.action.value in self.zero_indices[player.character.value]:
                 player.action_frame = player.action_frame + 1
@@ -0,0 +1,124 @@
+"""Drive many Dolphin consoles from one process
+
+Console.step() blocks until its next frame, so running several games at once would
+otherwise need a thread or process per console. A ConsolePool waits on all of their
+connections together instead, and hands back whichever frames are ready.
+"""
+
+import selectors
+import time
+
+from melee.console import Console
+from melee.slippstream import SERVICE_INTERVAL
+
+
+class ConsolePool:
+    """A set of Dolphin consoles, stepped together
+
+    Each console gets its own slippi_port, counting up from the first one, and (by
+    default) its own temporary home directory. step() returns a batch of frames
+    from every console that has one ready, so that a single process can, say, run
+    inference for all of the games at once.
+    """
+
+    def __init__(self, count, slippi_port=51441, **kwargs):
+        """Create a pool of consoles
+
+        Args:
+            count (int): How many consoles
+            slippi_port (int): Slippi port of the first console. The rest follow on
+                from it
+            **kwargs: Passed on to every Console. Only the "dolphin" system can be
+                pooled, and background_receiver isn't supported.
+        """
+        assert count > 0, "A console pool needs at least one console"
+        assert (
+            kwargs.get("system", "dolphin") == "dolphin"
+        ), "Only Dolphin can be pooled"
+        assert not kwargs.get(
+            "background_receiver"
+        ), "Pooled consoles can't use a background receiver"
+        self.consoles = [
+            Console(slippi_port=slippi_port + i, **kwargs) for i in range(count)
+        ]
+        """(list of Console): The consoles. step() uses their index in here"""
+        self._selector = selectors.DefaultSelector()
+        # Consoles whose last frame has been handed out, and so are due a flush
+        self._stepped = set(range(count))
+
+    def __len__(self):
+        return len(self.consoles)
+
+    def __getitem__(self, index):
+        return self.consoles[index]
+
+    def run(self, *args, **kwargs):
+        """Run every console's Dolphin. Takes the same arguments as Console.run()"""
+        for console in self.consoles:
+            console.run(*args, **kwargs)
+
+    def connect(self):
+        """Connect to every console
+
+        Returns:
+            True if they all connected, False otherwise
+        """
+        for console in self.consoles:
+            if not console.connect():
+                return False
+            self._selector.register(console, selectors.EVENT_READ)
+        return True
+
+    def stop(self):
+        """Stop every console"""
+        for console in self.consoles:
+            try:
+                self._selector.unregister(console)
+            except KeyError:
+                # Never connected
+                pass
+            console.stop()
+
+    def step(self, timeout=None, min_frames=1):
+        """Flush the controllers of the consoles stepped last time, then wait for frames
+
+        Each console gives at most one frame per step. Consoles without one are
+        left to catch up on a later step, and their controllers aren't flushed until
+        their frame has been handed out.
+
+        Args:
+            timeout (float): Longest to wait, in seconds. None waits for as long as
+                it takes to get min_frames
+            min_frames (int): How many consoles need a frame before returning. None
+                waits for all of them
+
+        Returns:
+            dict: The GameState of each console with a frame ready, by its index in
+                consoles. Empty if the timeout ran out first
+        """
+        for index in self._stepped:
+            self.consoles[index].flush()
+        if min_frames is None:
+            min_frames = len(self.consoles)
+        min_frames = min(min_frames, len(self.consoles))
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        frames = {}
+        while True:
+            for index, console in enumerate(self.consoles):
+                if index not in frames:
+                    gamestate = console.poll()
+                    if gamestate is not None:
+                        frames[index] = gamestate
+            if len(frames) >= min_frames:
+                break
+            # Wake up now and then regardless, so ENet can keep the connections alive
+            wait = SERVICE_INTERVAL
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                wait = min(wait, remaining)
+            self._selector.select(wait)
+        self._stepped = set(frames)
+        return frames
@@ -1,11 +1,11 @@
-""" Defines a Clontroller class that manages pressing buttons for your console"""
+"""Defines a Clontroller class that manages pressing buttons for your console"""
 
-import copy
 import platform
 import sys
 import time
 from cmath import e
-from struct import pack
+from collections.abc import MutableMapping
+from struct import Struct
 
 import serial
 
@@ -17,27 +17,78 @@ except ImportError:
 
 from melee import enums
 
+BUTTON_BITS = {
+    enums.Button.BUTTON_A: 0x0100,
+    enums.Button.BUTTON_B: 0x0200,
+    enums.Button.BUTTON_X: 0x0400,
+    enums.Button.BUTTON_Y: 0x0800,
+    enums.Button.BUTTON_Z: 0x0010,
+    enums.Button.BUTTON_L: 0x0040,
+    enums.Button.BUTTON_R: 0x0020,
+    enums.Button.BUTTON_START: 0x1000,
+    enums.Button.BUTTON_D_UP: 0x0008,
+    enums.Button.BUTTON_D_DOWN: 0x0004,
+    enums.Button.BUTTON_D_LEFT: 0x0001,
+    enums.Button.BUTTON_D_RIGHT: 0x0002,
+}
+"""(dict of enums.Button to int): Each button's bit in the GameCube's 16 bit button word"""
+
+# The buttons toBytes() sends. Not the D-pad
+_SENT_BUTTONS = 0x1F70
+# toBytes() always sets this bit
+_ORIGIN_BIT = 0x0080
+# Buttons, then main stick x and y, C stick x and y, L and R
+_GAMECUBE_STATE = Struct(">H6B")
+
+
+class ButtonView(MutableMapping):
+    """The buttons of a ControllerState, as a dict of enums.Button to bool
+
+    Reads and writes go straight through to the ControllerState's button word.
+    """
+
+    __slots__ = ("_state",)
+
+    def __init__(self, state):
+        self._state = state
+
+    def __getitem__(self, button):
+        return bool(self._state.buttons & BUTTON_BITS[button])
+
+    def __setitem__(self, button, pressed):
+        if pressed:
+            self._state.buttons |= BUTTON_BITS[button]
+        else:
+            self._state.buttons &= ~BUTTON_BITS[button]
+
+    def __delitem__(self, button):
+        raise TypeError("Buttons can't be removed")
+
+    def __iter__(self):
+        return iter(BUTTON_BITS)
+
+    def __len__(self):
+        return len(BUTTON_BITS)
+
+    def __repr__(self):
+        return repr(dict(self))
+
 
 class ControllerState:
     """A snapshot of the state of a virtual controller"""
 
+    __slots__ = (
+        "buttons",
+        "main_stick",
+        "c_stick",
+        "raw_main_stick",
+        "l_shoulder",
+        "r_shoulder",
+    )
+
     def __init__(self):
-        __slots__ = ("button", "main_stick", "c_stick", "l_shoulder", "r_shoulder")
-        self.button = dict()
-        """(dict of enums.Button to bool): For the each Button as key, tells you if the button is pressed."""
-        # Boolean buttons
-        self.button[enums.Button.BUTTON_A] = False
-        self.button[enums.Button.BUTTON_B] = False
-        self.button[enums.Button.BUTTON_X] = False
-        self.button[enums.Button.BUTTON_Y] = False
-        self.button[enums.Button.BUTTON_Z] = False
-        self.button[enums.Button.BUTTON_L] = False
-        self.button[enums.Button.BUTTON_R] = False
-        self.button[enums.Button.BUTTON_START] = False
-        self.button[enums.Button.BUTTON_D_UP] = False
-        self.button[enums.Button.BUTTON_D_DOWN] = False
-        self.button[enums.Button.BUTTON_D_LEFT] = False
-        self.button[enums.Button.BUTTON_D_RIGHT] = False
+        self.buttons = 0
+        """(int): The pressed buttons, as the GameCube's 16 bit button word. See BUTTON_BITS"""
         # Analog sticks
         self.main_stick = (0.5, 0.5)
         """(pair of floats): The main stick's x,y position. Ranges from 0->1, 0.5 is neutral"""
@@ -51,49 +102,45 @@ class ControllerState:
         self.r_shoulder = 0
         """(float): R shoulder analog press. Ranges from 0 (not pressed) to 1 (fully pressed)"""
 
+    @property
+    def button(self):
+        """(ButtonView): For the each Button as key, tells you if the button is pressed.
+        Works like a dict of enums.Button to bool, backed by buttons."""
+        return ButtonView(self)
+
+    def copy(self):
+        """A copy of this controller state
+
+        Returns:
+            ControllerState: The copy
+        """
+        state = ControllerState.__new__(ControllerState)
+        state.buttons = self.buttons
+        state.main_stick = self.main_stick
+        state.c_stick = self.c_stick
+        state.raw_main_stick = self.raw_main_stick
+        state.l_shoulder = self.l_shoulder
+        state.r_shoulder = self.r_shoulder
+        return state
+
     def toBytes(self):
         """Serialize the controller state into an 8 byte sequence that the Gamecube uses"""
-        buttons_total = 0x0080
-        if self.button[enums.Button.BUTTON_A]:
-            buttons_total += 0x0100
-        if self.button[enums.Button.BUTTON_B]:
-            buttons_total += 0x0200
-        if self.button[enums.Button.BUTTON_X]:
-            buttons_total += 0x0400
-        if self.button[enums.Button.BUTTON_Y]:
-            buttons_total += 0x0800
-        if self.button[enums.Button.BUTTON_Z]:
-            buttons_total += 0x0010
-        if self.button[enums.Button.BUTTON_L]:
-            buttons_total += 0x0040
-        if self.button[enums.Button.BUTTON_R]:
-            buttons_total += 0x0020
-        if self.button[enums.Button.BUTTON_START]:
-            buttons_total += 0x1000
-
-        buffer = pack(">H", buttons_total)
-
-        # Convert from a float 0-1 to int 1-255
-        val = pack(">B", (int((max(min(self.main_stick[0], 1), 0) * 254)) + 1))
-        buffer += val
-        val = pack(">B", (int((max(min(self.main_stick[1], 1), 0) * 254)) + 1))
-        buffer += val
-        val = pack(">B", (int((max(min(self.c_stick[0], 1), 0) * 254)) + 1))
-        buffer += val
-        val = pack(">B", (int((max(min(self.c_stick[1], 1), 0) * 254)) + 1))
-        buffer += val
-
-        # Convert from a float 0-1 to int 0-255
-        #   The max/min thing just ensures the value is between 0 and 1
-        val = pack(">B", int(max(min(self.l_shoulder, 1), 0) * 255))
-        buffer += val
-        val = pack(">B", int(max(min(self.r_shoulder, 1), 0) * 255))
-        buffer += val
-        return buffer
+        return _GAMECUBE_STATE.pack(
+            (self.buttons & _SENT_BUTTONS) | _ORIGIN_BIT,
+            # Convert from a float 0-1 to int 1-255
+            int(max(min(self.main_stick[0], 1), 0) * 254) + 1,
+            int(max(min(self.main_stick[1], 1), 0) * 254) + 1,
+            int(max(min(self.c_stick[0], 1), 0) * 254) + 1,
+            int(max(min(self.c_stick[1], 1), 0) * 254) + 1,
+            # Convert from a float 0-1 to int 0-255
+            #   The max/min thing just ensures the value is between 0 and 1
+            int(max(min(self.l_shoulder, 1), 0) * 255),
+            int(max(min(self.r_shoulder, 1), 0) * 255),
+        )
 
     def __str__(self):
         string = ""
-        for val in self.button:
+        for val in BUTTON_BITS:
             string += str(val) + ": " + str(self.button[val])
             string += "\n"
         string += "MAIN_STICK: " + str(self.main_stick) + "\n"
@@ -380,18 +427,7 @@ class Controller:
         All buttons are released, all sticks set to 0.5, all shoulders set to 0
         """
         # Set the internal state back to neutral
-        self.current.button[enums.Button.BUTTON_A] = False
-        self.current.button[enums.Button.BUTTON_B] = False
-        self.current.button[enums.Button.BUTTON_X] = False
-        self.current.button[enums.Button.BUTTON_Y] = False
-        self.current.button[enums.Button.BUTTON_Z] = False
-        self.current.button[enums.Button.BUTTON_L] = False
-        self.current.button[enums.Button.BUTTON_R] = False
-        self.current.button[enums.Button.BUTTON_START] = False
-        self.current.button[enums.Button.BUTTON_D_UP] = False
-        self.current.button[enums.Button.BUTTON_D_DOWN] = False
-        self.current.button[enums.Button.BUTTON_D_LEFT] = False
-        self.current.button[enums.Button.BUTTON_D_RIGHT] = False
+        self.current.buttons = 0
         self.current.main_stick = (0.5, 0.5)
         self.current.c_stick = (0.5, 0.5)
         self.current.l_shoulder = 0
@@ -437,7 +473,7 @@ class Controller:
         It doesn't get sent to the console until you flush
         """
         # Move the current controller state into the previous one
-        self.prev = copy.copy(self.current)
+        self.prev = self.current.copy()
 
         if self._is_dolphin:
             self._write("FLUSH\n")
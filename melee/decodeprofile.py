@@ -0,0 +1,145 @@
+"""Decode profiles, for only decoding the parts of a game you actually use
+
+Decoding every field of every player on every frame is most of the work of reading
+a game. A DecodeProfile names the ports and fields you want, and everything else is
+skipped at decode time.
+"""
+
+from melee.events import POST_FRAME_FIELDS, PRE_FRAME_FIELDS, EventDecoder
+
+# Fields every frame event needs, to know which frame and player it's for
+_HEADER_FIELDS = ("frame", "port", "is_nana")
+
+PROFILE_FIELDS = {
+    "position": ("x", "y"),
+    "character": ("character",),
+    "action": ("action",),
+    "action_frame": ("action_frame",),
+    "facing": ("facing",),
+    "percent": ("percent",),
+    "shield_strength": ("shield_strength",),
+    "stock": ("stock",),
+    "is_powershield": ("state_flags_4",),
+    "hitstun_frames_left": ("hitstun_frames_left",),
+    "on_ground": ("airborne",),
+    "jumps_left": ("jumps_left",),
+    "invulnerable": ("hurtbox_status",),
+    "invulnerability_left": (),
+    "speed": (
+        "speed_air_x_self",
+        "speed_y_self",
+        "speed_x_attack",
+        "speed_y_attack",
+        "speed_ground_x_self",
+    ),
+    "hitlag_left": ("hitlag_left",),
+    "moonwalkwarning": (),
+    "off_stage": (),
+    "ecb": (
+        "ecb_top_x",
+        "ecb_top_y",
+        "ecb_bottom_x",
+        "ecb_bottom_y",
+        "ecb_left_x",
+        "ecb_left_y",
+        "ecb_right_x",
+        "ecb_right_y",
+    ),
+    "fod_platforms": ("fod_platform_left", "fod_platform_right"),
+    "controller_state": (
+        "main_stick_x",
+        "main_stick_y",
+        "c_stick_x",
+        "c_stick_y",
+        "trigger",
+        "buttons",
+        "raw_main_stick_x",
+        "raw_main_stick_y",
+    ),
+}
+"""The fields a DecodeProfile can ask for, and the replay event fields each one needs
+
+Names are PlayerState attributes, or groups of them: position is x, y and position,
+speed is the five speed_* attributes, ecb is ecb and the ecb_* tuples, and
+fod_platforms is the GameState's Fountain of Dreams platform heights.
+invulnerability_left, moonwalkwarning and off_stage aren't in the replay. They're
+worked out from other fields, which get decoded along with them.
+"""
+
+
+# Fields worked out from (or corrected using) other fields, which get decoded along
+#   with them
+_DERIVED_FIELDS = {
+    "action_frame": ("action", "character"),
+    "invulnerable": ("invulnerability_left",),
+    "invulnerability_left": ("action", "action_frame"),
+    "moonwalkwarning": ("action",),
+    "off_stage": ("position", "on_ground"),
+}
+
+
+class DecodeProfile:
+    """Which ports and fields to decode from a game
+
+    Pass one to a Console, or to replays.read_replay(). Players on other ports never
+    show up in the GameState (or Replay), and PlayerState attributes not asked for
+    are left at their defaults.
+    """
+
+    def __init__(self, ports=None, fields=None, nana=True, projectiles=True):
+        """Create a profile
+
+        Args:
+            ports (list of int): Controller ports to decode. None for all of them
+            fields (list of str): Fields to decode, from PROFILE_FIELDS. None for all
+                of them. Fields that are worked out from others bring those along
+                too. costume, cpu_level and team_id are always filled in.
+            nana (bool): Decode Nana, for Ice Climbers players
+            projectiles (bool): Decode projectiles (Console only)
+
+        Raises:
+            ValueError: If a field isn't in PROFILE_FIELDS
+        """
+        self.ports = None if ports is None else frozenset(ports)
+        self.fields = frozenset(PROFILE_FIELDS if fields is None else fields)
+        unknown = self.fields - PROFILE_FIELDS.keys()
+        if unknown:
+            raise ValueError(
+                "Unknown decode profile fields: " + ", ".join(sorted(unknown))
+            )
+        # Derived fields can need other derived fields. Keep adding until there's
+        #   nothing new
+        needed = list(self.fields)
+        while needed:
+            added = frozenset(_DERIVED_FIELDS.get(needed.pop(), ())) - self.fields
+            self.fields |= added
+            needed.extend(added)
+        self.nana = nana
+        self.projectiles = projectiles
+
+        raw_fields = set(_HEADER_FIELDS)
+        for field in self.fields:
+            raw_fields.update(PROFILE_FIELDS[field])
+        self.raw_fields = frozenset(raw_fields)
+        """(frozenset of str): The replay event fields this profile needs"""
+        self.pre_frame_decoder = EventDecoder(
+            "PreFrame", [field for field in PRE_FRAME_FIELDS if field[0] in raw_fields]
+        )
+        self.post_frame_decoder = EventDecoder(
+            "PostFrame",
+            [field for field in POST_FRAME_FIELDS if field[0] in raw_fields],
+            defaults={"jumps_left": 1},
+        )
+
+    def __reduce__(self):
+        # The decoders can't be pickled, but they can be rebuilt
+        return (
+            DecodeProfile,
+            (self.ports, self.fields, self.nana, self.projectiles),
+        )
+
+    def wants(self, port, is_nana):
+        """Should the player on this controller port (1-4) be decoded?"""
+        if is_nana and not self.nana:
+            return False
+        return self.ports is None or port in self.ports
@@ -0,0 +1,188 @@
+"""Binary layouts of the Slippi replay events that libmelee decodes
+
+Each layout is a tuple of (name, offset, format) entries, where offset is measured
+from the command byte of the event and format is a single big-endian `struct`
+format character. The same tables drive every decoder in libmelee, so a field only
+ever has to be described once.
+
+Older SLP versions write shorter events. Any field that does not fit inside the
+event size announced by the PAYLOADS event is simply absent from that replay.
+"""
+
+import struct
+from collections import namedtuple
+
+PAYLOAD_ENTRY = struct.Struct(">BH")
+"""One entry of the PAYLOADS event: a command byte and the size of that event"""
+
+FRAME_NUMBER = struct.Struct(">i")
+"""The frame number that every frame event carries just after its command byte"""
+
+PRE_FRAME_FIELDS = (
+    ("frame", 0x1, "i"),
+    ("port", 0x5, "B"),
+    ("is_nana", 0x6, "B"),
+    ("main_stick_x", 0x19, "f"),
+    ("main_stick_y", 0x1D, "f"),
+    ("c_stick_x", 0x21, "f"),
+    ("c_stick_y", 0x25, "f"),
+    ("trigger", 0x29, "f"),
+    ("buttons", 0x31, "H"),
+    ("raw_main_stick_x", 0x3B, "b"),
+    ("raw_main_stick_y", 0x40, "b"),
+)
+"""Fields of the PRE_FRAME event. Mostly controller inputs"""
+
+POST_FRAME_FIELDS = (
+    ("frame", 0x1, "i"),
+    ("port", 0x5, "B"),
+    ("is_nana", 0x6, "B"),
+    ("character", 0x7, "B"),
+    ("action", 0x8, "H"),
+    ("x", 0xA, "f"),
+    ("y", 0xE, "f"),
+    ("facing", 0x12, "f"),
+    ("percent", 0x16, "f"),
+    ("shield_strength", 0x1A, "f"),
+    ("stock", 0x21, "B"),
+    ("action_frame", 0x22, "f"),
+    ("state_flags_4", 0x29, "B"),
+    ("hitstun_frames_left", 0x2B, "f"),
+    ("airborne", 0x2F, "B"),
+    ("jumps_left", 0x32, "B"),
+    ("hurtbox_status", 0x34, "B"),
+    ("speed_air_x_self", 0x35, "f"),
+    ("speed_y_self", 0x39, "f"),
+    ("speed_x_attack", 0x3D, "f"),
+    ("speed_y_attack", 0x41, "f"),
+    ("speed_ground_x_self", 0x45, "f"),
+    ("hitlag_left", 0x49, "f"),
+    ("ecb_top_x", 0x51, "f"),
+    ("ecb_top_y", 0x55, "f"),
+    ("ecb_bottom_x", 0x59, "f"),
+    ("ecb_bottom_y", 0x5D, "f"),
+    ("ecb_left_x", 0x61, "f"),
+    ("ecb_left_y", 0x65, "f"),
+    ("ecb_right_x", 0x69, "f"),
+    ("ecb_right_y", 0x6D, "f"),
+    ("fod_platform_left", 0x71, "f"),
+    ("fod_platform_right", 0x75, "f"),
+)
+"""Fields of the POST_FRAME event. The character's state after the frame is processed"""
+
+GAME_START_FIELDS = (
+    ("major", 0x1, "B"),
+    ("minor", 0x2, "B"),
+    ("build", 0x3, "B"),
+    ("is_teams", 0xD, "H"),
+    ("stage", 0x13, "H"),
+)
+"""Fields of the GAME_START event that are not per-player"""
+
+GAME_START_PLAYER_FIELDS = (
+    ("character", 0x65, "B"),
+    ("player_type", 0x66, "B"),
+    ("costume", 0x68, "B"),
+    ("team_id", 0x6E, "B"),
+    ("cpu_level", 0x74, "B"),
+)
+"""Per-player fields of the GAME_START event, for the first player. Each
+following player block starts GAME_START_PLAYER_STRIDE bytes later"""
+
+GAME_START_PLAYER_STRIDE = 0x24
+
+
+def fields_in(fields, event_size):
+    """The subset of fields that are fully contained in an event of event_size bytes"""
+    return tuple(
+        field for field in fields if field[1] + struct.calcsize(field[2]) <= event_size
+    )
+
+
+ITEM_UPDATE_FIELDS = (
+    ("frame", 0x1, "i"),
+    ("type", 0x5, "H"),
+    ("subtype", 0x7, "B"),
+    ("facing", 0x8, "f"),
+    ("speed_x", 0xC, "f"),
+    ("speed_y", 0x10, "f"),
+    ("x", 0x14, "f"),
+    ("y", 0x18, "f"),
+    ("damage", 0x1C, "H"),
+    ("expiration_timer", 0x1E, "f"),
+    ("spawn_id", 0x22, "I"),
+    ("owner", 0x2A, "B"),
+)
+"""Fields of the ITEM_UPDATE event"""
+
+
+class EventDecoder:
+    """Unpacks every field of one event type with a single precompiled struct
+
+    Older SLP versions write shorter events, so a struct is compiled for each event
+    size the first time that size is seen. Fields past the end of a short event are
+    filled in with their default value instead.
+    """
+
+    def __init__(self, name, fields, defaults=None):
+        """Create a decoder
+
+        Args:
+            name (str): Name of the record type this decoder returns
+            fields (tuple): The (name, offset, format) fields to decode
+            defaults (dict): Value for each field when it's missing from the event.
+                Fields not in this dict default to 0.
+        """
+        self.fields = tuple(sorted(fields, key=lambda field: field[1]))
+        defaults = defaults or {}
+        self._defaults = tuple(defaults.get(field[0], 0) for field in self.fields)
+        self.record = namedtuple(name, [field[0] for field in self.fields])
+        self._layouts = {}
+
+    def _compile(self, event_size):
+        present = fields_in(self.fields, event_size)
+        fmt = ">"
+        cursor = 0
+        for _, offset, code in present:
+            if offset > cursor:
+                fmt += "{}x".format(offset - cursor)
+            fmt += code
+            cursor = offset + struct.calcsize(code)
+        layout = (struct.Struct(fmt).unpack_from, self._defaults[len(present) :])
+        self._layouts[event_size] = layout
+        return layout
+
+    def decode(self, buf, offset, event_size):
+        """Decode the event that starts at offset in buf
+
+        Args:
+            buf (bytes-like): Buffer holding the event
+            offset (int): Offset of the event's command byte in buf
+            event_size (int): Size of the event, as given by the PAYLOADS event
+
+        Returns:
+            namedtuple: One entry per field
+        """
+        try:
+            unpack, missing = self._layouts[event_size]
+        except KeyError:
+            unpack, missing = self._compile(event_size)
+        return self.record._make(unpack(buf, offset) + missing)
+
+
+PRE_FRAME_DECODER = EventDecoder("PreFrame", PRE_FRAME_FIELDS)
+POST_FRAME_DECODER = EventDecoder(
+    "PostFrame", POST_FRAME_FIELDS, defaults={"jumps_left": 1}
+)
+ITEM_UPDATE_DECODER = EventDecoder(
+    "ItemUpdate", ITEM_UPDATE_FIELDS, defaults={"owner": 0xFF}
+)
+GAME_START_DECODER = EventDecoder("GameStart", GAME_START_FIELDS)
+GAME_START_PLAYER_DECODER = EventDecoder(
+    "GameStartPlayer",
+    [
+        (name, offset - GAME_START_PLAYER_FIELDS[0][1], fmt)
+        for name, offset, fmt in GAME_START_PLAYER_FIELDS
+    ],
+)
+"""Decodes one player block of GAME_START. Give it the offset of the block"""
@@ -0,0 +1,94 @@
+"""A bounded queue of GameStates, for handing frames between threads
+
+Used by the Console's background receiver. The receiving thread puts frames in as
+they're decoded, and step() takes them out.
+"""
+
+import threading
+from collections import deque
+
+POLICIES = ("block", "drop_oldest", "latest")
+
+
+class FrameQueue:
+    """Bounded queue of GameStates with a choice of what to do when it fills up
+
+    Policies:
+        block: The receiver waits for step() to make room. No frame is ever lost,
+            but the connection isn't serviced while it waits.
+        drop_oldest: The oldest queued frame is thrown away to make room.
+        latest: Only the newest frame is kept. step() always gets the most recent
+            frame, skipping any it was too slow for.
+    """
+
+    def __init__(self, maxsize=8, policy="block"):
+        """Create a queue
+
+        Args:
+            maxsize (int): Most frames to hold at once
+            policy (str): What to do when it's full. One of POLICIES
+        """
+        assert policy in POLICIES, "Unknown frame queue policy: " + str(policy)
+        assert maxsize > 0, "Frame queue must hold at least one frame"
+        self.maxsize = maxsize
+        self.policy = policy
+        self.dropped = 0
+        """(int): Frames thrown away because the queue was full"""
+        self.late = 0
+        """(int): Frames handed out when a newer frame was already waiting"""
+        self._frames = deque()
+        self._condition = threading.Condition()
+        self._closed = False
+
+    def __len__(self):
+        return len(self._frames)
+
+    def put(self, gamestate):
+        """Add a frame, applying the queue's policy if it's full"""
+        with self._condition:
+            if self.policy == "latest":
+                self.dropped += len(self._frames)
+                self._frames.clear()
+            elif len(self._frames) >= self.maxsize:
+                if self.policy == "block":
+                    while len(self._frames) >= self.maxsize and not self._closed:
+                        self._condition.wait()
+                else:
+                    self._frames.popleft()
+                    self.dropped += 1
+            self._frames.append(gamestate)
+            self._condition.notify_all()
+
+    def get(self, block=True, timeout=None):
+        """Take the oldest frame out of the queue
+
+        Args:
+            block (bool): Wait for a frame if there isn't one
+            timeout (float): Longest to wait, in seconds. None waits forever
+
+        Returns:
+            GameState: The frame, or None if there isn't one, or the queue is closed
+                and empty
+        """
+        with self._condition:
+            if block:
+                self._condition.wait_for(
+                    lambda: self._frames or self._closed, timeout=timeout
+                )
+            if not self._frames:
+                return None
+            gamestate = self._frames.popleft()
+            if self._frames:
+                self.late += 1
+            self._condition.notify_all()
+            return gamestate
+
+    def close(self):
+        """No more frames are coming. Wakes up anyone waiting"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    @property
+    def closed(self):
+        return self._closed
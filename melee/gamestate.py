@@ -1,13 +1,14 @@
-""" Gamestate is a single snapshot in time of the game that represents all necessary information
-        to make gameplay decisions
+"""Gamestate is a single snapshot in time of the game that represents all necessary information
+to make gameplay decisions
 """
 
+import math
 from dataclasses import dataclass, field
 
 import numpy as np
 
 import melee
-from melee import enums
+from melee import controller, enums, observation
 
 
 @dataclass
@@ -56,6 +57,8 @@ class GameState(object):
         "_fod_platform_left",
         "_fod_platform_right",
         "custom",
+        "_spare_players",
+        "_spare_projectiles",
     )
 
     def __init__(self):
@@ -97,6 +100,99 @@ class GameState(object):
         """(float): The current height of FoD platforms"""
         self.custom = dict()
         """(dict): Custom fields to be added by the user"""
+        # Objects from an earlier frame, to be reused. None if this isn't pooled
+        self._spare_players = None
+        self._spare_projectiles = None
+
+    def copy(self):
+        """A copy of this gamestate that shares nothing with it
+
+        Consoles that reuse their gamestates overwrite each one a few frames later.
+        Copy any frame that needs to be kept for longer than that.
+
+        Returns:
+            GameState: The copy
+        """
+        gamestate = GameState.__new__(GameState)
+        for name in GameState.__slots__:
+            setattr(gamestate, name, getattr(self, name))
+        gamestate.players = {
+            port: player.copy() for port, player in self.players.items()
+        }
+        gamestate.player = gamestate.players
+        gamestate.projectiles = [projectile.copy() for projectile in self.projectiles]
+        gamestate.custom = dict(self.custom)
+        gamestate._spare_players = None
+        gamestate._spare_projectiles = None
+        return gamestate
+
+    def to_array(self, schema=None, out=None):
+        """This frame as a fixed-layout numpy vector, for machine learning
+
+        Args:
+            schema (observation.ObservationSchema): The layout. None for
+                observation.DEFAULT_SCHEMA
+            out (np.ndarray): float32 array of the schema's size to write into. None
+                makes a new one
+
+        Returns:
+            np.ndarray: The vector. See ObservationSchema.columns for what's where
+        """
+        if schema is None:
+            schema = observation.DEFAULT_SCHEMA
+        return schema.fill(self, out)
+
+    @classmethod
+    def _pooled(cls):
+        """A gamestate that reuses its own players and projectiles, see _recycle()"""
+        gamestate = cls()
+        gamestate._spare_players = {}
+        gamestate._spare_projectiles = []
+        return gamestate
+
+    def _recycle(self):
+        """Blank a pooled gamestate, so it can be filled in again as a new frame
+
+        Its players and projectiles are kept aside, for _new_player() and
+        _new_projectile() to hand back out.
+        """
+        spare_players = self._spare_players
+        for port, player in self.players.items():
+            spare_players[port] = player
+            if player.nana is not None:
+                spare_players[-port] = player.nana
+        self.players.clear()
+        self._spare_projectiles.extend(self.projectiles)
+        self.projectiles.clear()
+        self.custom.clear()
+        for name, value in _GAMESTATE_DEFAULTS:
+            setattr(self, name, value)
+
+    def _new_player(self, key, player=None):
+        """A blank PlayerState to fill in for this frame
+
+        Args:
+            key (int): Controller port of the player. Negative for their Nana
+            player (PlayerState): A PlayerState of this frame to blank and reuse,
+                if the gamestate is pooled
+        """
+        spare_players = self._spare_players
+        if spare_players is None:
+            return PlayerState()
+        if player is None:
+            player = spare_players.pop(key, None)
+            if player is None:
+                return PlayerState()
+        player._reset()
+        return player
+
+    def _new_projectile(self):
+        """A blank Projectile to fill in for this frame"""
+        if not self._spare_projectiles:
+            return Projectile()
+        projectile = self._spare_projectiles.pop()
+        projectile._reset()
+        return projectile
 
 
 class PlayerState(object):
@@ -245,6 +341,44 @@ class PlayerState(object):
         self.team_id = 0
         """(int): The team ID of the player. This is different than costume, and only relevant during teams."""
 
+    def copy(self):
+        """A copy of this player state that shares nothing with it
+
+        Returns:
+            PlayerState: The copy
+        """
+        player = PlayerState.__new__(PlayerState)
+        for name in PlayerState.__slots__:
+            setattr(player, name, getattr(self, name))
+        player.position = Position(self.position.x, self.position.y)
+        player.cursor = Cursor(self.cursor.x, self.cursor.y)
+        ecb = self.ecb
+        player.ecb = ECB(
+            Position(ecb.top.x, ecb.top.y),
+            Position(ecb.bottom.x, ecb.bottom.y),
+            Position(ecb.left.x, ecb.left.y),
+            Position(ecb.right.x, ecb.right.y),
+        )
+        player.controller_state = self.controller_state.copy()
+        if self.nana is not None:
+            player.nana = self.nana.copy()
+        return player
+
+    def _reset(self):
+        """Put everything back as it was when the PlayerState was made, in place"""
+        for name, value in _PLAYER_DEFAULTS:
+            setattr(self, name, value)
+        _reset_position(self.position)
+        _reset_position(self.cursor)
+        ecb = self.ecb
+        _reset_position(ecb.top)
+        _reset_position(ecb.bottom)
+        _reset_position(ecb.left)
+        _reset_position(ecb.right)
+        controller_state = self.controller_state
+        for name, value in _CONTROLLER_DEFAULTS:
+            setattr(controller_state, name, value)
+
 
 class Projectile:
     """Represents the state of a projectile (items, lasers, etc...)"""
@@ -271,6 +405,84 @@ class Projectile:
         self.subtype = 0
         """(int): The subtype of the item. Many projectiles have 'subtypes' that make them different. They're all different, so it's not an enum"""
 
+    def copy(self):
+        """A copy of this projectile that shares nothing with it
+
+        Returns:
+            Projectile: The copy
+        """
+        projectile = Projectile.__new__(Projectile)
+        projectile.__dict__.update(self.__dict__)
+        projectile.position = Position(self.position.x, self.position.y)
+        projectile.speed = Speed(self.speed.x, self.speed.y)
+        return projectile
+
+    def _reset(self):
+        """Put everything back as it was when the Projectile was made, in place"""
+        self.__dict__.update(_PROJECTILE_DEFAULTS)
+        _reset_position(self.position)
+        _reset_position(self.speed)
+
+
+def _reset_position(position):
+    position.x = _ZERO
+    position.y = _ZERO
+
+
+def _defaults(obj, names, mutable):
+    """The starting values of an object's attributes, other than the mutable ones"""
+    return tuple((name, getattr(obj, name)) for name in names if name not in mutable)
+
+
+# What _recycle() and _reset() set everything back to. The mutable attributes are
+#   emptied or reset in place instead
+_ZERO = Position().x
+_GAMESTATE_DEFAULTS = _defaults(
+    GameState(),
+    GameState.__slots__,
+    (
+        "players",
+        "player",
+        "projectiles",
+        "custom",
+        "_spare_players",
+        "_spare_projectiles",
+    ),
+)
+_PLAYER_DEFAULTS = _defaults(
+    PlayerState(),
+    PlayerState.__slots__,
+    ("position", "cursor", "ecb", "controller_state"),
+)
+_CONTROLLER_DEFAULTS = _defaults(
+    controller.ControllerState(), controller.ControllerState.__slots__, ()
+)
+_PROJECTILE_DEFAULTS = dict(
+    _defaults(Projectile(), vars(Projectile()), ("position", "speed"))
+)
+
+
+def _distance(players):
+    """The helper distance: between the first two players (or just Popo for
+    climbers). This is a bit kludgey.... :/"""
+    i = 0
+    player_one_x, player_one_y, player_two_x, player_two_y = 0, 0, 0, 0
+    for _, player_state in players.items():
+        if i == 0:
+            player_one_x, player_one_y = (
+                player_state.position.x,
+                player_state.position.y,
+            )
+        if i == 1:
+            player_two_x, player_two_y = (
+                player_state.position.x,
+                player_state.position.y,
+            )
+        i += 1
+    xdist = player_one_x - player_two_x
+    ydist = player_one_y - player_two_y
+    return math.sqrt((xdist**2) + (ydist**2))
+
 
 def port_detector(gamestate, character, costume):
     """Autodiscover what port the given character is on
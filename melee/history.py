@@ -0,0 +1,213 @@
+"""The last so many frames of each player, as numpy arrays, for Console(history=N)
+
+Velocities, action changes and input history all need more than the current
+frame. A GameStateHistory keeps the last depth frames of the fields bots use most,
+in preallocated arrays that are written in place every frame, so nothing piles up
+and adding a frame costs the same however deep the history is.
+
+Each player's frame is a HISTORY_DTYPE record. Players that aren't in the game have
+present set to False, and zeros for everything else. Windows of the history are
+views straight into the arrays, oldest frame first, so they're only good until the
+next frame is added. Copy them to keep them.
+"""
+
+import numpy as np
+
+from melee.sharedframes import dtype_struct
+
+HISTORY_DTYPE = np.dtype(
+    [
+        ("present", "?"),
+        ("character", "u1"),
+        ("action", "<u2"),
+        ("action_frame", "<i4"),
+        ("position", "<f4", (2,)),
+        ("speed_air_x_self", "<f4"),
+        ("speed_y_self", "<f4"),
+        ("speed_x_attack", "<f4"),
+        ("speed_y_attack", "<f4"),
+        ("speed_ground_x_self", "<f4"),
+        ("percent", "<i4"),
+        ("stock", "u1"),
+        ("shield_strength", "<f4"),
+        ("facing", "?"),
+        ("on_ground", "?"),
+        ("off_stage", "?"),
+        ("jumps_left", "u1"),
+        ("hitlag_left", "<i4"),
+        ("hitstun_frames_left", "<i4"),
+        ("invulnerable", "?"),
+        ("invulnerability_left", "<i4"),
+        ("main_stick", "<f4", (2,)),
+        ("c_stick", "<f4", (2,)),
+        ("l_shoulder", "<f4"),
+        ("r_shoulder", "<f4"),
+        # The GameCube's button word, see controller.BUTTON_BITS
+        ("buttons", "<u2"),
+    ]
+)
+"""Layout of one player on one frame. Enums are stored as their values"""
+
+_PLAYER_STRUCT = dtype_struct(HISTORY_DTYPE, HISTORY_DTYPE.names)
+_NO_PLAYER = bytes(HISTORY_DTYPE.itemsize)
+
+
+class GameStateHistory:
+    """Ring buffers of the last depth frames of each player
+
+    Every frame is written twice, depth records apart, into arrays twice as long as
+    the history. That way the last n frames are always next to each other, and a
+    window of them is a slice rather than a copy.
+    """
+
+    def __init__(self, depth=60):
+        """Create an empty history
+
+        Args:
+            depth (int): How many of the most recent frames to keep
+        """
+        assert depth > 0, "The history must hold at least one frame"
+        self.depth = depth
+        self.count = 0
+        """(int): Frames added in total, including ones no longer kept"""
+        # Indexed by port - 1
+        self._players = np.zeros((4, 2 * depth), HISTORY_DTYPE)
+        self._frames = np.zeros(2 * depth, np.int64)
+        # The same memory as bytes, to pack records into
+        self._buffer = self._players.reshape(-1).view(np.uint8).data
+        # Byte offset of each port's row
+        self._rows = tuple(
+            port * 2 * depth * HISTORY_DTYPE.itemsize for port in range(4)
+        )
+
+    def __len__(self):
+        """How many frames the history holds"""
+        return min(self.count, self.depth)
+
+    def append(self, gamestate):
+        """Add a frame, forgetting the oldest one if the history is full"""
+        slot = self.count % self.depth
+        buffer = self._buffer
+        size = HISTORY_DTYPE.itemsize
+        players = gamestate.players
+        for port, row in enumerate(self._rows, 1):
+            offset = row + slot * size
+            player = players.get(port)
+            if player is None:
+                buffer[offset : offset + size] = _NO_PLAYER
+            else:
+                controller = player.controller_state
+                _PLAYER_STRUCT.pack_into(
+                    buffer,
+                    offset,
+                    True,
+                    player.character.value,
+                    player.action.value,
+                    player.action_frame,
+                    player.position.x,
+                    player.position.y,
+                    player.speed_air_x_self,
+                    player.speed_y_self,
+                    player.speed_x_attack,
+                    player.speed_y_attack,
+                    player.speed_ground_x_self,
+                    player.percent,
+                    player.stock,
+                    player.shield_strength,
+                    player.facing,
+                    player.on_ground,
+                    player.off_stage,
+                    player.jumps_left,
+                    player.hitlag_left,
+                    player.hitstun_frames_left,
+                    player.invulnerable,
+                    player.invulnerability_left,
+                    *controller.main_stick,
+                    *controller.c_stick,
+                    controller.l_shoulder,
+                    controller.r_shoulder,
+                    controller.buttons,
+                )
+            mirror = offset + self.depth * size
+            buffer[mirror : mirror + size] = buffer[offset : offset + size]
+        self._frames[slot] = gamestate.frame
+        self._frames[slot + self.depth] = gamestate.frame
+        self.count += 1
+
+    def clear(self):
+        """Forget every frame"""
+        self.count = 0
+        self._players.fill(0)
+        self._frames.fill(0)
+
+    def _window(self, frames):
+        """The slice of the arrays holding the last frames frames"""
+        held = len(self)
+        if frames is None or frames > held:
+            frames = held
+        end = (self.count - 1) % self.depth + self.depth + 1
+        return slice(end - frames, end)
+
+    def window(self, port, field=None, frames=None):
+        """The last few frames of a player, oldest first
+
+        Args:
+            port (int): The player's controller port. None for every port, as rows
+                indexed by port - 1
+            field (str): Just this field of HISTORY_DTYPE, such as "position". None
+                for whole records
+            frames (int): How many of the most recent frames. None, or more than the
+                history holds, for all of them
+
+        Returns:
+            np.ndarray: A view into the history, good until the next frame is added.
+                For a field, one value per frame, or one row for fields like
+                position with more than one value
+        """
+        window = self._window(frames)
+        if port is None:
+            records = self._players[:, window]
+        else:
+            records = self._players[port - 1, window]
+        if field is None:
+            return records
+        return records[field]
+
+    def frames(self, frames=None):
+        """The frame number of each of the last few frames, oldest first"""
+        return self._frames[self._window(frames)]
+
+    def positions(self, port, frames=None):
+        """The player's (x, y) over the last few frames, as rows, oldest first"""
+        return self.window(port, "position", frames)
+
+    def velocities(self, port, frames=None):
+        """How far the player moved between each of the last few frames
+
+        Returns:
+            np.ndarray: One (x, y) row fewer than there are frames
+        """
+        return np.diff(self.positions(port, frames), axis=0)
+
+    def frames_since_change(self, port, field="action"):
+        """How long a field of the player has had its current value
+
+        Args:
+            port (int): The player's controller port
+            field (str): The field of HISTORY_DTYPE, such as "action" or "buttons"
+
+        Returns:
+            int: 0 if it changed on the newest frame, 1 if the frame before, and so
+                on. None if it hasn't changed in the whole history
+        """
+        values = self.window(port, field)
+        if len(values) == 0:
+            return None
+        changed = values != values[-1]
+        if changed.ndim > 1:
+            changed = changed.any(axis=tuple(range(1, changed.ndim)))
+        # The last frame with a different value
+        indices = np.flatnonzero(changed)
+        if len(indices) == 0:
+            return None
+        return int(len(values) - 2 - indices[-1])
@@ -0,0 +1,379 @@
+"""GameStates that only work out the fields that actually get read, for Console(lazy=True)
+
+A Console normally turns every field of every frame event into PlayerState
+attributes as soon as the event arrives: enums, ints, tuples, Positions, and
+helpers like off_stage. Most bots only read a few of them. In lazy mode, each event
+is still unpacked in one go, but the PlayerState just keeps the unpacked event.
+Each attribute is worked out from it the first time it's read, and then kept.
+The GameState's distance is likewise only worked out when read.
+
+Lazy states behave like any other GameState and PlayerState, and hold the same
+values. The only thing worked out up front is invulnerability_left, as that has
+to be tracked from frame to frame regardless.
+"""
+
+from melee import enums, stages
+from melee.controller import ControllerState
+from melee.enums import Action
+from melee.gamestate import ECB, Cursor, GameState, PlayerState, Position, _distance
+
+
+class LazyGameState(GameState):
+    """A GameState whose distance is only worked out when it's read"""
+
+    __slots__ = ("_ended",)
+
+    def __init__(self):
+        super().__init__()
+        del self.distance
+        # Whether a FRAME_BOOKEND has been seen. Frames without one keep a
+        #   distance of 0
+        self._ended = False
+
+    def __getattr__(self, name):
+        if name != "distance":
+            raise AttributeError(name)
+        self.distance = _distance(self.players) if self._ended else 0.0
+        return self.distance
+
+    def __reduce_ex__(self, protocol):
+        return _unpickle_copy, (self.copy(),)
+
+
+class LazyPlayerState(PlayerState):
+    """A PlayerState that works out each attribute from its frame events when read"""
+
+    __slots__ = (
+        "_fields",
+        "_is_nana",
+        "_pre",
+        "_post",
+        "_stage",
+        "_prev_action",
+        "_zero_indices",
+    )
+
+    def __init__(self, fields, is_nana, zero_indices):
+        """Create a player state with nothing worked out yet
+
+        Args:
+            fields (frozenset of str): The DecodeProfile fields to fill in. The rest
+                keep their defaults
+            is_nana (bool): Is this Nana? Nana's action_frame and iasa aren't fixed
+                up, as with eager decoding
+            zero_indices (dict): The Console's zero-indexed actions, by character
+        """
+        # The attributes are left unset, for __getattr__() to fill in
+        self._fields = fields
+        self._is_nana = is_nana
+        self._pre = None
+        self._post = None
+        self._stage = None
+        self._prev_action = None
+        self._zero_indices = zero_indices
+        self.nana = None
+
+    def set_pre_frame(self, pre):
+        """Use this unpacked PRE_FRAME event, forgetting anything from an earlier one"""
+        if self._pre is not None:
+            _forget(self, _PRE_ATTRIBUTES)
+        self._pre = pre
+
+    def set_post_frame(self, post, stage, prev_player):
+        """Use this unpacked POST_FRAME event, forgetting anything from an earlier one
+
+        Args:
+            post: The unpacked event
+            stage (enums.Stage): The stage, for off_stage
+            prev_player (PlayerState): The player on this port in the previous
+                frame, if there was one, for moonwalkwarning
+        """
+        if self._post is not None:
+            _forget(self, _POST_ATTRIBUTES)
+        self._post = post
+        self._stage = stage
+        self._prev_action = None if prev_player is None else prev_player.action
+
+    def __getattr__(self, name):
+        try:
+            loader = _LOADERS[name]
+        except KeyError:
+            raise AttributeError(name) from None
+        loader(self)
+        return getattr(self, name)
+
+    def __reduce_ex__(self, protocol):
+        return _unpickle_copy, (self.copy(),)
+
+
+def _unpickle_copy(state):
+    # Lazy states pickle as a plain copy of themselves, without the events
+    return state
+
+
+def _forget(player, names):
+    for name in names:
+        try:
+            delattr(player, name)
+        except AttributeError:
+            pass
+
+
+def _post_field(field):
+    """Decorator for loaders of POST_FRAME fields. Without the event, or the field
+    in the profile, the attributes keep their defaults"""
+
+    def decorator(function):
+        def loader(player):
+            if player._post is not None and field in player._fields:
+                function(player, player._post)
+            else:
+                _LOADER_DEFAULTS[field](player)
+
+        loader.field = field
+        return loader
+
+    return decorator
+
+
+@_post_field("position")
+def _load_position(player, post):
+    player.position = Position(post.x, post.y)
+    player.x = post.x
+    player.y = post.y
+
+
+@_post_field("character")
+def _load_character(player, post):
+    player.character = enums.Character(post.character)
+
+
+@_post_field("action")
+def _load_action(player, post):
+    try:
+        player.action = enums.Action(post.action)
+    except ValueError:
+        player.action = enums.Action.UNKNOWN_ANIMATION
+
+
+@_post_field("action_frame")
+def _load_action_frame(player, post):
+    action_frame = int(post.action_frame)
+    # Melee's indexing of action frames is wildly inconsistent. Index them all at 1
+    if not player._is_nana:
+        if player.action.value in player._zero_indices[player.character.value]:
+            action_frame += 1
+    player.action_frame = action_frame
+
+
+@_post_field("facing")
+def _load_facing(player, post):
+    player.facing = post.facing > 0
+
+
+@_post_field("percent")
+def _load_percent(player, post):
+    player.percent = int(post.percent)
+
+
+@_post_field("shield_strength")
+def _load_shield_strength(player, post):
+    player.shield_strength = post.shield_strength
+
+
+@_post_field("stock")
+def _load_stock(player, post):
+    player.stock = post.stock
+
+
+@_post_field("is_powershield")
+def _load_is_powershield(player, post):
+    player.is_powershield = (post.state_flags_4 & 0x20) == 0x20
+
+
+@_post_field("hitstun_frames_left")
+def _load_hitstun_frames_left(player, post):
+    try:
+        player.hitstun_frames_left = int(post.hitstun_frames_left)
+    except ValueError:
+        player.hitstun_frames_left = 0
+
+
+@_post_field("on_ground")
+def _load_on_ground(player, post):
+    player.on_ground = not bool(post.airborne)
+
+
+@_post_field("jumps_left")
+def _load_jumps_left(player, post):
+    player.jumps_left = post.jumps_left
+
+
+@_post_field("invulnerable")
+def _load_invulnerable(player, post):
+    player.invulnerable = post.hurtbox_status != 0
+    if "invulnerability_left" in player._fields and player.invulnerability_left > 0:
+        player.invulnerable = True
+
+
+@_post_field("speed")
+def _load_speed(player, post):
+    player.speed_air_x_self = post.speed_air_x_self
+    player.speed_y_self = post.speed_y_self
+    player.speed_x_attack = post.speed_x_attack
+    player.speed_y_attack = post.speed_y_attack
+    player.speed_ground_x_self = post.speed_ground_x_self
+
+
+@_post_field("hitlag_left")
+def _load_hitlag_left(player, post):
+    player.hitlag_left = int(post.hitlag_left)
+
+
+@_post_field("moonwalkwarning")
+def _load_moonwalkwarning(player, post):
+    # The pre-warning occurs when we first start a dash dance
+    player.moonwalkwarning = (
+        player._prev_action is not None
+        and player.action == Action.DASHING
+        and player._prev_action not in [Action.DASHING, Action.TURNING]
+    )
+
+
+@_post_field("off_stage")
+def _load_off_stage(player, post):
+    try:
+        player.off_stage = (
+            abs(player.position.x) > stages.EDGE_GROUND_POSITION[player._stage]
+            or player.y < -6
+        ) and not player.on_ground
+    except KeyError:
+        player.off_stage = False
+
+
+@_post_field("ecb")
+def _load_ecb(player, post):
+    player.ecb = ECB(
+        Position(post.ecb_top_x, post.ecb_top_y),
+        Position(post.ecb_bottom_x, post.ecb_bottom_y),
+        Position(post.ecb_left_x, post.ecb_left_y),
+        Position(post.ecb_right_x, post.ecb_right_y),
+    )
+    player.ecb_top = (post.ecb_top_x, post.ecb_top_y)
+    player.ecb_bottom = (post.ecb_bottom_x, post.ecb_bottom_y)
+    player.ecb_left = (post.ecb_left_x, post.ecb_left_y)
+    player.ecb_right = (post.ecb_right_x, post.ecb_right_y)
+
+
+def _load_iasa(player):
+    # The IASA flag doesn't set or reset for special attacks, so it's False for
+    #   every non-A attack
+    action = player.action.value
+    if not player._is_nana and (
+        action < Action.NEUTRAL_ATTACK_1.value or action > Action.DAIR.value
+    ):
+        player.iasa = False
+    else:
+        player.iasa = _PLAYER_DEFAULTS["iasa"]
+
+
+def _load_controller_state(player):
+    controller_state = ControllerState()
+    pre = player._pre
+    if pre is not None and "controller_state" in player._fields:
+        controller_state.main_stick = (
+            (pre.main_stick_x / 2) + 0.5,
+            (pre.main_stick_y / 2) + 0.5,
+        )
+        controller_state.c_stick = (
+            (pre.c_stick_x / 2) + 0.5,
+            (pre.c_stick_y / 2) + 0.5,
+        )
+        controller_state.raw_main_stick = (pre.raw_main_stick_x, pre.raw_main_stick_y)
+        # The game interprets both shoulders together, so the processed value will
+        #   always be the same
+        controller_state.l_shoulder = pre.trigger
+        controller_state.r_shoulder = pre.trigger
+        controller_state.buttons = pre.buttons
+    player.controller_state = controller_state
+
+
+def _defaults(*names):
+    def loader(player):
+        for name in names:
+            setattr(player, name, _PLAYER_DEFAULTS[name])
+
+    return loader
+
+
+def _load_default_position(player):
+    player.position = Position()
+    _defaults("x", "y")(player)
+
+
+def _load_default_ecb(player):
+    player.ecb = ECB()
+    _defaults("ecb_top", "ecb_bottom", "ecb_left", "ecb_right")(player)
+
+
+def _load_cursor(player):
+    player.cursor = Cursor()
+
+
+_PLAYER_DEFAULTS = {
+    name: getattr(PlayerState(), name)
+    for name in PlayerState.__slots__
+    if name not in ("position", "cursor", "ecb", "controller_state")
+}
+
+# What each POST_FRAME loader fills in
+_POST_LOADERS = {
+    _load_position: ("position", "x", "y"),
+    _load_character: ("character",),
+    _load_action: ("action",),
+    _load_action_frame: ("action_frame",),
+    _load_facing: ("facing",),
+    _load_percent: ("percent",),
+    _load_shield_strength: ("shield_strength",),
+    _load_stock: ("stock",),
+    _load_is_powershield: ("is_powershield",),
+    _load_hitstun_frames_left: ("hitstun_frames_left",),
+    _load_on_ground: ("on_ground",),
+    _load_jumps_left: ("jumps_left",),
+    _load_invulnerable: ("invulnerable",),
+    _load_speed: (
+        "speed_air_x_self",
+        "speed_y_self",
+        "speed_x_attack",
+        "speed_y_attack",
+        "speed_ground_x_self",
+    ),
+    _load_hitlag_left: ("hitlag_left",),
+    _load_moonwalkwarning: ("moonwalkwarning",),
+    _load_off_stage: ("off_stage",),
+    _load_ecb: ("ecb", "ecb_top", "ecb_bottom", "ecb_left", "ecb_right"),
+}
+# Filling in a field's attributes when it isn't decoded
+_LOADER_DEFAULTS = {
+    loader.field: _defaults(*names) for loader, names in _POST_LOADERS.items()
+}
+_LOADER_DEFAULTS["position"] = _load_default_position
+_LOADER_DEFAULTS["ecb"] = _load_default_ecb
+
+_LOADERS = {}
+"""The loader that fills in each attribute"""
+for _name in PlayerState.__slots__:
+    _LOADERS[_name] = _defaults(_name)
+for _loader, _names in _POST_LOADERS.items():
+    for _name in _names:
+        _LOADERS[_name] = _loader
+_LOADERS["iasa"] = _load_iasa
+_LOADERS["controller_state"] = _load_controller_state
+_LOADERS["cursor"] = _load_cursor
+_LOADERS["invulnerability_left"] = _defaults("invulnerability_left")
+
+_POST_ATTRIBUTES = tuple(name for names in _POST_LOADERS.values() for name in names) + (
+    "iasa",
+    "invulnerability_left",
+)
+_PRE_ATTRIBUTES = ("controller_state",)
@@ -0,0 +1,270 @@
+"""Flatten GameStates into fixed-layout numpy vectors, for machine learning
+
+An ObservationSchema lays out every number a model usually wants from a frame (the
+game, then each player, then the projectiles) as columns of one float32 vector.
+The layout only depends on the schema's options and OBSERVATION_VERSION, so a
+model trained on one version's vectors can rely on the same columns meaning the
+same things.
+
+Enums (character, action, stage, projectile type) are stored as their values,
+and bools as 0 or 1. Players that aren't in the game, and unused projectile slots,
+are all zeros, including their "present" column.
+"""
+
+import struct
+
+import numpy as np
+
+from melee.controller import BUTTON_BITS
+
+OBSERVATION_VERSION = 1
+"""Bump this whenever the columns of an ObservationSchema change"""
+
+GAME_FEATURES = ("frame", "stage", "distance")
+"""Columns for the game as a whole, at the start of the vector"""
+
+PLAYER_FEATURES = (
+    "present",
+    "character",
+    "action",
+    "action_frame",
+    "x",
+    "y",
+    "speed_air_x_self",
+    "speed_y_self",
+    "speed_x_attack",
+    "speed_y_attack",
+    "speed_ground_x_self",
+    "percent",
+    "stock",
+    "shield_strength",
+    "facing",
+    "on_ground",
+    "off_stage",
+    "jumps_left",
+    "hitlag_left",
+    "hitstun_frames_left",
+    "invulnerable",
+    "invulnerability_left",
+    "ecb_top_x",
+    "ecb_top_y",
+    "ecb_bottom_x",
+    "ecb_bottom_y",
+    "ecb_left_x",
+    "ecb_left_y",
+    "ecb_right_x",
+    "ecb_right_y",
+    "main_stick_x",
+    "main_stick_y",
+    "c_stick_x",
+    "c_stick_y",
+    "l_shoulder",
+    "r_shoulder",
+) + tuple(button.name.lower() for button in BUTTON_BITS)
+"""Columns for each player, and for each Nana if the schema has them"""
+
+PROJECTILE_FEATURES = (
+    "present",
+    "x",
+    "y",
+    "x_speed",
+    "y_speed",
+    "owner",
+    "type",
+    "subtype",
+    "frame",
+)
+"""Columns for each projectile slot"""
+
+_FLOAT = struct.Struct("<f")
+_GAME = struct.Struct("<%df" % len(GAME_FEATURES))
+_PLAYER = struct.Struct("<%df" % len(PLAYER_FEATURES))
+_PROJECTILE = struct.Struct("<%df" % len(PROJECTILE_FEATURES))
+# Where each button's bit is in the button word, in BUTTON_BITS order
+_BUTTON_SHIFTS = tuple(bit.bit_length() - 1 for bit in BUTTON_BITS.values())
+
+
+def _pack_player(out, offset, player):
+    controller = player.controller_state
+    buttons = controller.buttons
+    _PLAYER.pack_into(
+        out,
+        offset,
+        1,
+        player.character.value,
+        player.action.value,
+        player.action_frame,
+        player.position.x,
+        player.position.y,
+        player.speed_air_x_self,
+        player.speed_y_self,
+        player.speed_x_attack,
+        player.speed_y_attack,
+        player.speed_ground_x_self,
+        player.percent,
+        player.stock,
+        player.shield_strength,
+        player.facing,
+        player.on_ground,
+        player.off_stage,
+        player.jumps_left,
+        player.hitlag_left,
+        player.hitstun_frames_left,
+        player.invulnerable,
+        player.invulnerability_left,
+        *player.ecb_top,
+        *player.ecb_bottom,
+        *player.ecb_left,
+        *player.ecb_right,
+        *controller.main_stick,
+        *controller.c_stick,
+        controller.l_shoulder,
+        controller.r_shoulder,
+        *[buttons >> shift & 1 for shift in _BUTTON_SHIFTS],
+    )
+
+
+def _pack_projectile(out, offset, projectile):
+    _PROJECTILE.pack_into(
+        out,
+        offset,
+        1,
+        projectile.x,
+        projectile.y,
+        projectile.x_speed,
+        projectile.y_speed,
+        projectile.owner,
+        projectile.type.value,
+        projectile.subtype,
+        projectile.frame,
+    )
+
+
+class ObservationSchema:
+    """The layout of the observation vector made from each GameState
+
+    The vector is the GAME_FEATURES, then the PLAYER_FEATURES of each port in
+    ports (followed by that port's Nana, with nana on), then the PROJECTILE_FEATURES
+    of each projectile slot. columns names every one of them.
+    """
+
+    def __init__(self, ports=(1, 2, 3, 4), nana=True, projectiles=8):
+        """Create a schema
+
+        Args:
+            ports (list of int): Controller ports to include, in order
+            nana (bool): Include a Nana after each player, for Ice Climbers
+            projectiles (int): How many projectile slots. Any more projectiles than
+                this are left out
+        """
+        self.version = OBSERVATION_VERSION
+        """(int): The OBSERVATION_VERSION this schema lays vectors out by"""
+        self.ports = tuple(ports)
+        self.nana = nana
+        self.projectiles = projectiles
+        columns = list(GAME_FEATURES)
+        for port in self.ports:
+            prefixes = ["p%d_" % port]
+            if nana:
+                prefixes.append("p%d_nana_" % port)
+            for prefix in prefixes:
+                columns.extend(prefix + name for name in PLAYER_FEATURES)
+        for slot in range(projectiles):
+            columns.extend(
+                "projectile%d_%s" % (slot, name) for name in PROJECTILE_FEATURES
+            )
+        self.columns = tuple(columns)
+        """(tuple of str): The name of every column, in order"""
+        self.size = len(columns)
+        """(int): Length of each vector"""
+        self._index = {name: index for index, name in enumerate(columns)}
+        # Byte offsets of each block of columns. Only the blocks with something in
+        #   them get written, over zeros
+        self._players = tuple(
+            (
+                port,
+                self._offset("p%d_present" % port),
+                self._offset("p%d_nana_present" % port) if nana else None,
+            )
+            for port in self.ports
+        )
+        self._projectile_offsets = tuple(
+            self._offset("projectile%d_present" % slot) for slot in range(projectiles)
+        )
+
+    def __reduce__(self):
+        return (ObservationSchema, (self.ports, self.nana, self.projectiles))
+
+    def index(self, column):
+        """Where a column is in the vector, such as index("p1_x")"""
+        return self._index[column]
+
+    def _offset(self, column):
+        return self._index[column] * _FLOAT.size
+
+    def fill(self, gamestate, out=None):
+        """Write the vector for a GameState
+
+        Args:
+            gamestate (GameState): The frame
+            out (np.ndarray): float32 array of shape (size,) to write into. None
+                makes a new one
+
+        Returns:
+            np.ndarray: out
+        """
+        out = self._output(out, (self.size,))
+        out.fill(0)
+        self._pack(out, 0, gamestate)
+        return out
+
+    def fill_batch(self, gamestates, out=None):
+        """Write the vectors for a list of GameStates, one row each
+
+        Args:
+            gamestates (list of GameState): The frames
+            out (np.ndarray): float32 array of shape (len(gamestates), size) to
+                write into. None makes a new one
+
+        Returns:
+            np.ndarray: out
+        """
+        out = self._output(out, (len(gamestates), self.size))
+        out.fill(0)
+        row_size = self.size * _FLOAT.size
+        for row, gamestate in enumerate(gamestates):
+            self._pack(out, row * row_size, gamestate)
+        return out
+
+    def _pack(self, out, offset, gamestate):
+        """Write a GameState's vector into out at offset, which is already zeroed"""
+        _GAME.pack_into(
+            out, offset, gamestate.frame, gamestate.stage.value, gamestate.distance
+        )
+        players = gamestate.players
+        for port, player_offset, nana_offset in self._players:
+            player = players.get(port)
+            if player is None:
+                continue
+            _pack_player(out, offset + player_offset, player)
+            if nana_offset is not None and player.nana is not None:
+                _pack_player(out, offset + nana_offset, player.nana)
+        for projectile, projectile_offset in zip(
+            gamestate.projectiles, self._projectile_offsets
+        ):
+            _pack_projectile(out, offset + projectile_offset, projectile)
+
+    @staticmethod
+    def _output(out, shape):
+        if out is None:
+            return np.empty(shape, np.float32)
+        if out.shape != shape or out.dtype != np.float32 or not out.flags.c_contiguous:
+            raise ValueError(
+                "Observation buffers must be contiguous float32 arrays of shape "
+                + str(shape)
+            )
+        return out
+
+
+DEFAULT_SCHEMA = ObservationSchema()
+"""All four ports, with Nana, and 8 projectile slots"""
@@ -0,0 +1,689 @@
+"""Bulk decoding of SLP replay files
+
+Stepping a Console through a file builds a full GameState for every frame, which is
+what you want for a bot, but is very slow when you just want the numbers out of a
+large number of replays. The functions here decode a whole replay in one pass into
+per-port numpy arrays instead.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import struct
+import tempfile
+from collections import deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+from melee import enums
+from melee.events import (
+    GAME_START_DECODER,
+    GAME_START_FIELDS,
+    GAME_START_PLAYER_DECODER,
+    GAME_START_PLAYER_FIELDS,
+    GAME_START_PLAYER_STRIDE,
+    POST_FRAME_FIELDS,
+    PRE_FRAME_FIELDS,
+    fields_in,
+)
+from melee.slpfilestreamer import (
+    RAW_START,
+    EventType,
+    SLPFileStreamer,
+    read_metadata,
+    read_payload_sizes,
+    read_raw_length,
+)
+from melee.version import __version__
+
+# Fields that identify the event rather than describe the player
+_HEADER_FIELDS = ("frame", "port", "is_nana")
+# Fields in the POST_FRAME event that describe the whole game rather than the player
+_GAME_FIELDS = ("fod_platform_left", "fod_platform_right")
+
+PLAYER_FIELDS = tuple(
+    (name, offset, fmt)
+    for name, offset, fmt in POST_FRAME_FIELDS + PRE_FRAME_FIELDS
+    if name not in _HEADER_FIELDS + _GAME_FIELDS
+)
+"""Every per-player field that a Replay holds, as (name, offset, format)"""
+
+PLAYER_DTYPE = np.dtype([(name, fmt) for name, _, fmt in PLAYER_FIELDS])
+"""Numpy dtype of the per-player frame records in a Replay"""
+
+DECODER_VERSION = 1
+"""Bump this whenever decode_replay() output changes. Invalidates every ReplayCache"""
+
+
+class ReplayLoadError(Exception):
+    """Raised when an SLP file can't be read"""
+
+    def __init__(self, message):
+        self.message = message
+
+
+class Replay:
+    """The contents of an entire SLP file, decoded into numpy arrays
+
+    Each player gets a structured array with one record per frame of the game, with
+    the fields listed in PLAYER_DTYPE. Values are exactly as recorded in the replay.
+    So unlike a PlayerState, facing is the raw float (+1 right, -1 left), action_frame
+    is not re-indexed, and enums are left as plain integers. Fields that the replay's
+    SLP version doesn't record are zero.
+    """
+
+    def __init__(self):
+        self.path = ""
+        """(str): Path of the SLP file"""
+        self.slp_version = "unknown"
+        """(str): The SLP version of the file"""
+        self.stage = enums.Stage.NO_STAGE
+        """(enums.Stage): The stage being played on"""
+        self.is_teams = False
+        """(bool): Is this a teams game?"""
+        self.frames = np.zeros(0, dtype=np.int32)
+        """(np.ndarray): Frame number of each row in the player arrays"""
+        self.players = dict()
+        """(dict of int - np.ndarray): Per-frame player records. Key is controller port"""
+        self.nana = dict()
+        """(dict of int - np.ndarray): Per-frame records for Nana, for Ice Climbers players"""
+        self.metadata = dict()
+        """(dict): The replay's metadata block (startAt, lastFrame, players, etc...)"""
+
+
+def _payload_sizes(raw):
+    """Read the PAYLOADS event at the start of the raw stream
+
+    Returns:
+        (list, int): The size of each event type (including the command byte), and
+            the offset of the first event after the PAYLOADS event
+    """
+    eventsize = [0] * 0x100
+    if len(raw) < 2 or raw[0] != EventType.PAYLOADS.value:
+        raise ReplayLoadError("Replay does not start with a PAYLOADS event")
+    if len(raw) < raw[1] + 1:
+        raise ReplayLoadError("Replay is cut short in its PAYLOADS event")
+    return eventsize, read_payload_sizes(raw, 0, eventsize)
+
+
+def _scan_events(raw, eventsize, index):
+    """Walk the event stream and record where each event we care about starts
+
+    Returns:
+        dict of int - list: Event offsets, keyed by command byte
+    """
+    wanted = (
+        EventType.GAME_START.value,
+        EventType.PRE_FRAME.value,
+        EventType.POST_FRAME.value,
+    )
+    offsets = {command: [] for command in wanted}
+    end = len(raw)
+    while index < end:
+        command = raw[index]
+        size = eventsize[command]
+        # An unknown event or a truncated one means the rest of the file is garbage
+        if size == 0 or index + size > end:
+            break
+        if command in offsets:
+            offsets[command].append(index)
+        index += size
+    return offsets
+
+
+def _column(data, offsets, offset, fmt):
+    """Read one field out of every event at the given offsets, all at once"""
+    width = struct.calcsize(fmt)
+    indices = (offsets + offset)[:, np.newaxis] + np.arange(width)
+    return data[indices].view(">" + fmt)[:, 0]
+
+
+def _last_per_frame(rows):
+    """Indices into rows of the final occurrence of each distinct row
+
+    Rollback can record the same frame more than once. The last copy is the real one.
+    """
+    _, reverse_index = np.unique(rows[::-1], return_index=True)
+    return len(rows) - 1 - reverse_index
+
+
+def _fill_players(replay, data, offsets, fields, first_frame, dtype, wanted):
+    """Decode one event type into the replay's per-port arrays
+
+    Only the fields in dtype are decoded, for the (port, is_nana) pairs in wanted
+    """
+    if len(offsets) == 0:
+        return
+    ports = data[offsets + 0x5]
+    is_nana = data[offsets + 0x6]
+    rows = _column(data, offsets, 0x1, "i").astype(np.int64) - first_frame
+    for port in np.unique(ports):
+        for nana in (0, 1):
+            if (int(port) + 1, nana) not in wanted:
+                continue
+            selected = np.flatnonzero((ports == port) & (is_nana == nana))
+            if len(selected) == 0:
+                continue
+            selected = selected[_last_per_frame(rows[selected])]
+            target = replay.nana if nana else replay.players
+            array = target.get(int(port) + 1)
+            if array is None:
+                array = np.zeros(len(replay.frames), dtype=dtype)
+                target[int(port) + 1] = array
+            for name, offset, fmt in fields:
+                if name not in dtype.names:
+                    continue
+                array[name][rows[selected]] = _column(
+                    data, offsets[selected], offset, fmt
+                )
+
+
+def _player_dtype(fields):
+    """The dtype of player arrays holding just the given fields, in that order"""
+    if fields is None:
+        return PLAYER_DTYPE
+    unknown = [name for name in fields if name not in PLAYER_DTYPE.names]
+    if unknown:
+        raise ValueError("Unknown player fields: " + ", ".join(unknown))
+    return np.dtype([(name, PLAYER_DTYPE[name]) for name in fields])
+
+
+def decode_replay(raw, metadata=None, fields=None, ports=None, nana=True):
+    """Decode a raw SLP event stream into a Replay
+
+    Args:
+        raw (bytes-like): The 'raw' event stream of an SLP file
+        metadata (dict): The file's metadata block, if any
+        fields (list of str): Only decode these per-player fields (see
+            PLAYER_DTYPE). None decodes them all.
+        ports (list of int): Only decode these controller ports. None for all
+        nana (bool): Decode Nana, for Ice Climbers players
+
+    Returns:
+        Replay: The decoded replay
+
+    Raises:
+        ValueError: If a field isn't in PLAYER_DTYPE
+    """
+    dtype = _player_dtype(fields)
+    wanted = {
+        (port, is_nana)
+        for port in (ports if ports is not None else range(1, 5))
+        for is_nana in ((0, 1) if nana else (0,))
+    }
+    eventsize, index = _payload_sizes(raw)
+    offsets = _scan_events(raw, eventsize, index)
+    data = np.frombuffer(raw, dtype=np.uint8)
+
+    replay = Replay()
+    replay.metadata = metadata or {}
+
+    game_starts = offsets[EventType.GAME_START.value]
+    if game_starts:
+        start = game_starts[0]
+        size = eventsize[EventType.GAME_START.value]
+        values = {
+            name: struct.unpack_from(">" + fmt, raw, start + offset)[0]
+            for name, offset, fmt in fields_in(GAME_START_FIELDS, size)
+        }
+        replay.slp_version = "{}.{}.{}".format(
+            values["major"], values["minor"], values["build"]
+        )
+        replay.is_teams = values.get("is_teams", 0) != 0
+        replay.stage = enums.to_internal_stage(values.get("stage", 0))
+
+    pre_offsets = np.array(offsets[EventType.PRE_FRAME.value], dtype=np.int64)
+    post_offsets = np.array(offsets[EventType.POST_FRAME.value], dtype=np.int64)
+    if len(post_offsets) == 0:
+        return replay
+
+    post_frames = _column(data, post_offsets, 0x1, "i")
+    first_frame, last_frame = int(post_frames.min()), int(post_frames.max())
+    replay.frames = np.arange(first_frame, last_frame + 1, dtype=np.int32)
+
+    # Some old replays have a pre-frame event, but no post-frame event, for the last frame
+    if len(pre_offsets) > 0:
+        pre_frames = _column(data, pre_offsets, 0x1, "i")
+        pre_offsets = pre_offsets[
+            (pre_frames >= first_frame) & (pre_frames <= last_frame)
+        ]
+
+    pre_fields = fields_in(PRE_FRAME_FIELDS, eventsize[EventType.PRE_FRAME.value])
+    post_fields = fields_in(POST_FRAME_FIELDS, eventsize[EventType.POST_FRAME.value])
+    _fill_players(replay, data, post_offsets, post_fields, first_frame, dtype, wanted)
+    _fill_players(replay, data, pre_offsets, pre_fields, first_frame, dtype, wanted)
+    return replay
+
+
+def read_replay(path, fields=None, cache=None, profile=None):
+    """Read an entire SLP file into a Replay
+
+    This is much faster than stepping a Console through the file, but only gives you
+    the raw per-frame values. See Replay for details.
+
+    Args:
+        path (str): Path to the SLP file
+        fields (list of str): Only decode these per-player fields (see
+            PLAYER_DTYPE). None decodes them all.
+        cache (ReplayCache): Load the decoded replay from this cache if it's there,
+            and save it there if it isn't. Arrays loaded from the cache are read-only.
+        profile (DecodeProfile): Only decode the ports in this profile. Unless
+            fields is given, only the replay fields its fields need are decoded.
+
+    Returns:
+        Replay: The decoded replay
+
+    Raises:
+        ReplayLoadError: If the file is not a valid SLP file
+    """
+    ports, nana = None, True
+    if profile is not None:
+        ports, nana = profile.ports, profile.nana
+        if fields is None:
+            fields = [
+                name for name, _, _ in PLAYER_FIELDS if name in profile.raw_fields
+            ]
+    if fields is not None:
+        fields = list(fields)
+    if ports is not None:
+        ports = sorted(ports)
+
+    key = None
+    if cache is not None:
+        key = cache.key(path, fields, ports, nana)
+        replay = cache.load(key)
+        if replay is not None:
+            replay.path = str(path)
+            return replay
+
+    streamer = SLPFileStreamer(path, use_mmap=True)
+    if not streamer.connect():
+        raise ReplayLoadError("Could not load SLP file: " + str(path))
+    try:
+        replay = decode_replay(
+            streamer._contents, streamer.metadata, fields, ports, nana
+        )
+    finally:
+        streamer.shutdown()
+    replay.path = str(path)
+    if cache is not None:
+        cache.store(key, replay)
+    return replay
+
+
+class PlayerInfo(
+    namedtuple(
+        "PlayerInfo", ["character", "costume", "team_id", "cpu_level", "player_type"]
+    )
+):
+    """One player's settings from the GAME_START event
+
+    character is an enums.Character. cpu_level is 0 for anyone who isn't a CPU.
+    player_type is as recorded: 0 human, 1 CPU, 2 demo.
+    """
+
+    __slots__ = ()
+
+
+class ReplayInfo(
+    namedtuple(
+        "ReplayInfo",
+        [
+            "path",
+            "slp_version",
+            "stage",
+            "is_teams",
+            "players",
+            "last_frame",
+            "start_at",
+            "played_on",
+            "metadata",
+        ],
+    )
+):
+    """Summary of an SLP file, from its game start and metadata only
+
+    players is a dict of PlayerInfo keyed by controller port, holding just the ports
+    that are in the game. last_frame, start_at and played_on come from the metadata
+    block, and are None if the file doesn't have them. metadata is the whole block.
+    """
+
+    __slots__ = ()
+
+
+# Player blocks in the GAME_START event with this type are empty ports
+_EMPTY_PLAYER_TYPE = 3
+# Enough to hold the PAYLOADS and GAME_START events of any SLP version so far
+_SCAN_HEAD_SIZE = 1024
+
+
+def scan_metadata(path):
+    """Quickly read who played what, and where, from an SLP file
+
+    Only the start of the event stream and the metadata at the end of the file are
+    read. None of the frames are decoded, so this is suitable for indexing very large
+    replay libraries.
+
+    Args:
+        path (str): Path to the SLP file
+
+    Returns:
+        ReplayInfo: Summary of the replay
+
+    Raises:
+        ReplayLoadError: If the file is not a valid SLP file
+    """
+    with open(path, mode="rb") as file:
+        head = file.read(RAW_START + _SCAN_HEAD_SIZE)
+        raw_length = read_raw_length(head)
+        if raw_length is None:
+            raise ReplayLoadError("Not an SLP file: " + str(path))
+        raw = head[RAW_START:]
+        eventsize, index = _payload_sizes(raw)
+        size = eventsize[EventType.GAME_START.value]
+        if index + size > len(raw):
+            raw += file.read(index + size - len(raw))
+        if size == 0 or index + size > len(raw):
+            raise ReplayLoadError("SLP file has no game start: " + str(path))
+        if raw[index] != EventType.GAME_START.value:
+            raise ReplayLoadError("SLP file has no game start: " + str(path))
+
+        # A raw length of 0 means the game is still being recorded, and has no
+        #   metadata yet
+        metadata = {}
+        if raw_length:
+            file.seek(RAW_START + raw_length)
+            metadata = read_metadata(file.read())
+            if metadata is None:
+                raise ReplayLoadError("Corrupt metadata in SLP file: " + str(path))
+
+    start = GAME_START_DECODER.decode(raw, index, size)
+    players = dict()
+    for port in range(4):
+        block = GAME_START_PLAYER_FIELDS[0][1] + (GAME_START_PLAYER_STRIDE * port)
+        if block >= size:
+            break
+        player = GAME_START_PLAYER_DECODER.decode(raw, index + block, size - block)
+        if player.player_type == _EMPTY_PLAYER_TYPE:
+            continue
+        players[port + 1] = PlayerInfo(
+            enums.to_internal(player.character),
+            player.costume,
+            player.team_id,
+            player.cpu_level if player.player_type == 1 else 0,
+            player.player_type,
+        )
+
+    return ReplayInfo(
+        str(path),
+        "{}.{}.{}".format(start.major, start.minor, start.build),
+        enums.to_internal_stage(start.stage),
+        start.is_teams != 0,
+        players,
+        metadata.get("lastFrame"),
+        metadata.get("startAt"),
+        metadata.get("playedOn"),
+        metadata,
+    )
+
+
+class CorpusResult(namedtuple("CorpusResult", ["path", "replay", "error"])):
+    """The outcome of parsing one file of a corpus
+
+    Exactly one of replay (the Replay) and error (a message saying why the file
+    couldn't be parsed) is None.
+    """
+
+    __slots__ = ()
+
+
+def _parse_corpus_file(path, fields, cache, profile):
+    """Worker for parse_corpus(). Never raises, so one bad file can't kill the batch"""
+    try:
+        replay = read_replay(path, fields, cache, profile)
+    except ReplayLoadError as error:
+        return CorpusResult(path, None, error.message)
+    # Corrupt replays can fail in all sorts of ways while decoding
+    except Exception as error:  # pylint: disable=broad-except
+        return CorpusResult(path, None, "{}: {}".format(type(error).__name__, error))
+    return CorpusResult(path, replay, None)
+
+
+def _corpus_files(paths):
+    """Expand any directories in paths into the SLP files under them"""
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.endswith(".slp"):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def parse_corpus(
+    paths,
+    fields=None,
+    workers=None,
+    ordered=True,
+    max_in_flight=None,
+    cache=None,
+    profile=None,
+):
+    """Parse many SLP files in parallel with a pool of worker processes
+
+    Results are streamed back as they're ready. At most max_in_flight files are
+    being parsed or waiting to be collected at any one time, so memory use stays
+    bounded no matter how big the corpus is. Files that fail to parse show up as
+    results with an error instead of stopping the batch.
+
+    Args:
+        paths (iterable of str): SLP files to parse. Directories are searched
+            (recursively) for .slp files. May be a generator.
+        fields (list of str): Only decode these per-player fields (see
+            PLAYER_DTYPE). None decodes them all.
+        workers (int): Number of worker processes. None for one per CPU. 0 parses
+            everything in this process, which is handy for debugging.
+        ordered (bool): Yield results in the same order as paths. Otherwise they
+            come back in the order they finish.
+        max_in_flight (int): Limit on files being worked on at once. Defaults to
+            twice the number of workers.
+        cache (ReplayCache): Cache of decoded replays to use. See read_replay()
+        profile (DecodeProfile): Ports and fields to decode. See read_replay()
+
+    Yields:
+        CorpusResult: One per file
+    """
+    files = _corpus_files(paths)
+    if workers == 0:
+        for path in files:
+            yield _parse_corpus_file(path, fields, cache, profile)
+        return
+
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or 2 * workers
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        in_flight = deque()
+        for path in files:
+            in_flight.append(
+                pool.submit(_parse_corpus_file, path, fields, cache, profile)
+            )
+            while len(in_flight) >= max_in_flight:
+                yield from _collect(in_flight, ordered)
+        while in_flight:
+            yield from _collect(in_flight, ordered)
+
+
+def _collect(in_flight, ordered):
+    """Wait for and remove at least one finished future from in_flight"""
+    if ordered:
+        yield in_flight.popleft().result()
+        return
+    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+    for future in done:
+        in_flight.remove(future)
+        yield future.result()
+
+
+class ReplayCache:
+    """An on-disk cache of decoded replays, so that each file only gets decoded once
+
+    Pass one to read_replay() or parse_corpus(). Entries are keyed by a hash of the
+    file's contents along with the libmelee version, DECODER_VERSION and the fields
+    asked for, so a changed file or a new decoder never returns stale data. Cached
+    arrays are memory-mapped rather than read in.
+
+    Once the cache grows past max_size bytes, the least recently used entries are
+    deleted. Entries from other versions of the decoder go first.
+    """
+
+    def __init__(self, directory, max_size=10 * 2**30):
+        """Create a cache, or open an existing one
+
+        Args:
+            directory (str): Where to keep the cache. Created if it doesn't exist
+            max_size (int): Size limit of the cache, in bytes
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self._size = None
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, path, fields=None, ports=None, nana=True):
+        """The cache key for an SLP file decoded with the given read_replay() options"""
+        digest = hashlib.blake2b(digest_size=16)
+        with open(path, mode="rb") as file:
+            for chunk in iter(lambda: file.read(2**20), b""):
+                digest.update(chunk)
+        digest.update(self._version().encode())
+        digest.update(repr((fields, ports, nana)).encode())
+        return digest.hexdigest()
+
+    @staticmethod
+    def _version():
+        return "{}-{}".format(__version__, DECODER_VERSION)
+
+    def load(self, key):
+        """Get a Replay out of the cache
+
+        Returns:
+            Replay: The cached replay, with memory-mapped arrays. None on a miss
+        """
+        entry = os.path.join(self.directory, key)
+        try:
+            with open(os.path.join(entry, "replay.json")) as file:
+                info = json.load(file)
+            replay = Replay()
+            replay.frames = np.load(os.path.join(entry, "frames.npy"), mmap_mode="r")
+            for name, target in (("players", replay.players), ("nana", replay.nana)):
+                for port in info[name]:
+                    target[port] = np.load(
+                        os.path.join(entry, "{}_{}.npy".format(name, port)),
+                        mmap_mode="r",
+                    )
+            # Mark the entry as recently used
+            os.utime(os.path.join(entry, "replay.json"))
+        except (OSError, ValueError, KeyError):
+            # Missing, half-evicted or otherwise broken. Just decode it again
+            return None
+        replay.slp_version = info["slp_version"]
+        replay.stage = enums.Stage(info["stage"])
+        replay.is_teams = info["is_teams"]
+        replay.metadata = info["metadata"]
+        return replay
+
+    def store(self, key, replay):
+        """Save a Replay in the cache, evicting old entries if it's now too big"""
+        entry = os.path.join(self.directory, key)
+        if os.path.isdir(entry):
+            return
+        info = {
+            "version": self._version(),
+            "slp_version": replay.slp_version,
+            "stage": replay.stage.value,
+            "is_teams": replay.is_teams,
+            "metadata": replay.metadata,
+            "players": sorted(replay.players),
+            "nana": sorted(replay.nana),
+        }
+        # Write it all somewhere private first, so nobody can see a partial entry
+        staging = tempfile.mkdtemp(dir=self.directory, prefix=".staging-")
+        try:
+            np.save(os.path.join(staging, "frames.npy"), replay.frames)
+            for name, arrays in (("players", replay.players), ("nana", replay.nana)):
+                for port, array in arrays.items():
+                    np.save(
+                        os.path.join(staging, "{}_{}.npy".format(name, port)), array
+                    )
+            with open(os.path.join(staging, "replay.json"), "w") as file:
+                json.dump(info, file)
+            size = _directory_size(staging)
+            os.rename(staging, entry)
+        except OSError:
+            # Most likely another process stored the same replay first
+            shutil.rmtree(staging, ignore_errors=True)
+            return
+
+        if self._size is None:
+            self._size = self.size()
+        else:
+            self._size += size
+        if self._size > self.max_size:
+            self.evict()
+
+    def size(self):
+        """Total size of everything in the cache, in bytes"""
+        return sum(size for _, _, size in self._entries().values())
+
+    def _entries(self):
+        """(stale, last used time, size) of each entry, keyed by its directory"""
+        entries = dict()
+        for name in os.listdir(self.directory):
+            entry = os.path.join(self.directory, name)
+            if name.startswith(".") or not os.path.isdir(entry):
+                continue
+            try:
+                with open(os.path.join(entry, "replay.json")) as file:
+                    stale = json.load(file).get("version") != self._version()
+                used = os.path.getmtime(os.path.join(entry, "replay.json"))
+            except (OSError, ValueError):
+                stale, used = True, 0
+            entries[entry] = (stale, used, _directory_size(entry))
+        return entries
+
+    def evict(self):
+        """Delete entries until the cache fits in max_size
+
+        Entries from other decoder versions are deleted first, then the least
+        recently used ones.
+        """
+        entries = self._entries()
+        total = sum(size for _, _, size in entries.values())
+        # Stale entries first, then oldest first
+        for entry, (_, _, size) in sorted(
+            entries.items(), key=lambda item: (not item[1][0], item[1][1])
+        ):
+            if total <= self.max_size:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+        self._size = total
+
+    def clear(self):
+        """Delete everything in the cache"""
+        for name in os.listdir(self.directory):
+            shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+        self._size = 0
+
+
+def _directory_size(directory):
+    total = 0
+    for name in os.listdir(directory):
+        try:
+            total += os.path.getsize(os.path.join(directory, name))
+        except OSError:
+            pass
+    return total
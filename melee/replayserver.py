@@ -0,0 +1,219 @@
+"""A stand-in for a Dolphin's Slippstream server, for testing without an emulator
+
+ReplayServer speaks the same ENet/JSON protocol as Slippi Dolphin on localhost, and
+plays an SLP file to whichever client connects, one frame per message. It can pace
+the frames at real time, faster, or as fast as possible, and mess with them the way
+a real network might: late frames, lost frames and repeated frames.
+"""
+
+import base64
+import json
+import multiprocessing
+import random
+import time
+
+import enet
+
+from melee.events import FRAME_NUMBER
+from melee.slpfilestreamer import EventType, SLPFileStreamer
+
+# How often the server checks on the connection while it waits, in seconds
+_WAIT_INTERVAL = 0.001
+# Melee runs at 60 frames per second
+FRAME_TIME = 1 / 60
+
+
+def _replay_messages(path):
+    """Group the events of an SLP file into messages, the way Dolphin sends them
+
+    Returns:
+        list: (frame, bytes) pairs. frame is the frame number of the frame the
+            message finishes, or None for messages that aren't a frame, such as the
+            game start and end
+    """
+    streamer = SLPFileStreamer(path)
+    streamer.connect()
+    messages = []
+    events = []
+    while True:
+        message = streamer.dispatch(False)
+        if message is None:
+            break
+        if message["type"] != "game_event":
+            continue
+        payload = bytes(message["payload"])
+        command = payload[0]
+        if command == EventType.FRAME_BOOKEND.value:
+            events.append(payload)
+            frame = FRAME_NUMBER.unpack_from(payload, 0x1)[0]
+            messages.append((frame, b"".join(events)))
+            events = []
+        elif command in (
+            EventType.PAYLOADS.value,
+            EventType.GAME_START.value,
+            EventType.GAME_END.value,
+        ):
+            messages.append((None, payload))
+        else:
+            events.append(payload)
+    return messages
+
+
+class ReplayServer:
+    """Plays an SLP file over Slippstream, like a Dolphin would play a live game
+
+    The server runs in its own process, as the ENet bindings don't let other
+    threads run while they wait on the network. Which frames are late, lost or sent
+    twice is all worked out up front, from the seed. So is when each frame goes out,
+    as an offset from start_time, so latency can be measured against it.
+
+    Frames have to end in a FRAME_BOOKEND event, so the file needs to be SLP 3.0.0
+    or later.
+    """
+
+    def __init__(
+        self,
+        path,
+        port=51441,
+        address="127.0.0.1",
+        speed=1.0,
+        jitter=0.0,
+        drop_rate=0.0,
+        duplicate_rate=0.0,
+        seed=None,
+    ):
+        """Create a server
+
+        Args:
+            path (str): SLP file to play
+            port (int): Port to listen on. Clients connect with this as slippi_port
+            address (str): Address to listen on
+            speed (float): How many times faster than real time to send frames.
+                None sends them as fast as possible.
+            jitter (float): Send each frame up to this many seconds late. Frames still
+                go out in order, so a late frame holds up the ones after it.
+            drop_rate (float): Chance of a frame not being sent at all
+            duplicate_rate (float): Chance of a frame being sent twice in a row
+            seed (int): Seed for the jitter, drops and duplicates
+        """
+        self.path = path
+        self.port = port
+        self.address = address
+        self.speed = speed
+        self._messages = _replay_messages(path)
+        self._stop_event = multiprocessing.Event()
+        self._start_time = multiprocessing.Value("d", 0.0)
+        self._process = None
+
+        self.dropped_frames = 0
+        """(int): Frames that won't be sent"""
+        self.duplicated_frames = 0
+        """(int): Frames that will be sent twice"""
+        self.frame_offsets = {}
+        """(dict): When each frame number is first sent, in seconds after start_time"""
+        # When to send each message, as (offset, index into _messages)
+        self._plan = []
+        rng = random.Random(seed)
+        frame_time = 0 if speed is None else FRAME_TIME / speed
+        frames = 0
+        offset = 0.0
+        for index, (frame, _) in enumerate(self._messages):
+            if frame is None:
+                self._plan.append((offset, index))
+                continue
+            frames += 1
+            offset = max(offset, frames * frame_time + rng.uniform(0, jitter))
+            if rng.random() < drop_rate:
+                self.dropped_frames += 1
+                continue
+            self.frame_offsets.setdefault(frame, offset)
+            self._plan.append((offset, index))
+            if rng.random() < duplicate_rate:
+                self.duplicated_frames += 1
+                self._plan.append((offset, index))
+
+    @property
+    def start_time(self):
+        """(float): The time.perf_counter() that frame_offsets count from, or 0 if
+        no client has connected yet"""
+        return self._start_time.value
+
+    def start(self):
+        """Start serving in a background process"""
+        assert self._process is None, "The server is already running"
+        process = multiprocessing.Process(target=self.serve, daemon=True)
+        process.start()
+        self._process = process
+
+    def stop(self):
+        """Stop the server, and wait for its process to finish"""
+        self._stop_event.set()
+        if self._process is not None:
+            self._process.join(1)
+            if self._process.is_alive():
+                self._process.terminate()
+            self._process = None
+
+    def serve(self):
+        """Wait for a client, play it the replay, then keep the connection up until
+        stop() is called. Blocks, so is usually called through start()."""
+        host = enet.Host(enet.Address(self.address.encode(), self.port), 1, 0, 0, 0)
+        peer = self._accept(host)
+        if peer is None:
+            return
+        start = time.perf_counter()
+        self._start_time.value = start
+        cursor = 0
+        for offset, index in self._plan:
+            while not self._stop_event.is_set():
+                delay = start + offset - time.perf_counter()
+                if delay <= 0:
+                    break
+                host.service(0)
+                time.sleep(min(delay, _WAIT_INTERVAL))
+            # Stopped. Don't rush the rest of the replay out
+            if self._stop_event.is_set():
+                break
+            message = {
+                "type": "game_event",
+                "cursor": cursor,
+                "next_cursor": cursor + 1,
+                "payload": base64.b64encode(self._messages[index][1]).decode(),
+            }
+            self._send(peer, message)
+            cursor += 1
+            host.service(0)
+        while not self._stop_event.is_set():
+            host.service(0)
+            time.sleep(_WAIT_INTERVAL)
+        peer.disconnect()
+        host.service(0)
+
+    def _accept(self, host):
+        """Wait for a client's connect_request and answer it
+
+        Returns:
+            The client's peer, or None if the server was stopped first
+        """
+        while not self._stop_event.is_set():
+            event = host.service(0)
+            if event.type == enet.EVENT_TYPE_NONE:
+                time.sleep(_WAIT_INTERVAL)
+            elif event.type == enet.EVENT_TYPE_RECEIVE:
+                request = json.loads(event.packet.data)
+                if request.get("type") == "connect_request":
+                    reply = {
+                        "type": "connect_reply",
+                        "nick": "ReplayServer",
+                        "version": "replay",
+                        "cursor": request.get("cursor", 0),
+                    }
+                    self._send(event.peer, reply)
+                    return event.peer
+        return None
+
+    @staticmethod
+    def _send(peer, message):
+        # Dolphin sends compact JSON with the keys in order, over a reliable channel
+        data = json.dumps(message, sort_keys=True, separators=(",", ":"))
+        peer.send(0, enet.Packet(data.encode(), enet.PACKET_FLAG_RELIABLE))
@@ -0,0 +1,457 @@
+"""Share each frame a Console decodes with other processes, through shared memory
+
+One Console publishes every frame into a ring of fixed size records in shared
+memory. Any number of FrameSubscribers, in any process on the same machine, read
+them from there by sequence number, without making connections of their own to
+Dolphin. See Console(publish=...). Publishing and subscribing need Python 3.8 or
+later, for multiprocessing.shared_memory.
+
+Each record is a FRAME_DTYPE. Every record starts with its sequence number, which
+works as a seqlock: it's odd while the record is being written, and 2 * (sequence
++ 1) once it's done. Readers check it before and after reading to make sure the
+record wasn't being written, or overwritten, underneath them.
+"""
+
+import struct
+import time
+
+import numpy as np
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:
+    # Before Python 3.8. The record layouts still work, but there's no publishing
+    shared_memory = None
+
+SHARED_FRAMES_MAGIC = 0x534C4D46
+SHARED_FRAMES_VERSION = 1
+MAX_PROJECTILES = 32
+"""Most projectiles in a record. Any more are left out"""
+
+PLAYER_DTYPE = np.dtype(
+    [
+        ("present", "?"),
+        ("character", "u1"),
+        ("action", "<u2"),
+        ("action_frame", "<i4"),
+        ("x", "<f4"),
+        ("y", "<f4"),
+        ("percent", "<i4"),
+        ("shield_strength", "<f4"),
+        ("stock", "u1"),
+        ("facing", "?"),
+        ("invulnerable", "?"),
+        ("invulnerability_left", "<i4"),
+        ("hitlag_left", "<i4"),
+        ("hitstun_frames_left", "<i4"),
+        ("jumps_left", "u1"),
+        ("on_ground", "?"),
+        ("off_stage", "?"),
+        ("moonwalkwarning", "?"),
+        ("is_powershield", "?"),
+        ("iasa", "?"),
+        ("speed_air_x_self", "<f4"),
+        ("speed_y_self", "<f4"),
+        ("speed_x_attack", "<f4"),
+        ("speed_y_attack", "<f4"),
+        ("speed_ground_x_self", "<f4"),
+        # top, bottom, left, right
+        ("ecb", "<f4", (4, 2)),
+        ("costume", "u1"),
+        ("cpu_level", "u1"),
+        ("team_id", "u1"),
+        ("main_stick", "<f4", (2,)),
+        ("c_stick", "<f4", (2,)),
+        ("l_shoulder", "<f4"),
+        ("r_shoulder", "<f4"),
+        # The GameCube's button word, see controller.BUTTON_BITS
+        ("buttons", "<u2"),
+        ("cursor", "<f4", (2,)),
+        ("character_selected", "u1"),
+        ("controller_status", "u1"),
+        ("coin_down", "?"),
+    ]
+)
+"""Layout of one player in a record. Enums are stored as their values"""
+
+PROJECTILE_DTYPE = np.dtype(
+    [
+        ("x", "<f4"),
+        ("y", "<f4"),
+        ("x_speed", "<f4"),
+        ("y_speed", "<f4"),
+        ("owner", "i1"),
+        ("type", "u1"),
+        ("subtype", "u1"),
+        ("frame", "<i4"),
+    ]
+)
+"""Layout of one projectile in a record"""
+
+FRAME_DTYPE = np.dtype(
+    [
+        ("sequence", "<u8"),
+        ("frame", "<i4"),
+        ("stage", "u1"),
+        ("menu_state", "u1"),
+        ("submenu", "u1"),
+        ("is_teams", "?"),
+        ("ready_to_start", "?"),
+        ("menu_selection", "<i4"),
+        ("stage_select_cursor", "<f4", (2,)),
+        ("distance", "<f4"),
+        # Indexed by port - 1
+        ("players", PLAYER_DTYPE, (4,)),
+        ("nana", PLAYER_DTYPE, (4,)),
+        ("projectile_count", "u1"),
+        ("projectiles", PROJECTILE_DTYPE, (MAX_PROJECTILES,)),
+    ]
+)
+"""Layout of one frame in shared memory. Players that aren't in the game have
+present set to False, and only the first projectile_count projectiles are real"""
+
+_HEADER_DTYPE = np.dtype(
+    [
+        ("magic", "<u4"),
+        ("version", "<u4"),
+        ("slots", "<u4"),
+        ("head", "<i8"),
+    ]
+)
+
+# struct codes for the numpy types used above, by kind and size
+_STRUCT_CODES = {
+    ("b", 1): "?",
+    ("u", 1): "B",
+    ("i", 1): "b",
+    ("u", 2): "H",
+    ("i", 4): "i",
+    ("f", 4): "f",
+    ("u", 8): "Q",
+    ("i", 8): "q",
+}
+
+
+def dtype_struct(dtype, names):
+    """A struct.Struct that packs some of the fields of a flat dtype, in order
+
+    Array fields take one value per element.
+
+    Args:
+        dtype (np.dtype): A structured dtype, of the types these records use
+        names (list of str): The fields, in the order they're in the dtype
+    """
+    codes = []
+    for name in names:
+        field = dtype.fields[name][0]
+        count = int(np.prod(field.shape))
+        codes.append(_STRUCT_CODES[field.base.kind, field.base.itemsize] * count)
+    return struct.Struct("<" + "".join(codes))
+
+
+# Publishing packs records with struct, which is many times faster than having
+#   numpy convert them
+_SEQUENCE = struct.Struct("<Q")
+_FRAME_FIELDS = FRAME_DTYPE.names[: FRAME_DTYPE.names.index("players")]
+_FRAME_STRUCT = dtype_struct(FRAME_DTYPE, _FRAME_FIELDS)
+_PLAYER_STRUCT = dtype_struct(PLAYER_DTYPE, PLAYER_DTYPE.names)
+_PROJECTILE_STRUCT = dtype_struct(PROJECTILE_DTYPE, PROJECTILE_DTYPE.names)
+_PLAYERS_OFFSET = FRAME_DTYPE.fields["players"][1]
+_NANA_OFFSET = FRAME_DTYPE.fields["nana"][1]
+_PROJECTILE_COUNT_OFFSET = FRAME_DTYPE.fields["projectile_count"][1]
+_PROJECTILES_OFFSET = FRAME_DTYPE.fields["projectiles"][1]
+_NO_PLAYER = bytes(PLAYER_DTYPE.itemsize)
+# Names of the shared memory published from this process
+_published = set()
+
+
+def _require_shared_memory():
+    if shared_memory is None:
+        raise RuntimeError("Sharing frames needs Python 3.8 or later")
+
+
+def _pack_player(buffer, offset, player):
+    if player is None:
+        buffer[offset : offset + _PLAYER_STRUCT.size] = _NO_PLAYER
+        return
+    controller = player.controller_state
+    _PLAYER_STRUCT.pack_into(
+        buffer,
+        offset,
+        True,
+        player.character.value,
+        player.action.value,
+        player.action_frame,
+        player.position.x,
+        player.position.y,
+        player.percent,
+        player.shield_strength,
+        player.stock,
+        player.facing,
+        player.invulnerable,
+        player.invulnerability_left,
+        player.hitlag_left,
+        player.hitstun_frames_left,
+        player.jumps_left,
+        player.on_ground,
+        player.off_stage,
+        player.moonwalkwarning,
+        player.is_powershield,
+        bool(player.iasa),
+        player.speed_air_x_self,
+        player.speed_y_self,
+        player.speed_x_attack,
+        player.speed_y_attack,
+        player.speed_ground_x_self,
+        *player.ecb_top,
+        *player.ecb_bottom,
+        *player.ecb_left,
+        *player.ecb_right,
+        player.costume,
+        player.cpu_level,
+        player.team_id,
+        *controller.main_stick,
+        *controller.c_stick,
+        controller.l_shoulder,
+        controller.r_shoulder,
+        controller.buttons,
+        player.cursor_x,
+        player.cursor_y,
+        player.character_selected.value,
+        player.controller_status.value,
+        player.coin_down,
+    )
+
+
+def pack_frame(buffer, offset, gamestate, sequence=0):
+    """Write a GameState into buffer as a FRAME_DTYPE record
+
+    Args:
+        buffer: Writable buffer to write into
+        offset (int): Where in buffer the record starts
+        gamestate (GameState): The frame
+        sequence (int): Value of the record's sequence field
+    """
+    _FRAME_STRUCT.pack_into(
+        buffer,
+        offset,
+        sequence,
+        gamestate.frame,
+        gamestate.stage.value,
+        gamestate.menu_state.value,
+        gamestate.submenu.value,
+        gamestate.is_teams,
+        gamestate.ready_to_start,
+        gamestate.menu_selection,
+        gamestate.stage_select_cursor_x,
+        gamestate.stage_select_cursor_y,
+        gamestate.distance,
+    )
+    players = gamestate.players
+    for port in range(1, 5):
+        player = players.get(port)
+        index = (port - 1) * _PLAYER_STRUCT.size
+        _pack_player(buffer, offset + _PLAYERS_OFFSET + index, player)
+        _pack_player(
+            buffer,
+            offset + _NANA_OFFSET + index,
+            None if player is None else player.nana,
+        )
+    projectiles = gamestate.projectiles[:MAX_PROJECTILES]
+    buffer[offset + _PROJECTILE_COUNT_OFFSET] = len(projectiles)
+    # Projectiles past the count are left as they were
+    cursor = offset + _PROJECTILES_OFFSET
+    for projectile in projectiles:
+        _PROJECTILE_STRUCT.pack_into(
+            buffer,
+            cursor,
+            projectile.x,
+            projectile.y,
+            projectile.x_speed,
+            projectile.y_speed,
+            projectile.owner,
+            projectile.type.value,
+            projectile.subtype,
+            projectile.frame,
+        )
+        cursor += _PROJECTILE_STRUCT.size
+
+
+class FramePublisher:
+    """Writes frames into a ring in shared memory, for FrameSubscribers to read"""
+
+    def __init__(self, name=None, slots=256):
+        """Create the shared memory
+
+        Args:
+            name (str): Name of the shared memory, for subscribers to open. None
+                picks a unique one, see name
+            slots (int): How many frames the ring holds. A subscriber more than
+                this many frames behind has missed some
+
+        Raises:
+            RuntimeError: Before Python 3.8, which has no shared memory
+        """
+        _require_shared_memory()
+        size = _HEADER_DTYPE.itemsize + slots * FRAME_DTYPE.itemsize
+        self._memory = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self._header = np.ndarray((), _HEADER_DTYPE, buffer=self._memory.buf)
+        self._header[()] = (SHARED_FRAMES_MAGIC, SHARED_FRAMES_VERSION, slots, -1)
+        _published.add(self._memory._name)
+        self.slots = slots
+        self.sequence = -1
+        """(int): Sequence number of the last frame published, or -1 for none"""
+
+    @property
+    def name(self):
+        """(str): The name subscribers open the shared memory with"""
+        return self._memory.name
+
+    def publish(self, gamestate):
+        """Write a GameState into the next slot of the ring
+
+        Returns:
+            int: Its sequence number
+        """
+        sequence = self.sequence + 1
+        buffer = self._memory.buf
+        offset = _HEADER_DTYPE.itemsize + (sequence % self.slots) * FRAME_DTYPE.itemsize
+        # Mark the slot as being written, then write it, then mark it as done
+        _SEQUENCE.pack_into(buffer, offset, 2 * sequence + 1)
+        pack_frame(buffer, offset, gamestate, 2 * sequence + 1)
+        _SEQUENCE.pack_into(buffer, offset, 2 * (sequence + 1))
+        self._header["head"] = sequence
+        self.sequence = sequence
+        return sequence
+
+    def close(self):
+        """Remove the shared memory. Subscribers that have it open keep it until
+        they close it too"""
+        if self._memory is not None:
+            self._header = None
+            _published.discard(self._memory._name)
+            self._memory.close()
+            self._memory.unlink()
+            self._memory = None
+
+
+class FrameSubscriber:
+    """Reads the frames a FramePublisher writes, from any process"""
+
+    def __init__(self, name):
+        """Open a publisher's shared memory
+
+        Args:
+            name (str): The publisher's name
+
+        Raises:
+            FileNotFoundError: If there's no such shared memory
+            ValueError: If it isn't from a FramePublisher
+            RuntimeError: Before Python 3.8, which has no shared memory
+        """
+        _require_shared_memory()
+        try:
+            memory = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # Before Python 3.13, every process that opens shared memory cleans it
+            #   up on exit, publisher or not. Stop it doing that
+            memory = shared_memory.SharedMemory(name=name)
+            # The tracker only has one entry per name, which is the publisher's
+            #   if it's in this process
+            if memory._name not in _published:
+                resource_tracker.unregister(memory._name, "shared_memory")
+        self._memory = memory
+        self._header = np.ndarray((), _HEADER_DTYPE, buffer=memory.buf)
+        if (
+            self._header["magic"] != SHARED_FRAMES_MAGIC
+            or self._header["version"] != SHARED_FRAMES_VERSION
+        ):
+            self._header = None
+            memory.close()
+            raise ValueError("Not a frame publisher: " + name)
+        self.slots = int(self._header["slots"])
+        self._frames = np.ndarray(
+            (self.slots,),
+            FRAME_DTYPE,
+            buffer=memory.buf,
+            offset=_HEADER_DTYPE.itemsize,
+        )
+
+    @property
+    def head(self):
+        """(int): Sequence number of the newest frame, or -1 if there isn't one"""
+        return int(self._header["head"])
+
+    def view(self, sequence):
+        """The record for a frame, straight out of shared memory, without copying it
+
+        The publisher may overwrite it at any time. Check valid() after reading it.
+
+        Returns:
+            np.ndarray: A FRAME_DTYPE record, or None if the frame isn't there
+        """
+        record = self._frames[sequence % self.slots]
+        if record["sequence"] != 2 * (sequence + 1):
+            return None
+        return record
+
+    def valid(self, sequence):
+        """Is the frame still there, untouched? For after reading a view()"""
+        return self._frames[sequence % self.slots]["sequence"] == 2 * (sequence + 1)
+
+    def read(self, sequence):
+        """A copy of the record for a frame
+
+        Returns:
+            np.ndarray: A FRAME_DTYPE record, or None if the frame isn't there. Either
+                it hasn't been published yet, or it's been overwritten
+        """
+        record = self.view(sequence)
+        if record is None:
+            return None
+        record = record.copy()
+        if not self.valid(sequence):
+            return None
+        return record
+
+    def latest(self):
+        """The newest frame
+
+        Returns:
+            (int, np.ndarray): Its sequence number and a copy of its record, or
+                (-1, None) if nothing's been published yet
+        """
+        while True:
+            sequence = self.head
+            if sequence < 0:
+                return -1, None
+            record = self.read(sequence)
+            # If it was overwritten while reading, there's a newer one to get
+            if record is not None:
+                return sequence, record
+
+    def wait(self, sequence, timeout=None, poll_interval=0.0005):
+        """Wait for a frame to be published, and read it
+
+        Args:
+            sequence (int): The frame to wait for
+            timeout (float): Longest to wait, in seconds. None waits forever
+            poll_interval (float): How often to check, in seconds
+
+        Returns:
+            np.ndarray: A copy of its record, or None if it timed out or the frame
+                has already been overwritten
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.head < sequence:
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            time.sleep(poll_interval)
+        return self.read(sequence)
+
+    def close(self):
+        """Close the shared memory. Any views of it can't be used after this"""
+        if self._memory is not None:
+            self._header = self._frames = None
+            self._memory.close()
+            self._memory = None
@@ -1,11 +1,14 @@
-""" Implementation of a SlippiComm client aka 'Slippstream'
+"""Implementation of a SlippiComm client aka 'Slippstream'
                                                     (I'm calling it that)
 
 This can be used to talk to some server implementing the Slippstream protocol
 (i.e. the Project Slippi fork of Nintendont or Slippi Ishiiruka).
 """
 
+import asyncio
+import binascii
 import json
+import select
 import socket
 import time
 from enum import Enum
@@ -15,8 +18,26 @@ import enet
 import ubjson
 from ubjson.decoder import DecoderException
 
+from melee.slpfilestreamer import read_payload_sizes
+
 # The null token used for initial SlippiComm handshakes
 NULL_TOKEN = b"\x00\x00\x00\x00"
+# How long to wait for a Dolphin to connect, in seconds
+CONNECT_TIMEOUT = 4
+# ENet has to be serviced every so often to keep the connection alive, even when
+#   nothing is being received
+SERVICE_INTERVAL = 0.1
+# Returned by _handle_enet_event() for events that aren't messages
+_KEEP_WAITING = object()
+# Room to leave for the next datagram, so recv_into() never truncates one. This is
+#   the biggest a UDP datagram can be
+MAX_DATAGRAM_SIZE = 1 << 16
+# What to look for in a JSON message to find its payload and type without parsing it
+_PAYLOAD_KEY = b'"payload":"'
+_FAST_MESSAGE_TYPES = {
+    message_type: b'"type":"' + message_type.encode() + b'"'
+    for message_type in ("game_event", "menu_event")
+}
 
 
 # pylint: disable=too-few-public-methods
@@ -46,12 +67,21 @@ class CommType(Enum):
 class SlippstreamClient:
     """Container representing a client to some SlippiComm server"""
 
-    def __init__(self, address="127.0.0.1", port=51441, gamecube=False):
-        """Constructor for this object"""
+    def __init__(
+        self, address="127.0.0.1", port=51441, gamecube=False, fast_decode=True
+    ):
+        """Constructor for this object
+
+        Args:
+            fast_decode (bool): Pull the payload out of game and menu event messages
+                without parsing the JSON, and base64 decode it here. Otherwise every
+                message goes through json.loads and payloads are left as base64.
+        """
         self._host = enet.Host(None, 1, 0, 0)
         self._peer = None
-        self.buf = bytearray()
+        self._udp_buffer = EventBuffer()
         self.gamecube = gamecube
+        self.fast_decode = fast_decode
         self.address = address
         self.port = port
         # Not yet supported
@@ -81,60 +111,98 @@ class SlippstreamClient:
 
     def dispatch(self, polling_mode):
         """Dispatch messages with the peer (read and write packets)"""
-        event = None
-        event_type = 1000
-        while event_type not in [enet.EVENT_TYPE_RECEIVE]:
-            if self.gamecube:
-                wait_time = 1000
-                if polling_mode:
-                    wait_time = 0
-                event = self._host.service(wait_time)
-                event_type = event.type
-
-                if event.type == enet.EVENT_TYPE_NONE:
-                    if polling_mode:
-                        return None
-                if event.type == enet.EVENT_TYPE_RECEIVE:
-                    try:
-                        return json.loads(event.packet.data)
-                    except json.JSONDecodeError:
-                        # This happens at the end of a game for some reason?
-                        if len(event.packet.data) == 0:
-                            event_type = 0
-                            continue
-                        return None
-                elif event.type == enet.EVENT_TYPE_CONNECT:
-                    handshake = json.dumps(
-                        {
-                            "type": "connect_request",
-                            "cursor": 0,
-                        }
-                    )
-                    self._peer.send(0, enet.Packet(handshake.encode()))
-                elif event.type == enet.EVENT_TYPE_DISCONNECT:
+        if not self.gamecube:
+            while True:
+                if polling_mode and not self.wait(0):
                     return None
-            else:
-                self.buf += self.server.recv(1000)
-                # Exclude the the message length in the header
-                # msg = ubjson.loadb(self.buf[4:])
-                payload = self.buf[:]
-                # Clear out the old buffer
-                del self.buf
-                self.buf = bytearray()
-                # event = {}
-                # if msg["type"] == 1:
-                #     event = {"type": "connect_reply",
-                #             "nick": msg["payload"]["nick"],
-                #             "version": msg["payload"]["nintendontVersion"],
-                #             "cursor": msg["payload"]["pos"]}
-                event = {"payload": payload}
-                if payload[0] == 0x3E:
-                    event["type"] = "menu_event"
-                else:
-                    event["type"] = "game_event"
-                return event
+                buffer = self._udp_buffer
+                message = buffer.received(self.server.recv_into(buffer.free_space()))
+                if message is not None:
+                    return message
 
-        return None
+        wait_time = 1000
+        if polling_mode:
+            wait_time = 0
+        while True:
+            event = self._host.service(wait_time)
+            if event.type == enet.EVENT_TYPE_NONE and polling_mode:
+                return None
+            message = self._handle_enet_event(event)
+            if message is not _KEEP_WAITING:
+                return message
+
+    def wait(self, timeout):
+        """Wait for data to arrive from the console
+
+        Args:
+            timeout (float): Longest to wait, in seconds
+
+        Returns:
+            bool: Whether there's data to read
+        """
+        readable, _, _ = select.select([self.fileno()], [], [], timeout)
+        return bool(readable)
+
+    def fileno(self):
+        """The file descriptor of the socket messages arrive on, for select()"""
+        if self.gamecube:
+            return self._host.socket.fileno()
+        return self.server.fileno()
+
+    def _handle_enet_event(self, event):
+        """Turn an ENet event into a message for dispatch() to return
+
+        Returns:
+            The message, None if there won't be one, or _KEEP_WAITING if the event
+            wasn't a message
+        """
+        if event.type == enet.EVENT_TYPE_RECEIVE:
+            data = event.packet.data
+            if self.fast_decode and data:
+                # Anything that isn't JSON is a raw stream of events
+                if data[0] != 0x7B:  # "{"
+                    return self._udp_message(data)
+                message = _fast_message(data)
+                if message is not None:
+                    return message
+            try:
+                return json.loads(data)
+            except json.JSONDecodeError:
+                # This happens at the end of a game for some reason?
+                if len(data) == 0:
+                    return _KEEP_WAITING
+                return None
+        if event.type == enet.EVENT_TYPE_CONNECT:
+            self._send_connect_request()
+        elif event.type == enet.EVENT_TYPE_DISCONNECT:
+            return None
+        return _KEEP_WAITING
+
+    def _send_connect_request(self):
+        handshake = json.dumps(
+            {
+                "type": "connect_request",
+                "cursor": 0,
+            }
+        )
+        self._peer.send(0, enet.Packet(handshake.encode()))
+
+    @staticmethod
+    def _udp_message(data):
+        """Wrap a packet of raw events (such as from a GameCube) into a message"""
+        # msg = ubjson.loadb(self.buf[4:])
+        # event = {}
+        # if msg["type"] == 1:
+        #     event = {"type": "connect_reply",
+        #             "nick": msg["payload"]["nick"],
+        #             "version": msg["payload"]["nintendontVersion"],
+        #             "cursor": msg["payload"]["pos"]}
+        event = {"payload": bytearray(data)}
+        if data[0] == 0x3E:
+            event["type"] = "menu_event"
+        else:
+            event["type"] = "game_event"
+        return event
 
     def __new_handshake(self, cursor=0, token=NULL_TOKEN):
         """Returns a new binary handshake message"""
@@ -170,13 +238,7 @@ class SlippstreamClient:
                 for _ in range(4):
                     event = self._host.service(1000)
                     if event.type == enet.EVENT_TYPE_CONNECT:
-                        handshake = json.dumps(
-                            {
-                                "type": "connect_request",
-                                "cursor": 0,
-                            }
-                        )
-                        self._peer.send(0, enet.Packet(handshake.encode()))
+                        self._send_connect_request()
                         return True
                 return False
             except OSError:
@@ -186,3 +248,194 @@ class SlippstreamClient:
             self.server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
             self.server.bind(("0.0.0.0", 55559))
             return True
+
+
+class EventBuffer:
+    """Reassembles Slippi events that arrive in arbitrarily split datagrams
+
+    Datagrams are received straight into one preallocated buffer, with
+    free_space() and received(). Complete events are handed out as soon as they're
+    there, and a partial event at the end is held on to until the rest of it
+    arrives. Event sizes come from the PAYLOADS event at the start of each game.
+    """
+
+    def __init__(self, size=4 * MAX_DATAGRAM_SIZE):
+        self._buffer = bytearray(size)
+        self._view = memoryview(self._buffer)
+        # Received data that hasn't been handed out yet is _buffer[_start:_end]
+        self._start = 0
+        self._end = 0
+        self.eventsize = [0] * 0x100
+
+    def free_space(self):
+        """A writable view of the buffer to receive the next datagram into"""
+        if len(self._buffer) - self._end < MAX_DATAGRAM_SIZE:
+            # Move the partial event left over at the end to the front. It can
+            #   overlap where it's going, so copy it out first
+            pending = self._end - self._start
+            self._buffer[:pending] = bytes(self._view[self._start : self._end])
+            self._start, self._end = 0, pending
+        return self._view[self._end :]
+
+    def received(self, count):
+        """Take in a datagram of count bytes, written to free_space()
+
+        Returns:
+            dict: A message holding every complete event received so far, or None if
+                there isn't one yet
+        """
+        datagram = self._end
+        self._end += count
+        if count == 0:
+            return None
+        # Menu events come in whole datagrams of their own
+        if self._start == datagram and self._buffer[datagram] == 0x3E:
+            self._start = self._end
+            return {
+                "type": "menu_event",
+                "payload": bytes(self._view[datagram : self._end]),
+            }
+
+        start = self._start
+        end = self._events_end()
+        if end == start:
+            return None
+        self._start = end
+        if self._start >= self._end:
+            self._start = self._end = 0
+        return {"type": "game_event", "payload": bytes(self._view[start:end])}
+
+    def _events_end(self):
+        """Where the last complete event in the buffer ends"""
+        buffer = self._buffer
+        eventsize = self.eventsize
+        index = self._start
+        end = self._end
+        while index < end:
+            command = buffer[index]
+            if command == 0x35:
+                if index + 1 >= end or index + buffer[index + 1] + 1 > end:
+                    break
+                event_size = read_payload_sizes(buffer, index, eventsize)
+            else:
+                event_size = eventsize[command]
+                if event_size == 0:
+                    # Padding or garbage. Either way there's no framing the rest,
+                    #   so hand it all out and let the Console sort it out
+                    return end
+                if index + event_size > end:
+                    break
+            index += event_size
+        return index
+
+
+def _fast_message(data):
+    """Get a game or menu event out of a JSON message, without json.loads
+
+    The payload is base64 decoded straight out of the packet. Base64 never contains
+    a quote, so the payload ends at the next one.
+
+    Returns:
+        dict: The message, with the payload as bytes. None if this isn't a game or
+            menu event, in which case the message needs parsing properly.
+    """
+    start = data.find(_PAYLOAD_KEY)
+    if start < 0:
+        return None
+    start += len(_PAYLOAD_KEY)
+    end = data.find(b'"', start)
+    if end < 0:
+        return None
+    for message_type, type_key in _FAST_MESSAGE_TYPES.items():
+        if data.find(type_key, 0, start) >= 0 or data.find(type_key, end) >= 0:
+            try:
+                payload = binascii.a2b_base64(memoryview(data)[start:end])
+            except binascii.Error:
+                return None
+            return {"type": message_type, "payload": payload}
+    return None
+
+
+class AsyncSlippstreamClient(SlippstreamClient):
+    """A SlippstreamClient that waits for messages on an asyncio event loop
+
+    Waiting for the next message yields to the event loop instead of blocking, so a
+    single thread can drive any number of consoles. The synchronous methods still
+    work, but don't mix them with the async ones on a GameCube connection.
+    """
+
+    async def connect_async(self):
+        """connect(), without blocking the event loop while the Dolphin answers
+
+        Returns True on success, False on failure
+        """
+        if not self.gamecube:
+            if not self.connect():
+                return False
+            self.server.setblocking(False)
+            return True
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + CONNECT_TIMEOUT
+        try:
+            self._peer = self._host.connect(
+                enet.Address(bytes(self.address, "utf-8"), int(self.port)), 1
+            )
+            while loop.time() < deadline:
+                event = self._host.service(0)
+                if event.type == enet.EVENT_TYPE_CONNECT:
+                    self._send_connect_request()
+                    return True
+                if event.type == enet.EVENT_TYPE_NONE:
+                    await self._readable(deadline - loop.time())
+        except OSError:
+            return False
+        return False
+
+    async def dispatch_async(self, polling_mode):
+        """dispatch(), yielding to the event loop while waiting for a message"""
+        if not self.gamecube:
+            buffer = self._udp_buffer
+            loop = asyncio.get_running_loop()
+            while True:
+                if polling_mode:
+                    try:
+                        count = self.server.recv_into(buffer.free_space())
+                    except BlockingIOError:
+                        return None
+                else:
+                    count = await loop.sock_recv_into(self.server, buffer.free_space())
+                message = buffer.received(count)
+                if message is not None:
+                    return message
+
+        while True:
+            # ENet may have already read more events off the socket, so drain those
+            #   before waiting on it
+            event = self._host.service(0)
+            if event.type == enet.EVENT_TYPE_NONE:
+                if polling_mode:
+                    return None
+                await self._readable(SERVICE_INTERVAL)
+                continue
+            message = self._handle_enet_event(event)
+            if message is not _KEEP_WAITING:
+                return message
+
+    async def _readable(self, timeout):
+        """Wait until the ENet socket has data, or timeout seconds pass"""
+        loop = asyncio.get_running_loop()
+        ready = loop.create_future()
+        fd = self._host.socket.fileno()
+        try:
+            loop.add_reader(fd, lambda: ready.done() or ready.set_result(None))
+        except NotImplementedError:
+            # The Windows proactor event loop can't watch sockets. Poll instead
+            await asyncio.sleep(0.001)
+            return
+        try:
+            await asyncio.wait_for(ready, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            loop.remove_reader(fd)
@@ -3,11 +3,80 @@
 Reads Slippi game events from SLP file rather than over network
 """
 
+import asyncio
+import hashlib
+import mmap
+import time
+import zipfile
 from enum import Enum
 
 import numpy as np
 import ubjson
 
+from melee.events import FRAME_NUMBER, PAYLOAD_ENTRY
+
+# Every SLP file starts with this, followed by the length of the raw array
+RAW_HEADER = b"{U\x03raw[$U#l"
+RAW_START = len(RAW_HEADER) + 4
+METADATA_KEY = b"U\x08metadata"
+# Bump this whenever the layout of frame index sidecar files changes
+INDEX_VERSION = 2
+# How much of a followed file to read at once, and how much already handled data
+#   to keep around before dropping it from the buffer
+FOLLOW_READ_SIZE = 1 << 16
+FOLLOW_COMPACT_SIZE = 1 << 20
+
+
+def read_raw_length(header):
+    """Read the length of the raw event stream from the first bytes of an SLP file
+
+    Returns:
+        int: The length of the raw array, or None if this isn't an SLP file.
+            A length of 0 means the file is still being written.
+    """
+    if len(header) < RAW_START or bytes(header[: len(RAW_HEADER)]) != RAW_HEADER:
+        return None
+    return int.from_bytes(header[len(RAW_HEADER) : RAW_START], "big")
+
+
+def read_payload_sizes(buf, index, eventsize):
+    """Read the PAYLOADS event at buf[index] into the eventsize table
+
+    Each entry of eventsize is set to the full size of that event type, including
+    its command byte.
+
+    Returns:
+        int: The size of the PAYLOADS event itself
+    """
+    payload_size = buf[index + 1]
+    num_commands = (payload_size - 1) // 3
+    for cursor in range(index + 2, index + 2 + (3 * num_commands), 3):
+        command, command_len = PAYLOAD_ENTRY.unpack_from(buf, cursor)
+        eventsize[command] = command_len + 1
+    return payload_size + 1
+
+
+def read_metadata(tail):
+    """Decode the metadata block that follows the raw array of an SLP file
+
+    Args:
+        tail (bytes): Everything in the file after the raw array
+
+    Returns:
+        dict: The metadata, empty if the file has none, or None if it's corrupt
+    """
+    # The only thing after the raw array is the metadata object, then the
+    #   closing brace of the outer object
+    if not tail.startswith(METADATA_KEY):
+        return {}
+    try:
+        metadata = ubjson.loadb(tail[len(METADATA_KEY) : -1])
+    except ubjson.decoder.DecoderException:
+        return None
+    if not isinstance(metadata, dict):
+        return None
+    return metadata
+
 
 # pylint: disable=too-few-public-methods
 class EventType(Enum):
@@ -25,8 +94,33 @@ class EventType(Enum):
 
 
 class SLPFileStreamer:
-    def __init__(self, path):
+    def __init__(
+        self,
+        path,
+        use_mmap=False,
+        follow=False,
+        poll_interval=0.005,
+        follow_timeout=None,
+    ):
+        """Create a streamer for the given SLP file
+
+        Args:
+            path (str): Path to the SLP file
+            use_mmap (bool): Memory-map the file rather than reading it in. The raw
+                event stream is then a zero-copy memoryview into the file, and only
+                the metadata at the end of the file gets decoded.
+            follow (bool): Follow a file that is still being written, such as the
+                replay Dolphin saves during a game. Events are handed out as soon as
+                they're written, and the stream ends at the GAME_END event. Seeking
+                isn't supported in this mode.
+            poll_interval (float): When following, how long to sleep between checks
+                for new data, in seconds
+            follow_timeout (float): When following, give up if no new data is written
+                for this many seconds. None waits forever.
+        """
         self._path = path
+        self._use_mmap = use_mmap
+        self._mmap = None
         self._contents = None
         self.eventsize = [0] * 0x100
         self._index = 0
@@ -36,50 +130,88 @@ class SLPFileStreamer:
         self.consoleNick = ""
         self.players = {}
         self.lastFrame = -9999
+        self.metadata = {}
+        # Frame index. See build_index()
+        self._index_eventsize = None
+        self._prelude_end = 0
+        self._first_frame = 0
+        self._frame_offsets = None
+        # Follow mode. _contents is then a buffer of the file starting at _consumed
+        self._follow = follow
+        self._poll_interval = poll_interval
+        self._follow_timeout = follow_timeout
+        self._file = None
+        self._consumed = 0
+        self._raw_end = None
+        self._header_read = False
+        self._game_ended = False
+        self._last_data = 0
 
     def shutdown(self):
-        pass
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._mmap is not None:
+            try:
+                self._contents.release()
+                self._mmap.close()
+            except BufferError:
+                # Someone still holds a view into the file. It will be closed
+                #   once they let go of it.
+                pass
+            self._mmap = None
+            self._contents = None
 
-    def _is_new_frame(self, event_bytes):
+    def _is_new_frame(self, command, index):
         """Introspect the bytes of the event to see if it represents a new frame
 
         This is for supporting older SLP files that don't have frame bookends
         """
-        if EventType(event_bytes[0]) in [EventType.POST_FRAME, EventType.PRE_FRAME]:
-            frame = np.ndarray((1,), ">i", event_bytes, 0x1)[0]
+        if command in (EventType.POST_FRAME.value, EventType.PRE_FRAME.value):
+            frame = FRAME_NUMBER.unpack_from(self._contents, index + 0x1)[0]
             if frame > self._frame:
                 self._frame = frame
                 return True
             self._frame = frame
         return False
 
-    def dispatch(self, dummy):
-        """Read a single game event off the buffer"""
-        if self._index >= len(self._contents):
-            return None
+    def dispatch(self, polling_mode):
+        """Read a single game event off the buffer
+
+        Payloads are zero-copy memoryview slices of the file contents, except when
+        following a file.
 
-        if EventType(self._contents[self._index]) == EventType.PAYLOADS:
-            cursor = 0x2
-            payload_size = self._contents[self._index + 1]
-            num_commands = (payload_size - 1) // 3
-            for i in range(0, num_commands):
-                command = np.ndarray((1,), ">B", self._contents, cursor)[0]
-                command_len = np.ndarray((1,), ">H", self._contents, cursor + 0x1)[0]
-                self.eventsize[command] = command_len + 1
-                cursor += 3
+        Args:
+            polling_mode (bool): Only matters when following a file. Return None
+                straight away if the next event hasn't been written yet, rather
+                than waiting for it.
+        """
+        if self._follow and not self._wait_for_event(polling_mode):
+            return None
+        index = self._index
+        if index >= len(self._contents):
+            return None
 
+        command = self._contents[index]
+        if command == EventType.GAME_END.value:
+            self._game_ended = True
+        if command == EventType.PAYLOADS.value:
+            event_size = read_payload_sizes(self._contents, index, self.eventsize)
             wrapper = dict()
             wrapper["type"] = "game_event"
-            wrapper["payload"] = self._contents[
-                self._index : self._index + payload_size + 1
-            ]
-            self._index += payload_size + 1
+            wrapper["payload"] = self._contents[index : index + event_size]
+            self._index += event_size
             return wrapper
 
-        event_size = self.eventsize[self._contents[self._index]]
+        event_size = self.eventsize[command]
+        if event_size == 0:
+            # Garbage. There's no stepping over it, so treat it as the end of the
+            #   game, as when following a file
+            self._index = len(self._contents)
+            return None
 
         # Check to see if a new frame has happened for an old file type
-        if self._is_new_frame(self._contents[self._index : self._index + event_size]):
+        if self._is_new_frame(command, index):
             wrapper = dict()
             wrapper["type"] = "frame_end"
             wrapper["payload"] = b""
@@ -87,12 +219,311 @@ class SLPFileStreamer:
 
         wrapper = dict()
         wrapper["type"] = "game_event"
-        wrapper["payload"] = self._contents[self._index : self._index + event_size]
+        wrapper["payload"] = self._contents[index : index + event_size]
         self._index += event_size
 
         return wrapper
 
+    def _wait_for_event(self, polling_mode):
+        """Make sure a whole event is buffered at _index, reading more of the
+        followed file as needed
+
+        Returns:
+            bool: False if there isn't going to be one. Either the game is over, or
+                polling_mode is set and the rest of the event isn't written yet.
+        """
+        self._last_data = time.monotonic()
+        while True:
+            ready = self._poll_event()
+            if ready is not None:
+                return ready
+            if polling_mode or self._follow_timed_out():
+                return False
+            time.sleep(self._poll_interval)
+
+    async def dispatch_async(self, polling_mode):
+        """dispatch(), yielding to the event loop while waiting for a followed file
+        to be written"""
+        if self._follow and not polling_mode:
+            self._last_data = time.monotonic()
+            while self._poll_event() is None:
+                if self._follow_timed_out():
+                    return None
+                await asyncio.sleep(self._poll_interval)
+        return self.dispatch(polling_mode)
+
+    async def connect_async(self):
+        """connect(), for symmetry with the network clients. Nothing to wait for"""
+        return self.connect()
+
+    def _follow_timed_out(self):
+        return (
+            self._follow_timeout is not None
+            and time.monotonic() - self._last_data > self._follow_timeout
+        )
+
+    def _poll_event(self):
+        """Read whatever has been written to the followed file so far
+
+        Returns:
+            bool: Whether there's a whole event buffered at _index. False means the
+                game is over. None if we have to wait for more to be written.
+        """
+        if self._index >= FOLLOW_COMPACT_SIZE:
+            del self._contents[: self._index]
+            self._consumed += self._index
+            self._index = 0
+
+        while True:
+            if self._game_ended:
+                self._read_follow_metadata()
+                return False
+            if self._raw_end is not None and (
+                self._consumed + self._index >= self._raw_end
+            ):
+                self._read_follow_metadata()
+                return False
+            if self._event_buffered():
+                return True
+
+            chunk = self._file.read(FOLLOW_READ_SIZE)
+            if not chunk:
+                return None
+            self._contents += chunk
+            self._last_data = time.monotonic()
+
+    def _event_buffered(self):
+        """Is there a whole event in the follow buffer at _index?"""
+        contents = self._contents
+        index = self._index
+        if not self._header_read:
+            if len(contents) < RAW_START:
+                return False
+            raw_length = read_raw_length(contents)
+            if raw_length is None:
+                # Not an SLP file. Nothing more will come out of it
+                self._game_ended = True
+                return False
+            # Dolphin fills in the length once the game is over. If it's already
+            #   there, the file is complete and we stop at the end of the raw array
+            if raw_length:
+                self._raw_end = RAW_START + raw_length
+            self._header_read = True
+            self._index = index = RAW_START
+
+        if index >= len(contents):
+            return False
+        command = contents[index]
+        if command == EventType.PAYLOADS.value:
+            if index + 1 >= len(contents):
+                return False
+            event_size = contents[index + 1] + 1
+        else:
+            event_size = self.eventsize[command]
+            if event_size == 0:
+                # Garbage. Treat it as the end of the game
+                self._game_ended = True
+                return False
+        return index + event_size <= len(contents)
+
+    def _read_follow_metadata(self):
+        """Pick up the metadata of a followed file, if it's been written yet"""
+        if self.metadata or self._file is None:
+            return
+        position = self._file.tell()
+        try:
+            self._file.seek(0)
+            raw_length = read_raw_length(self._file.read(RAW_START))
+            if not raw_length:
+                return
+            self._file.seek(RAW_START + raw_length)
+            metadata = read_metadata(self._file.read())
+            if metadata:
+                self._set_metadata(metadata)
+        finally:
+            self._file.seek(position)
+
+    def build_index(self, sidecar_path=None):
+        """Index where each frame starts in the file, so that seek() is O(1)
+
+        This scans the whole event stream once, without decoding it. Call after
+        connect().
+
+        Args:
+            sidecar_path (str): Optional index file to go with the replay. If it
+                exists and matches the replay it's loaded instead of scanning, and
+                otherwise the new index is saved to it.
+        """
+        assert not self._follow, "Can't index a file that's still being written"
+        if sidecar_path is not None and self._load_index(sidecar_path):
+            return
+
+        contents = self._contents
+        eventsize = [0] * 0x100
+        frame_offsets = dict()
+        prelude_end = 0
+        has_frame_start = False
+        last_frame = None
+        index = 0
+        end = len(contents)
+        while index < end:
+            command = contents[index]
+            if command == EventType.PAYLOADS.value:
+                event_size = read_payload_sizes(contents, index, eventsize)
+            else:
+                event_size = eventsize[command]
+                if event_size == 0 or index + event_size > end:
+                    break
+
+            if command == EventType.GAME_START.value:
+                prelude_end = index + event_size
+            elif command == EventType.FRAME_START.value:
+                # With rollback a frame can appear more than once. Playback from
+                #   the start would return the first one, so seek does too
+                has_frame_start = True
+                frame = FRAME_NUMBER.unpack_from(contents, index + 0x1)[0]
+                frame_offsets.setdefault(frame, index)
+            elif command == EventType.PRE_FRAME.value and not has_frame_start:
+                # Old replays have no FRAME_START. Use the first PRE_FRAME instead
+                frame = FRAME_NUMBER.unpack_from(contents, index + 0x1)[0]
+                if frame != last_frame:
+                    frame_offsets.setdefault(frame, index)
+                    last_frame = frame
+            index += event_size
+
+        self._index_eventsize = np.array(eventsize, dtype=np.int64)
+        self._prelude_end = prelude_end
+        self._first_frame = min(frame_offsets, default=0)
+        offsets = np.full(
+            max(frame_offsets, default=-1) - self._first_frame + 1, -1, dtype=np.int64
+        )
+        for frame, offset in frame_offsets.items():
+            offsets[frame - self._first_frame] = offset
+        self._frame_offsets = offsets
+
+        if sidecar_path is not None:
+            self._save_index(sidecar_path)
+
+    def _save_index(self, sidecar_path):
+        with open(sidecar_path, "wb") as file:
+            np.savez(
+                file,
+                version=INDEX_VERSION,
+                raw_length=len(self._contents),
+                digest=self._digest(),
+                eventsize=self._index_eventsize,
+                prelude_end=self._prelude_end,
+                first_frame=self._first_frame,
+                frame_offsets=self._frame_offsets,
+            )
+
+    def _digest(self):
+        """A hash of the event stream, to tell which replay an index is for"""
+        return hashlib.blake2b(self._contents, digest_size=16).hexdigest()
+
+    def _load_index(self, sidecar_path):
+        try:
+            with np.load(sidecar_path, allow_pickle=False) as index:
+                if int(index["version"]) != INDEX_VERSION:
+                    return False
+                # A sidecar left over from some other replay doesn't match
+                if int(index["raw_length"]) != len(self._contents):
+                    return False
+                if str(index["digest"]) != self._digest():
+                    return False
+                self._index_eventsize = index["eventsize"]
+                self._prelude_end = int(index["prelude_end"])
+                self._first_frame = int(index["first_frame"])
+                self._frame_offsets = index["frame_offsets"]
+        except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+            return False
+        return True
+
+    def prelude(self):
+        """The events before the first frame (PAYLOADS and GAME_START)
+
+        A Console needs to have handled these before it can decode a frame it has
+        seek()'d to. Requires build_index().
+        """
+        return self._contents[: self._prelude_end]
+
+    def seek(self, frame):
+        """Make dispatch() continue from the start of the given frame
+
+        Builds the frame index first if needed.
+
+        Args:
+            frame (int): Frame number to jump to
+
+        Raises:
+            ValueError: If the replay has no such frame
+        """
+        if self._frame_offsets is None:
+            self.build_index()
+        row = frame - self._first_frame
+        if row < 0 or row >= len(self._frame_offsets) or self._frame_offsets[row] < 0:
+            raise ValueError("Frame {} is not in the replay".format(frame))
+        self.eventsize = [int(size) for size in self._index_eventsize]
+        self._index = int(self._frame_offsets[row])
+        # Frame end detection for old replays compares against the last frame seen
+        self._frame = frame
+
+    def _set_metadata(self, metadata):
+        self.metadata = metadata
+        try:
+            self.playedOn = metadata["playedOn"]
+        except KeyError:
+            pass
+        try:
+            self.timestamp = metadata["startAt"]
+        except KeyError:
+            pass
+        try:
+            self.consoleNick = metadata["consoleNick"]
+        except KeyError:
+            pass
+        try:
+            self.players = metadata["players"]
+        except KeyError:
+            pass
+        try:
+            self.lastFrame = metadata["lastFrame"]
+        except KeyError:
+            pass
+
+    def _connect_mmap(self):
+        with open(self._path, mode="rb") as file:
+            try:
+                mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty file
+                return False
+        raw_length = read_raw_length(mapped[:RAW_START])
+        raw_end = RAW_START + (raw_length or 0)
+        if not raw_length or raw_end > len(mapped):
+            mapped.close()
+            return False
+
+        metadata = read_metadata(mapped[raw_end:])
+        if metadata is None:
+            mapped.close()
+            return False
+
+        self._mmap = mapped
+        self._contents = memoryview(mapped)[RAW_START:raw_end]
+        self._set_metadata(metadata)
+        return True
+
     def connect(self):
+        if self._follow:
+            try:
+                self._file = open(self._path, mode="rb", buffering=0)
+            except OSError:
+                return False
+            self._contents = bytearray()
+            return True
+        if self._use_mmap:
+            return self._connect_mmap()
         with open(self._path, mode="rb") as file:
             full = None
             try:
@@ -104,26 +535,6 @@ class SLPFileStreamer:
                 return False
             if "raw" not in full:
                 return False
-            raw = full["raw"]
-            self._contents = raw
-            try:
-                self.playedOn = full["metadata"]["playedOn"]
-            except KeyError:
-                pass
-            try:
-                self.timestamp = full["metadata"]["startAt"]
-            except KeyError:
-                pass
-            try:
-                self.consoleNick = full["metadata"]["consoleNick"]
-            except KeyError:
-                pass
-            try:
-                self.players = full["metadata"]["players"]
-            except KeyError:
-                pass
-            try:
-                self.lastFrame = full["metadata"]["lastFrame"]
-            except KeyError:
-                pass
+            self._contents = memoryview(full["raw"])
+            self._set_metadata(full.get("metadata", {}))
             return True
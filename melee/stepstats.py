@@ -0,0 +1,105 @@
+"""Where the time goes in each step(), for Console(stats=True)
+
+Each frame is one sample, made up of the time spent in each stage of getting it:
+flushing the controllers, waiting for messages, decoding them, handling each type
+of event and finishing off the GameState. The last so many frames are kept, for
+percentiles and histograms.
+"""
+
+import numpy as np
+
+from melee.slippstream import EventType
+
+EVENT_STAGES = tuple(event.name.lower() for event in EventType)
+"""Stages for handling each type of event, named after the EventType"""
+STAGES = ("flush", "wait", "decode") + EVENT_STAGES + ("finish",)
+"""Every stage, in the order they happen in a step
+
+flush: Flushing the controllers
+wait: Waiting for, and reading, the next message
+decode: Getting events out of Dolphin's JSON messages, and base64 decoding them
+finish: Fixing up the finished GameState and adding the metadata
+"""
+
+
+class StepStats:
+    """Rolling timings of each stage of step(), in seconds
+
+    Console(stats=True) fills one of these in as console.stats. Stages with nothing
+    to do on a frame count as zero for that frame.
+    """
+
+    def __init__(self, window=1000):
+        """Create some stats
+
+        Args:
+            window (int): How many of the most recent frames to keep
+        """
+        self.window = window
+        self.frames = 0
+        """(int): Frames timed in total, including ones no longer in the window"""
+        self._samples = np.zeros((window, len(STAGES)))
+        # Time so far in each stage, for the frame in progress
+        self._current = np.zeros(len(STAGES))
+        self._index = {stage: index for index, stage in enumerate(STAGES)}
+
+    def index(self, stage):
+        """The column of a stage, for add()"""
+        return self._index[stage]
+
+    def add(self, index, seconds):
+        """Add time to a stage of the frame in progress"""
+        self._current[index] += seconds
+
+    def end_frame(self):
+        """The frame in progress is done. Keep its timings"""
+        self._samples[self.frames % self.window] = self._current
+        self._current[:] = 0
+        self.frames += 1
+
+    def reset(self):
+        """Forget all timings"""
+        self.frames = 0
+        self._current[:] = 0
+
+    def samples(self, stage=None):
+        """The timings in the window, oldest first
+
+        Args:
+            stage (str): Just this stage. None for the total of every stage
+
+        Returns:
+            np.ndarray: Seconds per frame
+        """
+        count = min(self.frames, self.window)
+        start = self.frames % self.window if self.frames > self.window else 0
+        rows = np.roll(self._samples, -start, axis=0)[:count]
+        if stage is None:
+            return rows.sum(axis=1)
+        return rows[:, self._index[stage]]
+
+    def percentiles(self, percentiles=(50, 90, 99)):
+        """Percentiles of each stage, and of the total, over the window
+
+        Returns:
+            dict: Seconds at each percentile, by stage. "total" is the whole step
+        """
+        results = {}
+        if self.frames == 0:
+            return results
+        for stage in STAGES + ("total",):
+            samples = self.samples(None if stage == "total" else stage)
+            results[stage] = tuple(np.percentile(samples, percentiles))
+        return results
+
+    def histogram(self, stage=None, bins=20):
+        """A histogram of a stage over the window, as from numpy.histogram()
+
+        Args:
+            stage (str): The stage. None for the total of every stage
+            bins: Passed on to numpy.histogram()
+
+        Returns:
+            (np.ndarray, np.ndarray): Counts, and the edges of the bins in seconds
+        """
+        return np.histogram(self.samples(stage), bins=bins)
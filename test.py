@@ -1,7 +1,18 @@
 #!/usr/bin/python3
+import asyncio
+import base64
+import json
+import os
+import pickle
+import tempfile
+import threading
+import time
 import unittest
 
+import numpy as np
+
 import melee
+from melee.slpfilestreamer import SLPFileStreamer
 
 
 class SLPFile(unittest.TestCase):
@@ -62,6 +73,1156 @@ class SLPFile(unittest.TestCase):
                 self.assertEqual(gamestate.players[2].percent, 25)
                 self.assertEqual(gamestate.players[3].percent, 0)
 
+    def test_read_replay(self):
+        """
+        Decode a whole SLP file into columnar arrays
+        """
+        replay = melee.replays.read_replay("test_artifacts/test_game_1.slp")
+        self.assertEqual(replay.slp_version, "3.6.1")
+        self.assertEqual(replay.stage, melee.Stage.YOSHIS_STORY)
+        self.assertEqual(len(replay.frames), 1038)
+        self.assertEqual(replay.frames[0], -123)
+        self.assertEqual(sorted(replay.players.keys()), [1, 2])
+        self.assertEqual(replay.metadata["lastFrame"], 914)
+        row = 297 - replay.frames[0]
+        self.assertEqual(replay.players[1]["character"][row], 1)
+        self.assertEqual(replay.players[1]["action"][row], 0)
+        self.assertEqual(replay.players[2]["action"][row], 27)
+        self.assertEqual(int(replay.players[1]["percent"][row]), 17)
+        self.assertEqual(int(replay.players[2]["percent"][row]), 0)
+
+        replay = melee.replays.read_replay("test_artifacts/test_game_2.slp")
+        self.assertEqual(replay.slp_version, "2.0.1")
+        self.assertEqual(len(replay.frames), 3839)
+        row = 301 - replay.frames[0]
+        self.assertEqual(replay.players[2]["action"][row], 88)
+        self.assertEqual(replay.players[3]["action"][row], 56)
+        self.assertEqual(int(replay.players[2]["percent"][row]), 25)
+
+        with self.assertRaises(melee.replays.ReplayLoadError):
+            melee.replays.read_replay("test_artifacts/corrupt_game_1.slp")
+
+    def test_mmap_file(self):
+        """
+        Memory-mapped loading should see the same replay as a full read
+        """
+        streamer = SLPFileStreamer("test_artifacts/test_game_1.slp")
+        mapped = SLPFileStreamer("test_artifacts/test_game_1.slp", use_mmap=True)
+        self.assertTrue(streamer.connect())
+        self.assertTrue(mapped.connect())
+        self.assertIsInstance(mapped._contents, memoryview)
+        self.assertEqual(bytes(mapped._contents), streamer._contents)
+        self.assertEqual(mapped.metadata, streamer.metadata)
+        self.assertEqual(mapped.playedOn, "dolphin")
+        mapped.shutdown()
+
+        for i in range(1, 4):
+            mapped = SLPFileStreamer(
+                "test_artifacts/corrupt_game_{}.slp".format(i), use_mmap=True
+            )
+            self.assertFalse(mapped.connect())
+
+    def test_event_decoder(self):
+        """
+        Fields past the end of a short (old version) event take their defaults
+        """
+        event = bytearray(0x2B)
+        event[0] = 0x38
+        event[0x5] = 1
+        event[0x21] = 4
+        post = melee.events.POST_FRAME_DECODER.decode(bytes(event), 0, len(event))
+        self.assertEqual(post.port, 1)
+        self.assertEqual(post.stock, 4)
+        self.assertEqual(post.jumps_left, 1)
+        self.assertEqual(post.hitlag_left, 0)
+
+        # The same bytes inside a bigger buffer, with a full size event
+        buffer = bytes(0x10) + bytes(event) + bytes(0x80)
+        post = melee.events.POST_FRAME_DECODER.decode(buffer, 0x10, 0x79)
+        self.assertEqual(post.stock, 4)
+        self.assertEqual(post.jumps_left, 0)
+
+    def test_seek(self):
+        """
+        Jump straight to a frame, with and without a saved index
+        """
+        console = melee.Console(
+            system="file",
+            allow_old_version=False,
+            path="test_artifacts/test_game_1.slp",
+        )
+        self.assertTrue(console.connect())
+        with tempfile.TemporaryDirectory() as directory:
+            sidecar = os.path.join(directory, "test_game_1.slp.idx")
+            console.build_index(sidecar)
+            self.assertTrue(os.path.isfile(sidecar))
+            console.seek(297)
+            gamestate = console.step()
+            self.assertEqual(gamestate.frame, 297)
+            self.assertEqual(console.slp_version, "3.6.1")
+            self.assertEqual(gamestate.players[1].action.value, 0)
+            self.assertEqual(gamestate.players[2].action.value, 27)
+            self.assertEqual(gamestate.players[1].percent, 17)
+            self.assertEqual(console.step().frame, 298)
+
+            # A fresh console picks the index up from the sidecar
+            console = melee.Console(
+                system="file",
+                allow_old_version=False,
+                path="test_artifacts/test_game_1.slp",
+            )
+            self.assertTrue(console.connect())
+            console.build_index(sidecar)
+            console.seek(914)
+            self.assertEqual(console.step().frame, 914)
+            self.assertIsNone(console.step())
+            with self.assertRaises(ValueError):
+                console.seek(915)
+
+            # A sidecar from a different replay of the same length is rebuilt
+            with open("test_artifacts/test_game_1.slp", "rb") as file:
+                data = bytearray(file.read())
+            data[-2000] ^= 0xFF
+            other = os.path.join(directory, "other.slp")
+            with open(other, "wb") as file:
+                file.write(data)
+            with np.load(sidecar) as index:
+                digest = str(index["digest"])
+            console = melee.Console(system="file", path=other)
+            self.assertTrue(console.connect())
+            console.build_index(sidecar)
+            with np.load(sidecar) as index:
+                self.assertNotEqual(str(index["digest"]), digest)
+            console.stop()
+
+        console = melee.Console(
+            system="file", allow_old_version=True, path="test_artifacts/test_game_2.slp"
+        )
+        self.assertTrue(console.connect())
+        console.seek(301)
+        gamestate = console.step()
+        self.assertEqual(gamestate.frame, 301)
+        self.assertEqual(gamestate.players[2].action.value, 88)
+        self.assertEqual(gamestate.players[3].action.value, 56)
+
+    def test_parse_corpus(self):
+        """
+        Parse a directory of replays in a process pool, including corrupt ones
+        """
+        results = list(
+            melee.replays.parse_corpus(["test_artifacts"], fields=["x", "y"], workers=2)
+        )
+        self.assertEqual(len(results), 5)
+        paths = [os.path.basename(result.path) for result in results]
+        self.assertEqual(paths, sorted(paths))
+        for result in results:
+            if "corrupt" in result.path:
+                self.assertIsNone(result.replay)
+                self.assertTrue(result.error)
+            else:
+                self.assertIsNone(result.error)
+                for array in result.replay.players.values():
+                    self.assertEqual(array.dtype.names, ("x", "y"))
+                    self.assertEqual(array.dtype.itemsize, 8)
+
+    def test_scan_metadata(self):
+        """
+        Read the game start and metadata without decoding any frames
+        """
+        info = melee.replays.scan_metadata("test_artifacts/test_game_2.slp")
+        self.assertEqual(info.slp_version, "2.0.1")
+        self.assertEqual(info.stage, melee.Stage.FINAL_DESTINATION)
+        self.assertFalse(info.is_teams)
+        self.assertEqual(sorted(info.players), [2, 3])
+        self.assertEqual(info.players[2].character, melee.Character.MARIO)
+        self.assertEqual(info.players[3].character, melee.Character.FALCO)
+        self.assertEqual(info.players[3].costume, 1)
+        self.assertEqual(info.last_frame, 3715)
+        self.assertEqual(info.played_on, "nintendont")
+
+        with self.assertRaises(melee.replays.ReplayLoadError):
+            melee.replays.scan_metadata("test_artifacts/corrupt_game_1.slp")
+
+        # Files cut short partway through the events
+        with open("test_artifacts/test_game_1.slp", "rb") as file:
+            data = file.read()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "truncated.slp")
+            for length in (16, 20, 40, 400):
+                with open(path, "wb") as file:
+                    file.write(data[:length])
+                with self.assertRaises(melee.replays.ReplayLoadError):
+                    melee.replays.scan_metadata(path)
+
+    def test_replay_cache(self):
+        """
+        Decoded replays come back out of the cache unchanged, and it stays in size
+        """
+        path = "test_artifacts/test_game_2.slp"
+        with tempfile.TemporaryDirectory() as directory:
+            cache = melee.replays.ReplayCache(directory)
+            decoded = melee.replays.read_replay(path, cache=cache)
+            cached = melee.replays.read_replay(path, cache=cache)
+            self.assertIsInstance(cached.players[2], np.memmap)
+            self.assertEqual(cached.stage, decoded.stage)
+            self.assertEqual(cached.slp_version, decoded.slp_version)
+            self.assertEqual(cached.metadata, decoded.metadata)
+            self.assertTrue((cached.frames == decoded.frames).all())
+            for port, array in decoded.players.items():
+                self.assertTrue((cached.players[port] == array).all())
+
+            # A different field set is a different entry
+            subset = melee.replays.read_replay(path, fields=["x"], cache=cache)
+            self.assertEqual(subset.players[2].dtype.names, ("x",))
+            self.assertEqual(len(os.listdir(directory)), 2)
+
+            # Going over the size limit evicts the least recently used entry
+            cache.max_size = cache.size() - 1
+            melee.replays.read_replay(path, fields=["y"], cache=cache)
+            self.assertLessEqual(cache.size(), cache.max_size)
+            self.assertIsNotNone(cache.load(cache.key(path, ["y"])))
+
+    def test_follow_file(self):
+        """
+        Follow an SLP file while it's being written, as Dolphin does during a game
+        """
+        source = "test_artifacts/test_game_1.slp"
+        with open(source, "rb") as file:
+            data = file.read()
+
+        def frames(console):
+            while True:
+                gamestate = console.step()
+                if gamestate is None:
+                    return
+                yield gamestate.frame, gamestate.players[1].x, gamestate.players[2].x
+
+        console = melee.Console(system="file", path=source)
+        console.connect()
+        expected = list(frames(console))
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "live.slp")
+            with open(path, "wb", buffering=0) as file:
+                # The raw length is left at 0 until the game is over
+                file.write(data[:11] + bytes(4))
+                console = melee.Console(
+                    system="file", path=path, follow_file=True, polling_mode=True
+                )
+                self.assertTrue(console.connect())
+                followed = []
+                for start in range(15, len(data), 3001):
+                    file.write(data[start : start + 3001])
+                    followed.extend(frames(console))
+                file.seek(11)
+                file.write(data[11:15])
+                self.assertIsNone(console.step())
+                console.stop()
+        self.assertEqual(followed, expected)
+
+    def test_decode_profile(self):
+        """
+        Only the ports and fields in a decode profile are decoded
+        """
+        path = "test_artifacts/test_game_1.slp"
+        profile = melee.DecodeProfile(ports=[2], fields=["position", "stock"])
+        full = melee.Console(system="file", path=path)
+        full.connect()
+        partial = melee.Console(system="file", path=path, decode_profile=profile)
+        partial.connect()
+        while True:
+            expected, gamestate = full.step(), partial.step()
+            if expected is None:
+                self.assertIsNone(gamestate)
+                break
+            self.assertEqual(gamestate.frame, expected.frame)
+            self.assertEqual(list(gamestate.players), [2])
+            player, expected_player = gamestate.players[2], expected.players[2]
+            self.assertEqual(player.position.x, expected_player.position.x)
+            self.assertEqual(player.stock, expected_player.stock)
+            # Fields not asked for are left at their defaults
+            self.assertEqual(player.percent, 0)
+            self.assertEqual(player.ecb_top, (0, 0))
+
+        replay = melee.replays.read_replay(path, profile=profile)
+        self.assertEqual(list(replay.players), [2])
+        self.assertEqual(replay.players[2].dtype.names, ("x", "y", "stock"))
+
+        # invulnerability_left needs action_frame, which in turn needs character
+        profile = melee.DecodeProfile(fields=["invulnerability_left"])
+        self.assertLessEqual(
+            {"action", "action_frame", "character"}, set(profile.fields)
+        )
+
+        # action_frame isn't fixed up when it wasn't decoded
+        for lazy in (False, True):
+            console = melee.Console(
+                system="file",
+                path=path,
+                lazy=lazy,
+                decode_profile=melee.DecodeProfile(fields=["action", "character"]),
+            )
+            console.connect()
+            while True:
+                gamestate = console.step()
+                if gamestate is None:
+                    break
+                for player in gamestate.players.values():
+                    self.assertEqual(player.action_frame, 0)
+
+        # Every field decodes on its own just as it does in a full decode
+        def values(gamestate, field):
+            if field == "fod_platforms":
+                return gamestate._fod_platform_left, gamestate._fod_platform_right
+            players = []
+            for port, player in sorted(gamestate.players.items()):
+                if field == "position":
+                    value = (player.x, player.y, player.position.x, player.position.y)
+                elif field == "speed":
+                    value = tuple(
+                        getattr(player, name)
+                        for name in melee.decodeprofile.PROFILE_FIELDS["speed"]
+                    )
+                elif field == "ecb":
+                    value = (
+                        player.ecb_top,
+                        player.ecb_bottom,
+                        player.ecb_left,
+                        player.ecb_right,
+                    )
+                elif field == "controller_state":
+                    controller = player.controller_state
+                    value = (
+                        controller.buttons,
+                        controller.main_stick,
+                        controller.c_stick,
+                        controller.raw_main_stick,
+                        controller.l_shoulder,
+                    )
+                else:
+                    value = getattr(player, field)
+                players.append((port, value))
+            return players
+
+        for path, lazy in (
+            ("test_artifacts/test_game_1.slp", False),
+            ("test_artifacts/test_game_1.slp", True),
+            ("test_artifacts/test_game_2.slp", False),
+        ):
+            full = melee.Console(system="file", path=path, allow_old_version=True)
+            full.connect()
+            expected = []
+            while True:
+                gamestate = full.step()
+                if gamestate is None:
+                    break
+                expected.append(gamestate)
+            for field in melee.decodeprofile.PROFILE_FIELDS:
+                partial = melee.Console(
+                    system="file",
+                    path=path,
+                    allow_old_version=True,
+                    lazy=lazy,
+                    decode_profile=melee.DecodeProfile(fields=[field]),
+                )
+                partial.connect()
+                for expected_gamestate in expected:
+                    gamestate = partial.step()
+                    self.assertEqual(
+                        values(gamestate, field),
+                        values(expected_gamestate, field),
+                        (path, lazy, field, gamestate.frame),
+                    )
+                self.assertIsNone(partial.step())
+
+        with self.assertRaises(ValueError):
+            melee.DecodeProfile(fields=["not_a_field"])
+
+    def test_step_async(self):
+        """
+        step_async() waits for a followed file on the event loop, without blocking it
+        """
+        source = "test_artifacts/test_game_1.slp"
+        with open(source, "rb") as file:
+            data = file.read()
+
+        async def write(file):
+            for start in range(15, len(data), 20000):
+                file.write(data[start : start + 20000])
+                await asyncio.sleep(0.001)
+
+        async def read(console):
+            self.assertTrue(await console.connect_async())
+            frames = []
+            while True:
+                gamestate = await console.step_async()
+                if gamestate is None:
+                    return frames
+                frames.append(gamestate.frame)
+
+        async def main(path):
+            with open(path, "wb", buffering=0) as file:
+                file.write(data[:11] + bytes(4))
+                console = melee.Console(system="file", path=path, follow_file=True)
+                frames, _ = await asyncio.gather(read(console), write(file))
+            return frames
+
+        with tempfile.TemporaryDirectory() as directory:
+            frames = asyncio.run(main(os.path.join(directory, "live.slp")))
+        self.assertEqual(len(frames), 1038)
+        self.assertEqual(frames[-1], 914)
+
+    def test_fast_message(self):
+        """
+        Game events are pulled out of Dolphin's JSON messages without parsing them
+        """
+        payload = bytes(range(256))
+        encoded = base64.b64encode(payload).decode()
+        for message in (
+            {"type": "game_event", "payload": encoded},
+            {"cursor": 1, "next_cursor": 2, "payload": encoded, "type": "menu_event"},
+        ):
+            data = json.dumps(message, separators=(",", ":")).encode()
+            fast = melee.slippstream._fast_message(data)
+            self.assertEqual(fast["type"], message["type"])
+            self.assertEqual(fast["payload"], payload)
+        # Anything else is left for json.loads
+        data = b'{"type":"connect_reply","nick":"a","version":"1","cursor":0}'
+        self.assertIsNone(melee.slippstream._fast_message(data))
+
+    def test_event_buffer(self):
+        """
+        Events split across datagrams are put back together before they're handed out
+        """
+        streamer = SLPFileStreamer("test_artifacts/test_game_1.slp")
+        streamer.connect()
+        raw = bytes(streamer._contents)
+
+        def reassemble(buffer, datagram_size):
+            received = []
+            for start in range(0, len(raw), datagram_size):
+                datagram = raw[start : start + datagram_size]
+                buffer.free_space()[: len(datagram)] = datagram
+                message = buffer.received(len(datagram))
+                if message is not None:
+                    self.assertEqual(message["type"], "game_event")
+                    # Every message ends on an event boundary
+                    payload, index = message["payload"], 0
+                    while index < len(payload):
+                        if payload[index] == 0x35:
+                            index += payload[index + 1] + 1
+                        else:
+                            index += buffer.eventsize[payload[index]]
+                    self.assertEqual(index, len(payload))
+                    received.append(message["payload"])
+            self.assertEqual(b"".join(received), raw)
+
+        reassemble(melee.slippstream.EventBuffer(), 1500)
+        # With a buffer only just big enough, partial events get moved to the front
+        #   over the top of where they were
+        buffer = melee.slippstream.EventBuffer(melee.slippstream.MAX_DATAGRAM_SIZE + 64)
+        overlapped = []
+        free_space = buffer.free_space
+
+        def checked_free_space():
+            pending = buffer._end - buffer._start
+            if len(buffer._buffer) - buffer._end < melee.slippstream.MAX_DATAGRAM_SIZE:
+                overlapped.append(0 < buffer._start < pending)
+            return free_space()
+
+        buffer.free_space = checked_free_space
+        reassemble(buffer, 7)
+        self.assertTrue(any(overlapped))
+
+    def test_background_receiver(self):
+        """
+        Frames decoded on a background thread come out of step() in order
+        """
+        path = "test_artifacts/test_game_1.slp"
+
+        def frames(console, delay=0):
+            console.connect()
+            while True:
+                gamestate = console.step()
+                if gamestate is None:
+                    console.stop()
+                    return
+                yield gamestate.frame
+                time.sleep(delay)
+
+        expected = list(frames(melee.Console(system="file", path=path)))
+        console = melee.Console(system="file", path=path, background_receiver=True)
+        self.assertEqual(list(frames(console)), expected)
+        self.assertEqual(console.dropped_frames, 0)
+
+        # A slow bot only sees the newest frames, and the rest are counted as dropped
+        console = melee.Console(
+            system="file",
+            path=path,
+            background_receiver=True,
+            frame_queue_policy="latest",
+        )
+        seen = list(frames(console, delay=0.001))
+        self.assertEqual(seen, sorted(seen))
+        self.assertEqual(len(seen) + console.dropped_frames, len(expected))
+
+    def test_catch_up(self):
+        """
+        Catch-up mode jumps straight to the newest frame, and keeps the helpers that
+        depend on earlier frames right
+        """
+        source = "test_artifacts/test_game_1.slp"
+        with open(source, "rb") as file:
+            data = file.read()
+
+        def summary(gamestate):
+            return [
+                (
+                    player.x,
+                    player.action,
+                    player.percent,
+                    player.invulnerability_left,
+                    player.moonwalkwarning,
+                )
+                for _, player in sorted(gamestate.players.items())
+            ]
+
+        console = melee.Console(system="file", path=source)
+        console.connect()
+        expected = {}
+        while True:
+            gamestate = console.step()
+            if gamestate is None:
+                break
+            expected[gamestate.frame] = summary(gamestate)
+
+        # All of a file has already arrived, so the first step is the last frame
+        console = melee.Console(system="file", path=source, catch_up=True)
+        console.connect()
+        gamestate = console.step()
+        self.assertEqual(summary(gamestate), expected[max(expected)])
+        self.assertEqual(console.skipped_frames, len(expected) - 1)
+        self.assertIsNone(console.step())
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "live.slp")
+            with open(path, "wb", buffering=0) as file:
+                file.write(data[:11] + bytes(4))
+                console = melee.Console(
+                    system="file",
+                    path=path,
+                    follow_file=True,
+                    polling_mode=True,
+                    catch_up=True,
+                )
+                self.assertTrue(console.connect())
+                seen = []
+                for start in range(15, len(data), 30001):
+                    file.write(data[start : start + 30001])
+                    gamestate = console.step()
+                    if gamestate is not None:
+                        self.assertEqual(summary(gamestate), expected[gamestate.frame])
+                        seen.append(gamestate.frame)
+                self.assertIsNone(console.step())
+                console.stop()
+        self.assertEqual(seen, sorted(seen))
+        self.assertEqual(len(seen) + console.skipped_frames, len(expected))
+
+        # Old replays have no bookends, and end frames with frame_end messages
+        source = "test_artifacts/test_game_2.slp"
+        console = melee.Console(system="file", path=source, allow_old_version=True)
+        console.connect()
+        expected = []
+        while True:
+            gamestate = console.step()
+            if gamestate is None:
+                break
+            expected.append((gamestate.frame, summary(gamestate)))
+        console = melee.Console(
+            system="file", path=source, allow_old_version=True, catch_up=True
+        )
+        console.connect()
+        gamestate = console.step()
+        self.assertEqual((gamestate.frame, summary(gamestate)), expected[-1])
+        self.assertEqual(console.skipped_frames, len(expected) - 1)
+        self.assertIsNone(console.step())
+
+    def test_console_pool(self):
+        """
+        A pool steps several consoles from one loop, one frame per console per step
+        """
+        path = "test_artifacts/test_game_1.slp"
+        servers = [
+            melee.replayserver.ReplayServer(path, port=port, speed=None)
+            for port in (51561, 51562, 51563)
+        ]
+        for server in servers:
+            server.start()
+        pool = melee.ConsolePool(
+            3, slippi_port=51561, path=None, tmp_home_directory=False
+        )
+        try:
+            self.assertTrue(pool.connect())
+            frames = {index: [] for index in range(len(pool))}
+            while len(frames[0]) < 1038 or len(frames[2]) < 1038:
+                batch = pool.step(timeout=10, min_frames=None)
+                self.assertEqual(len(batch), 3)
+                for index, gamestate in batch.items():
+                    frames[index].append(gamestate.frame)
+            self.assertEqual(frames[0], frames[1])
+            self.assertEqual(frames[0], frames[2])
+            self.assertEqual(frames[0][-1], 914)
+        finally:
+            pool.stop()
+            for server in servers:
+                server.stop()
+
+    def test_replay_server(self):
+        """
+        The stand-in Slippstream server plays a replay to a Console over the network
+        """
+        path = "test_artifacts/test_game_1.slp"
+
+        def frames(console, count):
+            for _ in range(count):
+                gamestate = console.step()
+                yield gamestate.frame, gamestate.players[1].x, gamestate.players[2].x
+
+        console = melee.Console(system="file", path=path)
+        console.connect()
+        expected = list(frames(console, 1038))
+
+        # A perfect connection gets every frame, just like reading the file
+        server = melee.replayserver.ReplayServer(path, port=51571, speed=None)
+        server.start()
+        console = melee.Console(
+            system="dolphin", path=None, slippi_port=51571, tmp_home_directory=False
+        )
+        try:
+            self.assertTrue(console.connect())
+            self.assertEqual(list(frames(console, 1038)), expected)
+            self.assertEqual(console.nick, "ReplayServer")
+        finally:
+            server.stop()
+
+        # A bad one loses some, and duplicates are ignored
+        server = melee.replayserver.ReplayServer(
+            path, port=51572, speed=None, drop_rate=0.1, duplicate_rate=0.1, seed=1
+        )
+        self.assertGreater(server.dropped_frames, 0)
+        self.assertGreater(server.duplicated_frames, 0)
+        server.start()
+        console = melee.Console(
+            system="dolphin", path=None, slippi_port=51572, tmp_home_directory=False
+        )
+        try:
+            self.assertTrue(console.connect())
+            received = [frame for frame, _, _ in frames(console, 900)]
+        finally:
+            server.stop()
+        self.assertEqual(received, sorted(set(received)))
+        self.assertTrue(set(received) <= set(server.frame_offsets))
+
+        # Stopping partway through doesn't send the rest of the replay
+        server = melee.replayserver.ReplayServer(path, port=51573, speed=1)
+        sent = []
+        send = server._send
+
+        def counted_send(peer, message):
+            sent.append(message["cursor"])
+            send(peer, message)
+
+        server._send = counted_send
+        thread = threading.Thread(target=server.serve)
+        thread.start()
+        console = melee.Console(
+            system="dolphin", path=None, slippi_port=51573, tmp_home_directory=False
+        )
+        try:
+            self.assertTrue(console.connect())
+            list(frames(console, 10))
+        finally:
+            server._stop_event.set()
+            thread.join()
+        self.assertLess(len(sent), len(server._plan) / 2)
+
+    def test_capture(self):
+        """
+        A capture of a live session plays back exactly, flat out or in real time
+        """
+        path = "test_artifacts/test_game_1.slp"
+
+        def frames(console):
+            while True:
+                gamestate = console.step()
+                if gamestate is None or gamestate.frame == 914:
+                    return
+                yield gamestate.frame, gamestate.players[1].x, gamestate.players[2].x
+
+        server = melee.replayserver.ReplayServer(path, port=51581, speed=8)
+        server.start()
+        with tempfile.TemporaryDirectory() as directory:
+            capture = os.path.join(directory, "session.slpcap")
+            console = melee.Console(
+                system="dolphin",
+                path=None,
+                slippi_port=51581,
+                tmp_home_directory=False,
+                capture_path=capture,
+            )
+            try:
+                self.assertTrue(console.connect())
+                live = list(frames(console))
+            finally:
+                server.stop()
+                console.stop()
+
+            messages = list(melee.capture.read_capture(capture))
+            self.assertEqual(messages[0][1]["type"], "connect_reply")
+            duration = messages[-1][0] - messages[0][0]
+
+            console = melee.Console(system="capture", path=capture)
+            self.assertTrue(console.connect())
+            self.assertEqual(list(frames(console)), live)
+            self.assertEqual(console.nick, "ReplayServer")
+
+            console = melee.Console(
+                system="capture", path=capture, capture_realtime=True
+            )
+            self.assertTrue(console.connect())
+            start = time.perf_counter()
+            self.assertEqual(list(frames(console)), live)
+            self.assertGreater(time.perf_counter() - start, duration * 0.9)
+
+            # Old replays without frame bookends have frame_end messages too
+
+            def old_frames(console):
+                while True:
+                    gamestate = console.step()
+                    if gamestate is None:
+                        return
+                    players = gamestate.players
+                    yield gamestate.frame, players[2].x, players[3].x
+
+            old_capture = os.path.join(directory, "old.slpcap")
+            path = "test_artifacts/test_game_2.slp"
+            console = melee.Console(
+                system="file",
+                path=path,
+                allow_old_version=True,
+                capture_path=old_capture,
+            )
+            self.assertTrue(console.connect())
+            recorded = list(old_frames(console))
+            console.stop()
+            self.assertGreater(len(recorded), 0)
+            console = melee.Console(
+                system="capture", path=old_capture, allow_old_version=True
+            )
+            self.assertTrue(console.connect())
+            self.assertEqual(list(old_frames(console)), recorded)
+
+    def test_stats(self):
+        """
+        Console stats time each stage of every frame
+        """
+        path = "test_artifacts/test_game_1.slp"
+        console = melee.Console(system="file", path=path)
+        self.assertIsNone(console.stats)
+
+        console = melee.Console(system="file", path=path, stats=True)
+        console.connect()
+        frames = 0
+        while console.step() is not None:
+            frames += 1
+        stats = console.stats
+        self.assertEqual(stats.frames, frames)
+        self.assertEqual(len(stats.samples()), min(frames, stats.window))
+        percentiles = stats.percentiles((50, 99))
+        self.assertGreater(percentiles["pre_frame"][0], 0)
+        self.assertGreater(percentiles["post_frame"][0], 0)
+        self.assertEqual(percentiles["decode"], (0, 0))
+        self.assertLessEqual(percentiles["total"][0], percentiles["total"][1])
+        counts, _ = stats.histogram("wait", bins=10)
+        self.assertEqual(counts.sum(), min(frames, stats.window))
+
+        with self.assertRaises(ValueError):
+            melee.Console(
+                system="file", path=path, stats=True, background_receiver=True
+            )
+
+        # Only the most recent frames are kept
+        stats = melee.stepstats.StepStats(window=10)
+        for frame in range(25):
+            stats.add(stats.index("wait"), frame)
+            stats.end_frame()
+        self.assertEqual(list(stats.samples("wait")), list(range(15, 25)))
+
+    def test_shared_frames(self):
+        """
+        Frames published to shared memory can be read back by sequence number
+        """
+        console = melee.Console(
+            system="file", path="test_artifacts/test_game_1.slp", publish=True
+        )
+        console.connect()
+        subscriber = melee.sharedframes.FrameSubscriber(console.publisher.name)
+        self.assertEqual(subscriber.head, -1)
+        self.assertEqual(subscriber.latest(), (-1, None))
+        sequence = -1
+        while True:
+            gamestate = console.step()
+            if gamestate is None:
+                break
+            sequence += 1
+            if gamestate.frame == 100:
+                record = subscriber.read(sequence)
+                player = gamestate.players[1]
+                self.assertEqual(record["frame"], 100)
+                self.assertEqual(record["stage"], gamestate.stage.value)
+                self.assertTrue(record["players"][0]["present"])
+                self.assertEqual(record["players"][0]["action"], player.action.value)
+                self.assertAlmostEqual(
+                    record["players"][0]["x"], player.position.x, places=4
+                )
+                self.assertFalse(record["players"][2]["present"])
+        self.assertEqual(subscriber.head, sequence)
+        self.assertEqual(subscriber.latest()[0], sequence)
+        # Older frames have been overwritten by now
+        self.assertIsNone(subscriber.read(0))
+        subscriber.close()
+        console.stop()
+
+        publisher = melee.sharedframes.FramePublisher(slots=2)
+        subscriber = melee.sharedframes.FrameSubscriber(publisher.name)
+        for frame in range(3):
+            gamestate = melee.GameState()
+            gamestate.frame = frame
+            publisher.publish(gamestate)
+        self.assertIsNone(subscriber.read(0))
+        self.assertEqual(subscriber.read(1)["frame"], 1)
+        self.assertEqual(subscriber.wait(2, timeout=0)["frame"], 2)
+        self.assertIsNone(subscriber.wait(3, timeout=0.01))
+        subscriber.close()
+        publisher.close()
+
+        # Without shared memory (before Python 3.8), only publishing fails
+        shared_memory = melee.sharedframes.shared_memory
+        melee.sharedframes.shared_memory = None
+        try:
+            melee.Console(system="file", path="test_artifacts/test_game_1.slp")
+            with self.assertRaises(RuntimeError):
+                melee.Console(
+                    system="file", path="test_artifacts/test_game_1.slp", publish=True
+                )
+        finally:
+            melee.sharedframes.shared_memory = shared_memory
+
+        # Only the frames step() returns are published, even when a background
+        #   receiver is decoding ahead of it
+        console = melee.Console(
+            system="file",
+            path="test_artifacts/test_game_1.slp",
+            publish=True,
+            background_receiver=True,
+            frame_queue_policy="latest",
+        )
+        console.connect()
+        subscriber = melee.sharedframes.FrameSubscriber(console.publisher.name)
+        sequence = -1
+        while True:
+            gamestate = console.step()
+            if gamestate is None:
+                break
+            sequence += 1
+            self.assertEqual(subscriber.head, sequence)
+            self.assertEqual(subscriber.read(sequence)["frame"], gamestate.frame)
+        subscriber.close()
+        console.stop()
+
+    def test_reuse_gamestates(self):
+        """
+        Reused gamestates decode the same as new ones, and copies survive reuse
+        """
+        path = "test_artifacts/test_game_1.slp"
+        console = melee.Console(system="file", path=path)
+        console.connect()
+        fresh = []
+        while True:
+            gamestate = console.step()
+            if gamestate is None:
+                break
+            fresh.append(gamestate)
+
+        console = melee.Console(system="file", path=path, reuse_gamestates=2)
+        console.connect()
+        first = console.step()
+        kept = first.copy()
+        second = console.step()
+        self.assertIsNot(first, second)
+        self.assertIs(console.step(), first)
+        # The copy still has the first frame, even though that gamestate hasn't
+        self.assertEqual(kept.frame, fresh[0].frame)
+        self.assertNotEqual(first.frame, fresh[0].frame)
+        self.assertIsNot(kept.players[1], first.players[1])
+        self.assertIsNot(kept.players[1].position, first.players[1].position)
+
+        for expected in fresh[3:]:
+            gamestate = console.step()
+            self.assertEqual(gamestate.frame, expected.frame)
+            self.assertEqual(len(gamestate.projectiles), len(expected.projectiles))
+            self.assertEqual(gamestate.players.keys(), expected.players.keys())
+            for port, player in gamestate.players.items():
+                other = expected.players[port]
+                self.assertEqual(player.action, other.action)
+                self.assertEqual(player.position, other.position)
+                self.assertEqual(player.ecb, other.ecb)
+                self.assertEqual(player.percent, other.percent)
+                self.assertEqual(
+                    player.invulnerability_left, other.invulnerability_left
+                )
+                self.assertEqual(player.moonwalkwarning, other.moonwalkwarning)
+                self.assertEqual(
+                    player.controller_state.button,
+                    other.controller_state.button,
+                )
+        self.assertIsNone(console.step())
+
+        # Options reuse can't be combined with
+        for options in (
+            {"reuse_gamestates": 1},
+            {"reuse_gamestates": 2, "lazy": True},
+            {"reuse_gamestates": 2, "background_receiver": True},
+        ):
+            with self.assertRaises(ValueError):
+                melee.Console(system="file", path=path, **options)
+
+    def test_controller_state(self):
+        """
+        Controller buttons are one button word, that also works like a dict
+        """
+        state = melee.ControllerState()
+        self.assertEqual(state.buttons, 0)
+        self.assertEqual(len(state.button), 12)
+        self.assertFalse(any(state.button.values()))
+        state.button[melee.Button.BUTTON_A] = True
+        state.button[melee.Button.BUTTON_D_UP] = True
+        self.assertEqual(state.buttons, 0x0108)
+        self.assertTrue(state.button[melee.Button.BUTTON_A])
+        state.button[melee.Button.BUTTON_A] = False
+        self.assertEqual(state.buttons, 0x0008)
+        self.assertEqual(
+            dict(state.button),
+            {
+                button: button == melee.Button.BUTTON_D_UP
+                for button in melee.controller.BUTTON_BITS
+            },
+        )
+        with self.assertRaises(KeyError):
+            state.button[melee.Button.BUTTON_MAIN]
+
+        # The D-pad isn't sent
+        state.button[melee.Button.BUTTON_B] = True
+        state.main_stick = (1, 0)
+        state.l_shoulder = 1
+        self.assertEqual(state.toBytes(), bytes([0x02, 0x80, 255, 1, 128, 128, 255, 0]))
+
+        copy = state.copy()
+        copy.button[melee.Button.BUTTON_B] = False
+        self.assertTrue(state.button[melee.Button.BUTTON_B])
+
+        console = melee.Console(system="file", path="test_artifacts/test_game_1.slp")
+        console.connect()
+        pressed = set()
+        while True:
+            gamestate = console.step()
+            if gamestate is None:
+                break
+            for player in gamestate.players.values():
+                for button, down in player.controller_state.button.items():
+                    if down:
+                        pressed.add(button)
+        self.assertIn(melee.Button.BUTTON_A, pressed)
+
+    def test_observation(self):
+        """
+        GameStates flatten into vectors laid out by an observation schema
+        """
+        console = melee.Console(system="file", path="test_artifacts/test_game_1.slp")
+        console.connect()
+        gamestates = []
+        while True:
+            gamestate = console.step()
+            if gamestate is None:
+                break
+            gamestates.append(gamestate)
+
+        schema = melee.observation.DEFAULT_SCHEMA
+        self.assertEqual(schema.version, melee.observation.OBSERVATION_VERSION)
+        self.assertEqual(len(schema.columns), schema.size)
+        gamestate = gamestates[500]
+        player = gamestate.players[1]
+        vector = gamestate.to_array()
+        self.assertEqual(vector.shape, (schema.size,))
+        self.assertEqual(vector[schema.index("frame")], gamestate.frame)
+        self.assertEqual(vector[schema.index("p1_present")], 1)
+        self.assertEqual(vector[schema.index("p1_action")], player.action.value)
+        self.assertEqual(vector[schema.index("p1_percent")], player.percent)
+        self.assertAlmostEqual(
+            vector[schema.index("p1_main_stick_x")],
+            player.controller_state.main_stick[0],
+            places=5,
+        )
+        # Nobody on port 3, so it's all zeros
+        start = schema.index("p3_present")
+        end = start + len(melee.observation.PLAYER_FEATURES)
+        self.assertFalse(vector[start:end].any())
+
+        batch = schema.fill_batch(gamestates)
+        self.assertEqual(batch.shape, (len(gamestates), schema.size))
+        self.assertTrue((batch[500] == vector).all())
+
+        schema = melee.observation.ObservationSchema(
+            ports=(2, 1), nana=False, projectiles=0
+        )
+        self.assertEqual(schema.columns[3], "p2_present")
+        out = np.full(schema.size, np.nan, dtype=np.float32)
+        self.assertIs(gamestate.to_array(schema, out=out), out)
+        self.assertAlmostEqual(out[schema.index("p1_y")], player.position.y, places=4)
+        with self.assertRaises(ValueError):
+            gamestate.to_array(schema, out=np.zeros(schema.size))
+
+    def test_lazy(self):
+        """
+        Lazy gamestates hold the same values as eagerly decoded ones
+        """
+        path = "test_artifacts/test_game_2.slp"
+        console = melee.Console(system="file", path=path, allow_old_version=True)
+        console.connect()
+        lazy_console = melee.Console(
+            system="file", path=path, allow_old_version=True, lazy=True
+        )
+        lazy_console.connect()
+        names = [
+            name for name in melee.PlayerState.__slots__ if name != "controller_state"
+        ]
+        while True:
+            gamestate = console.step()
+            lazy = lazy_console.step()
+            if gamestate is None:
+                self.assertIsNone(lazy)
+                break
+            self.assertIsInstance(lazy, melee.lazystate.LazyGameState)
+            last = lazy
+            self.assertEqual(lazy.frame, gamestate.frame)
+            self.assertEqual(lazy.distance, gamestate.distance)
+            self.assertEqual(lazy.players.keys(), gamestate.players.keys())
+            for port, player in gamestate.players.items():
+                lazy_player = lazy.players[port]
+                for name in names:
+                    self.assertEqual(
+                        getattr(lazy_player, name), getattr(player, name), name
+                    )
+                self.assertEqual(
+                    lazy_player.controller_state.buttons,
+                    player.controller_state.buttons,
+                )
+                self.assertEqual(
+                    lazy_player.controller_state.main_stick,
+                    player.controller_state.main_stick,
+                )
+
+        # Copies are ordinary gamestates
+        copy = last.copy()
+        self.assertIs(type(copy), melee.GameState)
+        self.assertIs(type(copy.players[2]), melee.PlayerState)
+        self.assertEqual(copy.players[2].position, last.players[2].position)
+        # As are pickles
+        unpickled = pickle.loads(pickle.dumps(last))
+        self.assertIs(type(unpickled.players[2]), melee.PlayerState)
+        self.assertEqual(unpickled.distance, last.distance)
+
+    def test_history(self):
+        """
+        The console's history holds the last frames it returned, oldest first
+        """
+        console = melee.Console(
+            system="file", path="test_artifacts/test_game_1.slp", history=30
+        )
+        console.connect()
+        history = console.history
+        self.assertEqual(len(history), 0)
+        self.assertEqual(len(history.positions(1)), 0)
+        self.assertIsNone(history.frames_since_change(1))
+        gamestates = []
+        while True:
+            gamestate = console.step()
+            if gamestate is None:
+                break
+            gamestates.append(gamestate)
+            if len(gamestates) in (10, 100):
+                # Both before and after the history has wrapped around
+                recent = gamestates[-30:]
+                self.assertEqual(len(history), len(recent))
+                self.assertEqual(
+                    list(history.frames()), [state.frame for state in recent]
+                )
+                self.assertEqual(
+                    list(history.window(1, "action", 5)),
+                    [state.players[1].action.value for state in recent[-5:]],
+                )
+                np.testing.assert_allclose(
+                    history.positions(2),
+                    [(state.players[2].x, state.players[2].y) for state in recent],
+                )
+                self.assertEqual(
+                    list(history.window(2, "buttons")),
+                    [state.players[2].controller_state.buttons for state in recent],
+                )
+                self.assertEqual(
+                    history.window(None, "present").shape, (4, len(recent))
+                )
+                self.assertFalse(history.window(3, "present").any())
+                # How long since the action last changed, the slow way
+                actions = [state.players[1].action for state in recent]
+                since = None
+                for back in range(1, len(actions)):
+                    if actions[-1 - back] != actions[-1]:
+                        since = back - 1
+                        break
+                self.assertEqual(history.frames_since_change(1), since)
+        self.assertEqual(history.count, len(gamestates))
+        self.assertEqual(history.velocities(1, 2).shape, (1, 2))
+
+        # Seeking starts the history over
+        console.seek(50)
+        self.assertEqual(len(history), 0)
+        self.assertFalse(history._players["present"].any())
+        self.assertFalse(history._frames.any())
+        console.step()
+        self.assertEqual(list(history.frames()), [50])
+        console.stop()
+
+        # With a background receiver running ahead, the history still only has the
+        #   frames step() returned
+        for policy in ("block", "latest"):
+            console = melee.Console(
+                system="file",
+                path="test_artifacts/test_game_1.slp",
+                history=30,
+                background_receiver=True,
+                frame_queue_policy=policy,
+            )
+            console.connect()
+            returned = []
+            while True:
+                gamestate = console.step()
+                if gamestate is None:
+                    break
+                returned.append(gamestate.frame)
+                self.assertEqual(list(console.history.frames()), returned[-30:], policy)
+            console.stop()
+
     def test_framedata(self):
         """
         Test that frame and stage data retreive correctly
@@ -95,6 +1256,26 @@ class SLPFile(unittest.TestCase):
         )
         self.assertFalse(console.connect())
 
+        # An event the replay never gave a size for ends the game, rather than
+        #   being stepped over forever
+        with open("test_artifacts/test_game_1.slp", "rb") as file:
+            data = file.read()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "garbage.slp")
+            # Start the first frame, after PAYLOADS and GAME_START, with garbage
+            eventsize = [0] * 0x100
+            start = melee.slpfilestreamer.RAW_START
+            offset = start + melee.slpfilestreamer.read_payload_sizes(
+                data, start, eventsize
+            )
+            offset += eventsize[melee.slippstream.EventType.GAME_START.value]
+            with open(path, "wb") as file:
+                file.write(data[:offset] + b"\x99" * 64 + data[offset + 64 :])
+            console = melee.Console(system="file", path=path)
+            self.assertTrue(console.connect())
+            self.assertIsNone(console.step())
+            console.stop()
+
 
 if __name__ == "__main__":
     unittest.main()